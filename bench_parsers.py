@@ -0,0 +1,288 @@
+"""
+Офлайн-бенчмарк и проверка точности парсеров на сохраненных HTML-страницах.
+
+Страницы лежат в fixtures/html/<площадка>/, ожидаемые значения полей - в
+fixtures/html/cases.json. Браузер получает страницы через перехват запросов,
+все остальные запросы обрываются - в сеть бенчмарк не ходит.
+
+Покрывает get_etender_details, get_xarid_details, список Etender, карточки
+Xarid.uz и IT-Market, parse_price_to_number. Печатает точность по каждому полю
+и время на лот: "page" - вызов с браузером целиком, "extract" - только разбор
+текста (горячий путь, по нему и ловим регрессии).
+
+Запуск:
+    python bench_parsers.py                  # отчет + сравнение с bench_baseline.json
+    python bench_parsers.py --save-baseline  # записать текущий прогон как эталон
+    python bench_parsers.py --repeat 500 --tolerance 0.3
+    python bench_parsers.py --ci             # в CI: без эталона - ошибка, а не "сравнивать не с чем"
+    python bench_parsers.py --no-browser     # только группы без Chromium (цены)
+
+Код выхода 1:
+- любое поле не совпало с cases.json, кроме перечисленных в его "known_misses"
+  ("<группа>/<фикстура> <поле>", как в списке расхождений) - с эталоном или без;
+- точность упала или "extract" стал медленнее эталона больше чем на tolerance;
+- (с --ci либо переменной CI) эталона bench_baseline.json нет.
+Эталон снимается на тех же фикстурах (--save-baseline); с --no-browser в эталоне
+обновляются только замеренные ключи, остальные остаются как были.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+# main создает Bot при импорте - токен нужен только по формату, в сеть никто не ходит
+os.environ.setdefault("BOT_TOKEN", "0:offline")
+# Фикстуры отдаются локально - темп запросов (AdaptiveLimiter) не нужен и искажал бы время "page"
+os.environ.setdefault("CRAWL_START_INTERVAL", "0")
+os.environ.setdefault("CRAWL_MIN_INTERVAL", "0")
+
+from playwright.async_api import async_playwright
+
+import main
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(ROOT, "fixtures", "html")
+BASELINE_PATH = os.path.join(ROOT, "bench_baseline.json")
+
+def load_cases():
+    with open(os.path.join(FIXTURES_DIR, "cases.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+def time_call(func, *args, repeat=200, rounds=5):
+    """Лучшее из rounds среднее время одного вызова, мс (как timeit)."""
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(repeat): func(*args)
+        elapsed = (time.perf_counter() - started) * 1000 / repeat
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+class Report:
+    def __init__(self, known_misses=()):
+        self.fields = {}   # "группа.поле" -> [верно, всего]
+        self.timings = {}  # "группа/фикстура:вид" -> мс
+        self.misses = []
+        self.known_misses = set(known_misses)
+        self.unexpected = []  # Расхождения не из known_misses - из-за них код выхода 1
+        self.fixed = set()    # known_misses, которые теперь совпали - пора убрать из cases.json
+
+    def check(self, group, field, got, expected, where):
+        hit = self.fields.setdefault(f"{group}.{field}", [0, 0])
+        hit[1] += 1
+        key = f"{where} {field}"
+        if got == expected:
+            hit[0] += 1
+            if key in self.known_misses: self.fixed.add(key)
+            return
+        miss = f"{key}: ожидали {expected!r}, получили {got!r}"
+        self.misses.append(miss)
+        if key not in self.known_misses: self.unexpected.append(miss)
+
+    def accuracy(self):
+        return {key: round(ok / total, 4) for key, (ok, total) in sorted(self.fields.items())}
+
+    def as_dict(self):
+        return {"accuracy": self.accuracy(), "timings_ms": {k: round(v, 4) for k, v in sorted(self.timings.items())}}
+
+async def serve_fixtures(context, pages):
+    """Все запросы контекста: известный URL -> фикстура, остальное -> abort."""
+    async def handler(route):
+        url = route.request.url.split("#")[0]
+        if url in pages: await route.fulfill(status=200, content_type="text/html; charset=utf-8", body=pages[url])
+        else: await route.abort()
+    await context.route("**/*", handler)
+
+async def bench_etender_details(page, cases, report, args):
+    for case in cases:
+        where = f"etender_details/{case['fixture']}"
+        started = time.perf_counter()
+        await page.goto(case["url"], wait_until="domcontentloaded")
+        try: await page.wait_for_selector(main.ETENDER_DETAIL_READY, timeout=5000)
+        except Exception as e: main.record_error("bench", "detail_wait", e)
+        data = await main.get_etender_details(page, case["url"])
+        report.timings[f"{where}:page"] = (time.perf_counter() - started) * 1000
+        for field, expected in case["expected"].items():
+            report.check("etender_details", field, data.get(field), expected, where)
+        clean_text = " ".join((await page.inner_text("body")).split())
+        report.timings[f"{where}:extract"] = time_call(lambda: main.extract_etender_fields(clean_text, {}), repeat=args.repeat)
+
+async def bench_etender_listing(page, cases, report, args):
+    for case in cases:
+        where = f"etender_listing/{case['fixture']}"
+        await page.goto(case["url"], wait_until="domcontentloaded")
+        started = time.perf_counter()
+        links = await main.etender_listing_links(page)
+        report.timings[f"{where}:page"] = (time.perf_counter() - started) * 1000
+        report.check("etender_listing", "links", links, case["expected"], where)
+
+async def bench_xarid_details(page, cases, report, args):
+    for case in cases:
+        where = f"xarid_details/{case['fixture']}"
+        started = time.perf_counter()
+        data = await main.get_xarid_details(page, case["url"])
+        report.timings[f"{where}:page"] = (time.perf_counter() - started) * 1000
+        for field, expected in case["expected"].items():
+            report.check("xarid_details", field, data.get(field), expected, where)
+        raw_text = await page.inner_text("body")
+        report.timings[f"{where}:extract"] = time_call(lambda: main.extract_xarid_fields(raw_text, {}), repeat=args.repeat)
+
+def xarid_card_fields(full_text):
+    """То, что parse_xarid_uz/process_xarid_lot берут из карточки списка."""
+    lot_id, _ = main.xarid_lot_from_card(full_text)
+    candidate, reason = main.xarid_candidate_from_card(full_text)
+    fields = {"lot_id": str(lot_id) if lot_id else None, "status": reason or "ok"}
+    if candidate:
+        _, clean_text, _, _, current_price_raw, start_price_num, _ = candidate
+        fields["start_price"] = start_price_num
+        fields["current_price"] = main.parse_price_to_number(current_price_raw) if current_price_raw and current_price_raw.count('.') < 2 else 0.0
+        fields["region"] = main.REGION_MATCHER.first(clean_text, "Не указан")
+    return fields
+
+async def bench_xarid_cards(page, cases, report, args):
+    for case in cases:
+        where = f"xarid_cards/{case['fixture']}"
+        await page.goto(case["url"], wait_until="domcontentloaded")
+        card_texts = await page.locator(".lot-item").all_inner_texts()
+        for i, expected in enumerate(case["expected"]):
+            got = xarid_card_fields(card_texts[i]) if i < len(card_texts) else {}
+            for field, value in expected.items():
+                report.check("xarid_cards", field, got.get(field), value, f"{where}#{i + 1}")
+        if card_texts:
+            report.timings[f"{where}:extract"] = time_call(lambda: [xarid_card_fields(t) for t in card_texts], repeat=args.repeat) / len(card_texts)
+
+async def bench_it_market_cards(page, cases, report, args):
+    for case in cases:
+        where = f"it_market_cards/{case['fixture']}"
+        await page.goto(case["url"], wait_until="domcontentloaded")
+        cards = page.locator(".animated-card")
+        parsed = []
+        for i in range(await cards.count()):
+            card = cards.nth(i)
+            href = await card.locator(".stretched-link").get_attribute("href")
+            parsed.append((f"https://it-market.uz{href}", await card.inner_text()))
+        for i, expected in enumerate(case["expected"]):
+            link, text = parsed[i] if i < len(parsed) else (None, "")
+            fields = main.parse_it_market_card(text)
+            report.check("it_market_cards", "link", link, expected["link"], f"{where}#{i + 1}")
+            if expected.get("skip"):
+                report.check("it_market_cards", "skip", fields is None, True, f"{where}#{i + 1}")
+                continue
+            for field in ("company", "status", "title", "price"):
+                report.check("it_market_cards", field, (fields or {}).get(field), expected[field], f"{where}#{i + 1}")
+        texts = [text for _, text in parsed]
+        if texts:
+            report.timings[f"{where}:extract"] = time_call(lambda: [main.parse_it_market_card(t) for t in texts], repeat=args.repeat) / len(texts)
+
+def bench_prices(cases, report, args):
+    for raw, expected in cases:
+        report.check("prices", "value", main.parse_price_to_number(raw), expected, f"prices {raw!r}")
+    raws = [raw for raw, _ in cases]
+    report.timings["prices:extract"] = time_call(lambda: [main.parse_price_to_number(r) for r in raws], repeat=args.repeat) / len(raws)
+
+async def run(args):
+    cases = load_cases()
+    report = Report(cases.get("known_misses", []))
+    bench_prices(cases.get("prices", []), report, args)
+    if args.no_browser:
+        print("ℹ️ --no-browser: группы со страницами (Etender, Xarid, IT-Market) пропущены")
+        return report
+    pages = {}
+    for group in ("etender_details", "etender_listing", "xarid_details", "xarid_cards", "it_market_cards"):
+        for case in cases.get(group, []): pages[case["url"]] = read_fixture(case["fixture"])
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        try:
+            context = await browser.new_context()
+            await serve_fixtures(context, pages)
+            page = await context.new_page()
+            await bench_etender_details(page, cases.get("etender_details", []), report, args)
+            await bench_etender_listing(page, cases.get("etender_listing", []), report, args)
+            await bench_xarid_details(page, cases.get("xarid_details", []), report, args)
+            await bench_xarid_cards(page, cases.get("xarid_cards", []), report, args)
+            await bench_it_market_cards(page, cases.get("it_market_cards", []), report, args)
+            await context.close()
+        finally:
+            await browser.close()
+    return report
+
+def compare(current, baseline, tolerance):
+    """Строки отчета и список регрессий относительно эталона."""
+    lines, regressions = [], []
+    for key, value in current["accuracy"].items():
+        old = baseline.get("accuracy", {}).get(key)
+        mark = "" if old is None else f"  (эталон {old:.0%})"
+        if old is not None and value < old:
+            mark += "  ⬇️"; regressions.append(f"точность {key}: {old:.0%} -> {value:.0%}")
+        lines.append(f"  {key:<32} {value:>6.0%}{mark}")
+    lines.append("")
+    for key, value in current["timings_ms"].items():
+        old = baseline.get("timings_ms", {}).get(key)
+        mark = ""
+        if old:
+            delta = value / old - 1
+            mark = f"  ({delta:+.0%})"
+            # Браузерные тайминги шумят - в регрессии идет только разбор текста
+            if key.endswith(":extract") and delta > tolerance:
+                mark += "  ⬇️"; regressions.append(f"время {key}: {old:.3f} -> {value:.3f} мс")
+        lines.append(f"  {key:<52} {value:>9.3f} мс{mark}")
+    return lines, regressions
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк парсеров на HTML-фикстурах")
+    parser.add_argument("--repeat", type=int, default=200, help="вызовов на замер разбора текста")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="допустимое замедление extract относительно эталона (0.5 = +50%%)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--ci", action="store_true", default=bool(os.getenv("CI")), help="без эталона - код выхода 1")
+    parser.add_argument("--no-browser", action="store_true", help="только группы без Chromium")
+    args = parser.parse_args()
+    if args.ci and not args.save_baseline and not os.path.exists(args.baseline):
+        # Иначе прогон без эталона "зеленый" и регрессии молча проходят
+        print(f"❌ Нет эталона {args.baseline} - снимите его: python bench_parsers.py --save-baseline")
+        return 1
+
+    report = asyncio.run(run(args))
+    current = report.as_dict()
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f: baseline = json.load(f)
+
+    lines, regressions = compare(current, baseline, args.tolerance)
+    print("📊 Точность по полям:")
+    print("\n".join(lines))
+    if report.misses:
+        print("\n❌ Расхождения:")
+        for miss in report.misses: print(f"  {miss}{'' if miss in report.unexpected else '  (known_misses)'}")
+    for key in sorted(report.fixed): print(f"ℹ️ Уже совпадает, уберите из known_misses: {key}")
+    if report.unexpected:
+        # Точность проверяем по cases.json всегда: эталон ловит только дрейф, а не ошибку с самого начала
+        print(f"\n❌ {len(report.unexpected)} полей не совпали с fixtures/html/cases.json")
+        return 1
+
+    if args.save_baseline:
+        if args.no_browser:
+            # Браузерные группы не мерили - их ключи в эталоне не трогаем
+            for section in ("accuracy", "timings_ms"): current[section] = {**baseline.get(section, {}), **current[section]}
+        with open(args.baseline, "w", encoding="utf-8") as f: json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Эталон сохранен: {args.baseline}")
+        return 0
+    if not baseline:
+        print("\nℹ️ Эталона нет - запустите с --save-baseline")
+        return 0
+    if regressions:
+        print("\n⚠️ Регрессии:")
+        for r in regressions: print(f"  {r}")
+        return 1
+    print("\n✅ Без регрессий относительно эталона")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -1,17 +1,34 @@
 import asyncio
+import contextlib
+import hashlib
+import html
+import json
 import logging
 import os
 import re
+import signal
+import socket
 import sys
-import psycopg2
+import threading
+import time
+import aiohttp
+import asyncpg
 import gspread
-from datetime import datetime
+from aiohttp import web
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
 
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import BaseMiddleware, Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.types import FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from playwright.async_api import async_playwright
 
 # === 1. CONFIGURATION ===
@@ -29,14 +46,80 @@ DB_CONFIG = {
     "host": os.getenv("DB_HOST"),
     "port": os.getenv("DB_PORT")
 }
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
 
 # Google Sheets Configuration
 GOOGLE_KEY_FILE = os.getenv("GOOGLE_KEY_PATH", "google_key.json")
 GOOGLE_SHEET_NAME = os.getenv("GOOGLE_SHEET_NAME", "Список тендеров")
+SHEETS_BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", "50"))        # Сколько строк копим до append_rows
+SHEETS_FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", "30"))  # Или сбрасываем раз в N сек
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", "5"))
+SHEETS_MAX_REQUEUES = int(os.getenv("SHEETS_MAX_REQUEUES", "10"))  # Сбросов подряд с ошибкой, после которых пачку отбрасываем
 
 # Parser Settings
 MAX_PAGES_PER_RUN = 5
+DETAIL_CONCURRENCY = int(os.getenv("DETAIL_CONCURRENCY", "4"))  # Сколько детальных страниц грузим параллельно
+PARSE_INTERVAL = int(os.getenv("PARSE_INTERVAL", "300"))  # Пауза между проходами одной площадки, сек
+REJECT_TTL = int(os.getenv("REJECT_TTL", str(7 * 24 * 3600)))  # Сколько помним отсеянные фильтром лоты, сек
+BACKFILL_INTERVAL = int(os.getenv("BACKFILL_INTERVAL", str(6 * 3600)))  # Глубокий проход всех страниц, сек
+
+# Жизненный цикл Chromium (BrowserPool): перезапуск по числу переходов, по памяти и после падения
+BROWSER_MAX_NAVIGATIONS = int(os.getenv("BROWSER_MAX_NAVIGATIONS", "2000"))  # Переходов до плановой замены браузера
+BROWSER_MAX_RSS_MB = int(os.getenv("BROWSER_MAX_RSS_MB", "1500"))  # Драйвер + Chromium, МБ; 0 - не следить
+BROWSER_DRAIN_TIMEOUT = float(os.getenv("BROWSER_DRAIN_TIMEOUT", "300"))  # Сколько ждем текущие проходы перед заменой, сек
+PAGE_MAX_USES = int(os.getenv("PAGE_MAX_USES", "50"))  # Вкладку PagePool после N лотов закрываем и открываем новую
+
+# Темп запросов к площадкам (AdaptiveLimiter): стартуем осторожно, разгоняемся на успехах,
+# на таймаутах / 429 / 5xx вдвое сбавляем. Лимит - на сайт (все поддомены uzex.uz за одним фаерволом)
+CRAWL_START_CONCURRENCY = int(os.getenv("CRAWL_START_CONCURRENCY", "2"))
+CRAWL_MAX_CONCURRENCY = int(os.getenv("CRAWL_MAX_CONCURRENCY", "8"))  # Одновременных запросов к сайту из процесса
+CRAWL_START_INTERVAL = float(os.getenv("CRAWL_START_INTERVAL", "1.0"))  # Пауза между стартами запросов, сек
+CRAWL_MIN_INTERVAL = float(os.getenv("CRAWL_MIN_INTERVAL", "0.1"))
+CRAWL_MAX_INTERVAL = float(os.getenv("CRAWL_MAX_INTERVAL", "30"))
+CRAWL_BACKOFF_PAUSE = float(os.getenv("CRAWL_BACKOFF_PAUSE", "10"))  # Пауза сайта после сбоя, если он не прислал Retry-After
+CRAWL_SITE_GROUPS = ("uzex.uz",)  # Домены, поддомены которых делят один лимитер; остальные хосты - каждый свой
+
+# Что не грузим в браузере: типы ресурсов Playwright и хосты трекеров (через запятую)
+BLOCKED_RESOURCE_TYPES = {t.strip() for t in os.getenv("BLOCKED_RESOURCE_TYPES", "image,media,font,stylesheet").split(",") if t.strip()}
+BLOCKED_HOSTS = [h.strip() for h in os.getenv(
+    "BLOCKED_HOSTS",
+    "google-analytics.com,googletagmanager.com,doubleclick.net,mc.yandex.ru,"
+    "facebook.net,connect.facebook.net,top-fwz1.mail.ru,counter.yadro.ru,hotjar.com,jivosite.com"
+).split(",") if h.strip()]
+
+# HTTP fast path: списки Etender/Xarid берем из JSON API, браузер нужен только для новых лотов.
+# Публичного описания API у площадок нет, поэтому fast path включается только для площадки
+# с явно заданным URL; для проверки без сети - локальный stub_server.py.
+ETENDER_API_URL = os.getenv("ETENDER_API_URL", "")
+XARID_API_URL = os.getenv("XARID_API_URL", "")
+HTTP_FAST_PATH = os.getenv("HTTP_FAST_PATH", "1") == "1"  # "0" - всегда Playwright, даже с заданными URL
+HTTP_PAGE_SIZE = int(os.getenv("HTTP_PAGE_SIZE", "20"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+
+# Предзагрузка карточек для свайпов
+PREFETCH_SIZE = int(os.getenv("PREFETCH_SIZE", "10"))            # Сколько карточек берем одним запросом
+PREFETCH_LOW_WATER = int(os.getenv("PREFETCH_LOW_WATER", "3"))   # Дозагружаем в фоне, когда осталось меньше
+PREFETCH_MAX_BUFFERS = int(os.getenv("PREFETCH_MAX_BUFFERS", "5000"))
+
+# Бюджет времени на один проход площадки, сек
+SOURCE_TIMEOUTS = {
+    "Xarid.uz": int(os.getenv("XARID_TIMEOUT", "600")),
+    "Etender": int(os.getenv("ETENDER_TIMEOUT", "900")),
+    "IT-Market": int(os.getenv("IT_MARKET_TIMEOUT", "180")),
+    "Xarid.uz:prices": int(os.getenv("XARID_PRICES_TIMEOUT", "600")),
+}
+# Обновление текущих цен открытых аукционов Xarid - отдельный проход со своим интервалом
+PRICE_REFRESH_INTERVAL = int(os.getenv("PRICE_REFRESH_INTERVAL", "900"))
+PRICE_REFRESH_MAX_PAGES = int(os.getenv("PRICE_REFRESH_MAX_PAGES", "200"))  # Свой лимит страниц: листаем до конца открытых лотов, а не MAX_PAGES_PER_RUN
+PRICE_ALERT_THRESHOLD = float(os.getenv("PRICE_ALERT_THRESHOLD", "0.05"))  # Доля изменения для уведомления лайкнувших; 0 - выкл.
+SOURCE_INTERVALS = {"Xarid.uz:prices": PRICE_REFRESH_INTERVAL}  # Остальные площадки - PARSE_INTERVAL
 MIN_PRICE_LIMIT = 5000000  # 5 Million SUM
+SITE_TZ = timezone(timedelta(hours=int(os.getenv("SITE_TZ_OFFSET", "5"))))  # Даты на площадках - по Ташкенту (UTC+5)
 
 TARGET_KEYWORDS = [
     "Услуги печатные", "звуко- и видеозаписей", "программных средств",
@@ -63,142 +146,904 @@ TOPIC_MAP = {
     "Xarid.uz": 2, "IT-Market": 4, "Etender": 6, "Cooperation": 8, "XT-Xarid": 10
 }
 
+# Outbox: лимиты Telegram (~20 сообщений в минуту в группу) и повторы
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", str(20 / 60)))   # сообщений в секунду на чат
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_TOPIC_RATE = float(os.getenv("OUTBOX_TOPIC_RATE", str(10 / 60)))  # сообщений в секунду на топик
+OUTBOX_TOPIC_BURST = int(os.getenv("OUTBOX_TOPIC_BURST", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "10"))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))  # сообщений в секунду на бота всего (лимит Telegram ~30)
+
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "5"))  # Результатов /search на страницу
+SEARCH_HISTORY_PER_USER = int(os.getenv("SEARCH_HISTORY_PER_USER", "20"))  # Сколько последних запросов /search помним
+FAVORITES_PAGE_SIZE = int(os.getenv("FAVORITES_PAGE_SIZE", "10"))  # Лайков на одну страницу "Мои лайки"
+FAVORITES_COUNT_TTL = float(os.getenv("FAVORITES_COUNT_TTL", "600"))  # Сколько верим закэшированному числу лайков, сек
+
+# Роль процесса: "python main.py" - бот, "python main.py worker" - воркер парсинга
+PROCESS_ROLE = "worker" if sys.argv[1:2] == ["worker"] else "bot"
+# inline - парсер крутится в процессе бота (как раньше); queue - парсят отдельные воркеры
+CRAWLER_MODE = os.getenv("CRAWLER_MODE", "inline")
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+WORKER_SOURCE_SLOTS = int(os.getenv("WORKER_SOURCE_SLOTS", "3"))  # Сколько площадок воркер обходит одновременно
+WORKER_DETAIL_BATCH = int(os.getenv("WORKER_DETAIL_BATCH", str(DETAIL_CONCURRENCY * 2)))  # Лотов за один захват
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Каналы LISTEN/NOTIFY между воркерами и ботом
+TENDERS_CHANNEL, OUTBOX_CHANNEL, JOBS_CHANNEL, SUBSCRIPTIONS_CHANNEL = "tenders_new", "outbox_new", "crawl_jobs", "subscriptions_changed"
+# После обрыва LISTEN догоняем лоты, добавленные за столько секунд до отметки: id выдаются
+# до коммита, и пачка с меньшими id может закоммититься позже пачки с большими
+ANNOUNCE_OVERLAP = float(os.getenv("ANNOUNCE_OVERLAP", "300"))
+
+# Прием апдейтов: polling - один процесс; webhook - aiohttp-сервер, экземпляров сколько угодно за одним URL
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")  # публичный https://host; пусто - вебхук в Telegram не регистрируем
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Заголовок X-Telegram-Bot-Api-Secret-Token; по умолчанию выводится из токена - у всех экземпляров одинаковый
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "30"))  # Сколько ждем начатые апдейты при остановке, сек
+LEADER_RETRY_INTERVAL = float(os.getenv("LEADER_RETRY_INTERVAL", "15"))
+# Свой Bot API (telegram-bot-api --local) или заглушка для тестов; пусто - api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+TELEGRAM_API_LOCAL = os.getenv("TELEGRAM_API_LOCAL", "0") == "1"  # Bot API с --local: файлы отдаются путями на диске
+# Новые лоты, outbox и подписки касаются других процессов (воркеры, соседние экземпляры бота) - сообщаем через NOTIFY
+NOTIFY_PEERS = PROCESS_ROLE == "worker" or BOT_MODE == "webhook"
+
+# Метрики: локальный HTTP-эндпоинт в формате Prometheus
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 - не поднимать
+
+# Подписки пользователей на новые лоты
+SUBSCRIPTIONS_PER_USER = int(os.getenv("SUBSCRIPTIONS_PER_USER", "10"))
+
 # Initialize Bot
 logging.basicConfig(level=logging.INFO)
-bot = Bot(token=BOT_TOKEN)
+bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL, is_local=TELEGRAM_API_LOCAL)) if TELEGRAM_API_URL else None)
 dp = Dispatcher()
 
+# ==========================================
+# === 1.1 METRICS (PROMETHEUS TEXT FORMAT) ===
+# ==========================================
+
+METRIC_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+class Metrics:
+    """Счетчики, gauge и гистограммы в памяти процесса; render() отдает текст для Prometheus.
+    Потокобезопасно: пишут и event loop, и поток SheetsSink."""
+
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)  # (имя, метки) -> значение
+        self._gauges = {}
+        self._histograms = {}                # (имя, метки) -> [счетчики по бакетам..., сумма, количество]
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        with self._lock: self._counters[self._key(name, labels)] += value
+
+    def set(self, name, value, **labels):
+        with self._lock: self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None: hist = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound: hist[i] += 1
+            hist[-2] += seconds; hist[-1] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try: yield
+        finally: self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = [(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in list(labels) + list(extra)]
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+    def render(self):
+        with self._lock:
+            counters, gauges = dict(self._counters), dict(self._gauges)
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+        lines, typed = [], set()
+        def header(name, kind):
+            if name not in typed: typed.add(name); lines.append(f"# TYPE {name} {kind}")
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter"); lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, "gauge"); lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), hist in sorted(histograms.items()):
+            header(name, "histogram")
+            for bound, count in zip(self.buckets, hist):
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', str(bound))])} {count}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {hist[-1]}")
+            lines.append(f"{name}_sum{self._labels(labels)} {hist[-2]}")
+            lines.append(f"{name}_count{self._labels(labels)} {hist[-1]}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# Текущий проход площадки: страницы и новые лоты (для gauge "за последний цикл")
+crawl_run_stats = defaultdict(lambda: {"pages": 0, "lots": 0})
+
+def count_page(source):
+    metrics.inc("tender_crawl_pages_total", source=source)
+    crawl_run_stats[source]["pages"] += 1
+
+def count_lot(source):
+    metrics.inc("tender_crawl_lots_total", source=source)
+    crawl_run_stats[source]["lots"] += 1
+
+def record_error(source, stage, error):
+    """Вместо молчаливого except: pass - счетчик по площадке/этапу и строка в лог."""
+    metrics.inc("tender_crawl_errors_total", source=source, stage=stage, error=type(error).__name__)
+    print(f"⚠️ {source} [{stage}]: {type(error).__name__}: {error}")
+
+_query_labels = {}
+
+def _query_label(sql):
+    """'SELECT ... FROM tenders ...' -> 'select tenders': метка с низкой кардинальностью."""
+    label = _query_labels.get(sql)
+    if label is None:
+        op = re.match(r"\s*(\w+)", sql)
+        table = re.search(r"\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?)\s+(\w+)", sql, re.IGNORECASE)
+        label = f"{op.group(1).lower() if op else '?'} {table.group(1) if table else '-'}"
+        if len(_query_labels) < 1000: _query_labels[sql] = label
+    return label
+
+def _log_query(record):
+    label = _query_label(record.query)
+    metrics.observe("tender_db_query_seconds", record.elapsed, query=label)
+    if record.exception is not None: metrics.inc("tender_db_errors_total", query=label, error=type(record.exception).__name__)
+
+async def _init_db_connection(conn):
+    conn.add_query_logger(_log_query)
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Время и исход каждого хендлера бота."""
+    async def __call__(self, handler, event, data):
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        started, status = time.perf_counter(), "ok"
+        try: return await handler(event, data)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            metrics.observe("tender_bot_handler_seconds", time.perf_counter() - started, handler=name)
+            metrics.inc("tender_bot_handler_calls_total", handler=name, status=status)
+
+dp.message.middleware(HandlerTimingMiddleware())
+dp.callback_query.middleware(HandlerTimingMiddleware())
+
+async def _metrics_handler(request):
+    # Размеры кэшей - на момент опроса
+    metrics.set("tender_known_links", len(known_links))
+    metrics.set("tender_rejected_links", len(rejected_links))
+    metrics.set("tender_subscriptions", len(subscription_index.subs))
+    metrics.set("tender_card_buffers", len(card_buffers))
+    if browser_pool is not None:
+        health = browser_pool.health()
+        metrics.set("tender_browser_up", int(health["connected"]))
+        metrics.set("tender_browser_active_contexts", health["active_contexts"])
+        metrics.set("tender_browser_navigations", health["navigations"])
+    if db_pool is not None:
+        metrics.set("tender_db_pool_size", db_pool.get_size())
+        metrics.set("tender_db_pool_idle", db_pool.get_idle_size())
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+async def _healthz_handler(request):
+    ok = await db_health_check()
+    return web.Response(text="ok" if ok else "db down", status=200 if ok else 503)
+
+async def _browser_health_handler(request):
+    """503 - браузер не поднимается (последний запуск упал); до первого прохода - 200."""
+    if browser_pool is None: return web.json_response({"enabled": False})
+    browser_pool.check_memory()
+    health = browser_pool.health()
+    return web.json_response(health, status=503 if health["last_error"] and not health["connected"] else 200)
+
+async def start_metrics_server():
+    """GET /metrics и /healthz на METRICS_HOST:METRICS_PORT. Возвращает AppRunner (для cleanup) или None."""
+    if not METRICS_PORT: return None
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    app.router.add_get("/healthz", _healthz_handler)
+    app.router.add_get("/healthz/browser", _browser_health_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try: await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as e:
+        # Второй процесс на той же машине - задайте ему свой METRICS_PORT
+        print(f"⚠️ Метрики не запущены ({METRICS_HOST}:{METRICS_PORT}): {e}")
+        await runner.cleanup()
+        return None
+    print(f"📈 Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
 # ==========================================
 # === 2. DATABASE MANAGEMENT (PostgreSQL) ===
 # ==========================================
 
-def get_connection():
+db_pool = None  # asyncpg.Pool: создается один раз в main() и общий для парсеров и хендлеров
+
+async def create_db_pool():
+    """Создает ограниченный пул соединений. asyncpg сам подготавливает (prepare)
+    каждый запрос и кэширует его на соединении, поэтому повторные вызовы хелперов
+    не разбирают SQL заново."""
+    global db_pool
     try:
-        return psycopg2.connect(**DB_CONFIG)
-    except psycopg2.OperationalError as e:
+        db_pool = await asyncpg.create_pool(
+            database=DB_CONFIG["dbname"], user=DB_CONFIG["user"], password=DB_CONFIG["password"],
+            host=DB_CONFIG["host"], port=int(DB_CONFIG["port"]) if DB_CONFIG["port"] else None,
+            min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+            command_timeout=DB_COMMAND_TIMEOUT, statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            init=_init_db_connection
+        )
+        return db_pool
+    except (OSError, asyncpg.PostgresError) as e:
         print(f"❌ DB Connection Error: {e}")
         raise e
 
-def init_db():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tenders (
-            id SERIAL PRIMARY KEY,
-            source TEXT, title TEXT, description TEXT, price TEXT,
-            start_date TEXT, end_date TEXT, link TEXT UNIQUE,
-            date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id BIGINT PRIMARY KEY,
-            phone TEXT, username TEXT
-        );
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS favorites (
-            user_id BIGINT,
-            tender_id INTEGER,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (user_id, tender_id),
-            FOREIGN KEY (tender_id) REFERENCES tenders(id) ON DELETE CASCADE
-        );
-    ''')
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-def check_exists(link):
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM tenders WHERE link = %s", (link,))
-        result = cursor.fetchone()
-        conn.close()
-        return result is not None
-    except: return False
-
-def add_tender_direct(source, title, description, price, start_date, end_date, link):
+async def close_db_pool():
+    global db_pool
+    if db_pool is not None:
+        await db_pool.close()
+        db_pool = None
+
+async def db_health_check(timeout=5):
+    """True, если пул жив и база отвечает на SELECT 1."""
+    if db_pool is None: return False
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO tenders (source, title, description, price, start_date, end_date, link)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (link) DO NOTHING
-        """, (source, title, description, price, start_date, end_date, link))
-        conn.commit()
-        conn.close()
-        return True
+        async with db_pool.acquire(timeout=timeout) as conn:
+            return await conn.fetchval("SELECT 1", timeout=timeout) == 1
     except Exception as e:
-        print(f"DB Error: {e}")
+        print(f"⚠️ DB Health Check failed: {e}")
         return False
 
-def get_next_tender(user_id, source):
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        query = """
-            SELECT id, title, description, price, start_date, end_date, link 
-            FROM tenders 
-            WHERE source = %s 
-            AND id NOT IN (SELECT tender_id FROM favorites WHERE user_id = %s)
-            ORDER BY id DESC LIMIT 1
-        """
-        cursor.execute(query, (source, user_id))
-        return cursor.fetchone()
-    finally:
-        cursor.close()
-        conn.close()
-
-def add_favorite(user_id, tender_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("INSERT INTO favorites (user_id, tender_id) VALUES (%s, %s) ON CONFLICT DO NOTHING", (user_id, tender_id))
-        conn.commit()
-    finally:
-        cursor.close()
-        conn.close()
-
-def delete_favorite(user_id, tender_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+async def init_db():
+    async with db_pool.acquire() as conn:
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS tenders (
+                id SERIAL PRIMARY KEY,
+                source TEXT, title TEXT, link TEXT UNIQUE,
+                date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+        # Типизированные поля лота (старые базы получают их через ALTER)
+        for column, sql_type in TENDER_COLUMN_TYPES.items():
+            await conn.execute(f"ALTER TABLE tenders ADD COLUMN IF NOT EXISTS {column} {sql_type}")
+        await migrate_legacy_tenders(conn)
+        await conn.execute("CREATE INDEX IF NOT EXISTS tenders_end_at_idx ON tenders (end_at)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS tenders_amount_idx ON tenders (currency, amount)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS tenders_region_idx ON tenders (region)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS tenders_date_added_idx ON tenders (date_added)")
+        await conn.execute("ALTER TABLE tenders ADD COLUMN IF NOT EXISTS price_updated_at TIMESTAMPTZ")
+        # Полнотекстовый поиск: вектор считает сам PostgreSQL при вставке (PG 12+), GIN - по нему
+        await conn.execute(f"ALTER TABLE tenders ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS ({TENDER_SEARCH_VECTOR}) STORED")
+        await conn.execute("CREATE INDEX IF NOT EXISTS tenders_search_idx ON tenders USING GIN (search_tsv)")
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id BIGINT PRIMARY KEY,
+                phone TEXT, username TEXT
+            );
+        ''')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS favorites (
+                user_id BIGINT,
+                tender_id INTEGER,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, tender_id),
+                FOREIGN KEY (tender_id) REFERENCES tenders(id) ON DELETE CASCADE
+            );
+        ''')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id BIGSERIAL PRIMARY KEY,
+                chat_id TEXT NOT NULL,
+                thread_id INTEGER,
+                text TEXT NOT NULL,
+                photo_path TEXT,
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at TIMESTAMPTZ DEFAULT now(),
+                created_at TIMESTAMPTZ DEFAULT now()
+            );
+        ''')
+        # Страницы "Мои лайки": keyset по (timestamp, tender_id) внутри пользователя
+        await conn.execute("CREATE INDEX IF NOT EXISTS favorites_user_ts_idx ON favorites (user_id, timestamp DESC, tender_id DESC)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS outbox_due_idx ON outbox (next_attempt_at, id)")
+        # Лента свайпов: курсор просмотренного диапазона id на пользователя и площадку
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS feed_state (
+                user_id BIGINT,
+                source TEXT,
+                high_id INTEGER NOT NULL,
+                low_id INTEGER NOT NULL,
+                updated_at TIMESTAMPTZ DEFAULT now(),
+                PRIMARY KEY (user_id, source)
+            );
+        ''')
+        await conn.execute("CREATE INDEX IF NOT EXISTS tenders_source_id_idx ON tenders (source, id)")
+        await conn.execute(FEED_SEED_QUERY)
+        # Запросы /search: текст в callback_data не влезает, в кнопках - id строки (видят все экземпляры бота)
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS search_queries (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                query TEXT NOT NULL,
+                created_at TIMESTAMPTZ DEFAULT now(),
+                UNIQUE (user_id, query)
+            );
+        ''')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS rejected_lots (
+                link TEXT PRIMARY KEY,
+                source TEXT,
+                reason TEXT,
+                config_version TEXT NOT NULL,
+                rejected_at TIMESTAMPTZ DEFAULT now()
+            );
+        ''')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                keywords TEXT[] NOT NULL DEFAULT '{}',
+                regions TEXT[] NOT NULL DEFAULT '{}',
+                min_amount NUMERIC(20, 2),
+                max_amount NUMERIC(20, 2),
+                source TEXT,
+                created_at TIMESTAMPTZ DEFAULT now()
+            );
+        ''')
+        await conn.execute("CREATE INDEX IF NOT EXISTS subscriptions_user_idx ON subscriptions (user_id)")
+        # Очередь задач для воркеров: проход площадки (повторяется) или один лот
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS crawl_jobs (
+                id BIGSERIAL PRIMARY KEY,
+                kind TEXT NOT NULL,
+                source TEXT NOT NULL,
+                payload JSONB NOT NULL DEFAULT '{}',
+                dedup_key TEXT UNIQUE,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                run_after TIMESTAMPTZ DEFAULT now(),
+                locked_by TEXT,
+                locked_at TIMESTAMPTZ,
+                last_error TEXT,
+                created_at TIMESTAMPTZ DEFAULT now()
+            );
+        ''')
+        await conn.execute("CREATE INDEX IF NOT EXISTS crawl_jobs_due_idx ON crawl_jobs (kind, run_after, id) WHERE status = 'pending'")
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS crawl_state (
+                source TEXT PRIMARY KEY,
+                newest_lot_id BIGINT,
+                newest_link TEXT,
+                last_backfill_at TIMESTAMPTZ,
+                updated_at TIMESTAMPTZ DEFAULT now()
+            );
+        ''')
+
+# === Типизированная схема tenders ===
+TENDER_COLUMN_TYPES = {
+    "amount": "NUMERIC(20, 2)",          # Начальная цена / бюджет; NULL - не указана (договорная)
+    "currency": "TEXT DEFAULT 'UZS'",
+    "current_amount": "NUMERIC(20, 2)",  # Текущая ставка (Xarid.uz)
+    "start_at": "TIMESTAMPTZ", "end_at": "TIMESTAMPTZ",
+    "region": "TEXT", "category": "TEXT", "customer": "TEXT", "inn": "TEXT", "items_desc": "TEXT",
+}
+TENDER_FIELDS = tuple(TENDER_COLUMN_TYPES)
+# Вес полей в поиске: название и товары (A) важнее категории (B), заказчика (C) и региона (D)
+TENDER_SEARCH_VECTOR = """
+    setweight(to_tsvector('russian'::regconfig, coalesce(title, '') || ' ' || coalesce(items_desc, '')), 'A') ||
+    setweight(to_tsvector('russian'::regconfig, coalesce(category, '')), 'B') ||
+    setweight(to_tsvector('russian'::regconfig, coalesce(customer, '')), 'C') ||
+    setweight(to_tsvector('russian'::regconfig, coalesce(region, '')), 'D')
+"""
+LEGACY_TENDER_COLUMNS = ("description", "price", "start_date", "end_date")
+PLACEHOLDERS = {"", "-", "Не указан", "Не указана", "Не указано", "Нет ставок", "Договорная"}
+
+def known_or_none(value):
+    """Заглушки парсеров ("Не указан", "-") в базе храним как NULL."""
+    if value is None: return None
+    value = str(value).strip()
+    return None if value in PLACEHOLDERS else value
+
+def legacy_tender_fields(source, description, price, start_date, end_date):
+    """Старая строка tenders -> типизированные поля.
+    price: "845000000.0 UZS" (Xarid/Etender) или "20 000 000,00" / "Договорная" (IT-Market);
+    description: Xarid - "toifa||region||текущая цена", Etender - "Tender||region||валюта", IT-Market - заказчик."""
+    price = (price or "").strip()
+    amount_raw, _, currency = price.rpartition(" ")
+    if currency not in ("UZS", "USD", "RUB", "EUR"): amount_raw, currency = price, "UZS"
+    fields = {"amount": to_amount(parse_price_to_number(amount_raw)), "currency": currency,
+              "start_at": parse_site_datetime(start_date), "end_at": parse_site_datetime(end_date)}
+    parts = (description or "").split("||")
+    if len(parts) >= 3:
+        if source == "Xarid.uz":
+            fields["category"] = known_or_none(parts[0])
+            fields["current_amount"] = to_amount(parse_price_to_number(parts[2]))
+        fields["region"] = known_or_none(parts[1])
+    else:
+        fields["customer"] = known_or_none(description)
+    return fields
+
+async def migrate_legacy_tenders(conn):
+    """Разовая миграция: разбирает старые TEXT-колонки в типизированные, а сами
+    старые колонки переименовывает в legacy_* (данные остаются для сверки)."""
+    legacy = await conn.fetchval("""
+        SELECT count(*) FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'tenders' AND column_name = 'description'
+    """)
+    if not legacy: return
+    rows = await conn.fetch("SELECT id, source, description, price, start_date, end_date FROM tenders")
+    updates = []
+    for r in rows:
+        fields = legacy_tender_fields(r["source"], r["description"], r["price"], r["start_date"], r["end_date"])
+        updates.append((r["id"], *(fields.get(f) for f in TENDER_FIELDS)))
+    assignments = ", ".join(f"{f} = ${i}" for i, f in enumerate(TENDER_FIELDS, start=2))
+    async with conn.transaction():
+        await conn.executemany(f"UPDATE tenders SET {assignments} WHERE id = $1", updates)
+        for column in LEGACY_TENDER_COLUMNS:
+            await conn.execute(f"ALTER TABLE tenders RENAME COLUMN {column} TO legacy_{column}")
+    print(f"🗄 Миграция tenders: {len(updates)} строк переведены на типизированную схему")
+
+# === Инкрементальный обход: high-water mark по площадке ===
+class CrawlState:
+    """Самый свежий лот прошлого прохода. Обычный проход идет по страницам только
+    до него (уже известная территория), глубокий - раз в BACKFILL_INTERVAL на все
+    MAX_PAGES_PER_RUN страниц. Новая отметка сохраняется, только если проход прочитал
+    страницы подряд до старой отметки или до конца списка (finish())."""
+
+    def __init__(self, source, newest_lot_id=None, newest_link=None, last_backfill_at=None):
+        self.source = source
+        self.mark = newest_lot_id
+        self.newest_lot_id, self.newest_link = newest_lot_id, newest_link
+        self.last_backfill_at = last_backfill_at
+        self.pages = 0              # Прочитано страниц подряд с первой
+        self.reached_mark = False   # Встретили лот не новее старой отметки
+        self.exhausted = False      # Список кончился
+        self.deep = (newest_lot_id is None or last_backfill_at is None
+                     or datetime.now(timezone.utc) - last_backfill_at > timedelta(seconds=BACKFILL_INTERVAL))
+
+    @classmethod
+    async def load(cls, source):
+        try:
+            async with db_pool.acquire() as conn:
+                row = await conn.fetchrow("SELECT newest_lot_id, newest_link, last_backfill_at FROM crawl_state WHERE source = $1", source)
+        except Exception as e:
+            print(f"DB Error: {e}")
+            row = None
+        return cls(source, *row) if row else cls(source)
+
+    def observe(self, lots):
+        """lots - [(lot_id, link), ...] со страницы списка. True - дошли до известных лотов, дальше не листаем."""
+        self.pages += 1
+        for lot_id, link in lots:
+            if lot_id is not None and (self.newest_lot_id is None or lot_id > self.newest_lot_id):
+                self.newest_lot_id, self.newest_link = lot_id, link
+        if self.mark is not None and any(lot_id is not None and lot_id <= self.mark for lot_id, _ in lots):
+            self.reached_mark = True
+        return self.reached_mark and not self.deep
+
+    def finish(self):
+        """Список кончился сам (пустая страница, нет кнопки "дальше"), а не оборвался ошибкой."""
+        self.exhausted = True
+
+    async def save(self):
+        all_pages = self.exhausted or self.pages >= MAX_PAGES_PER_RUN
+        # Пагинация упала на 2-й странице - отметку не двигаем: иначе лоты непрочитанных
+        # страниц оказались бы "за отметкой" и ждали бэкфилла. Без старой отметки хватит всех страниц
+        advance = self.newest_lot_id is not None and (self.reached_mark or self.exhausted or (self.mark is None and all_pages))
+        backfilled = self.deep and all_pages
+        if not advance and not backfilled: return
+        try:
+            async with db_pool.acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO crawl_state (source, newest_lot_id, newest_link, last_backfill_at, updated_at)
+                    VALUES ($1, $2, $3, CASE WHEN $4 THEN now() END, now())
+                    ON CONFLICT (source) DO UPDATE SET
+                        newest_lot_id = COALESCE(EXCLUDED.newest_lot_id, crawl_state.newest_lot_id),
+                        newest_link = COALESCE(EXCLUDED.newest_link, crawl_state.newest_link),
+                        last_backfill_at = COALESCE(EXCLUDED.last_backfill_at, crawl_state.last_backfill_at),
+                        updated_at = now()
+                """, self.source, self.newest_lot_id if advance else None, self.newest_link if advance else None, backfilled)
+        except Exception as e:
+            print(f"DB Error: {e}")
+
+def _lot_number(value):
+    value = str(value or "")
+    return int(value) if value.isdigit() else None
+
+# === Дедупликация: известные ссылки держим в памяти ===
+# Храним не сами URL, а 8-байтовые blake2b-хэши: ~100 тыс. лотов занимают несколько МБ.
+known_links = set()
+
+def _link_key(link):
+    return hashlib.blake2b(link.encode("utf-8"), digest_size=8).digest()
+
+def remember_link(link):
+    known_links.add(_link_key(link))
+
+async def load_known_links():
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch("SELECT link FROM tenders WHERE link IS NOT NULL")
+    known_links.clear()
+    known_links.update(_link_key(r["link"]) for r in rows)
+    print(f"📚 Загружено известных ссылок: {len(known_links)}")
+
+# === Кэш отказов: лоты, отсеянные фильтрами, не открываем повторно ===
+# Ключ - тот же хэш ссылки, значение - unix-время отказа (для TTL).
+rejected_links = {}
+
+def filter_config_version():
+    """Версия настроек фильтров: сменились ключевые слова, toifa или лимит цены - старые отказы не действуют."""
+    config = json.dumps([TARGET_KEYWORDS, ALLOWED_TOIFA, MIN_PRICE_LIMIT], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(config.encode("utf-8")).hexdigest()[:12]
+
+def _is_rejected(key):
+    rejected_at = rejected_links.get(key)
+    return rejected_at is not None and time.time() - rejected_at < REJECT_TTL
+
+async def load_rejected_links():
+    version = filter_config_version()
+    async with db_pool.acquire() as conn:
+        # Отказы под другую версию фильтров и просроченные - больше не нужны
+        await conn.execute(
+            "DELETE FROM rejected_lots WHERE config_version <> $1 OR rejected_at < now() - make_interval(secs => $2)",
+            version, float(REJECT_TTL)
+        )
+        rows = await conn.fetch("SELECT link, extract(epoch FROM rejected_at) AS ts FROM rejected_lots")
+    rejected_links.clear()
+    rejected_links.update((_link_key(r["link"]), float(r["ts"])) for r in rows)
+    print(f"🚫 Загружено отказов (фильтры {version}): {len(rejected_links)}")
+
+async def remember_rejections(source, rejected):
+    """rejected - [(link, reason), ...]; пишем пачкой одним запросом."""
+    if not rejected: return
+    now = time.time()
+    for link, reason in rejected:
+        rejected_links[_link_key(link)] = now
+        metrics.inc("tender_crawl_rejections_total", source=source, reason=reason)
     try:
-        cursor.execute("DELETE FROM favorites WHERE user_id = %s AND tender_id = %s", (user_id, tender_id))
-        conn.commit()
-    finally:
-        cursor.close()
-        conn.close()
+        async with db_pool.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO rejected_lots (link, source, reason, config_version)
+                SELECT l, $2, r, $3 FROM unnest($1::text[], $4::text[]) AS u(l, r)
+                ON CONFLICT (link) DO UPDATE SET
+                    reason = EXCLUDED.reason, config_version = EXCLUDED.config_version, rejected_at = now()
+            """, [l for l, _ in rejected], source, filter_config_version(), [r for _, r in rejected])
+    except Exception as e:
+        print(f"DB Error: {e}")
 
-def get_user_favorites(user_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+async def filter_new_links(links):
+    """Возвращает ссылки, которых еще нет ни в tenders, ни в свежих отказах (порядок сохраняется).
+    Сначала сверяемся с памятью, остаток страницы проверяем одним запросом link = ANY($1)."""
+    candidates = [l for l in dict.fromkeys(links) if _link_key(l) not in known_links and not _is_rejected(_link_key(l))]
+    if not candidates: return []
     try:
-        query = """
-            SELECT t.id, t.title, t.price, t.link, t.source 
-            FROM favorites f
-            JOIN tenders t ON f.tender_id = t.id
-            WHERE f.user_id = %s
-            ORDER BY f.timestamp DESC
-        """
-        cursor.execute(query, (user_id,))
-        return cursor.fetchall()
-    finally:
-        cursor.close()
-        conn.close()
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT link, NULL::float8 AS ts FROM tenders WHERE link = ANY($1::text[])
+                UNION ALL
+                SELECT link, extract(epoch FROM rejected_at) FROM rejected_lots
+                WHERE link = ANY($1::text[]) AND config_version = $2 AND rejected_at > now() - make_interval(secs => $3)
+            """, candidates, filter_config_version(), float(REJECT_TTL))
+    except Exception as e:
+        print(f"DB Error: {e}")
+        return candidates
+    found = set()
+    for r in rows:
+        found.add(r["link"])
+        if r["ts"] is None: remember_link(r["link"])
+        else: rejected_links[_link_key(r["link"])] = float(r["ts"])
+    return [l for l in candidates if l not in found]
+
+# Новые лоты страницы - одним INSERT: по массиву на колонку через unnest. В RETURNING попадают
+# только реально вставленные строки: лот, который параллельно сохранил другой проход или воркер,
+# уходит в конфликт и второй раз не анонсируется.
+TENDER_ARRAY_TYPES = {f: t.split()[0].split("(")[0].lower() + "[]" for f, t in TENDER_COLUMN_TYPES.items()}
+TENDER_BULK_INSERT = f"""
+    INSERT INTO tenders (source, title, link, {", ".join(TENDER_FIELDS)})
+    SELECT * FROM unnest($1::text[], $2::text[], $3::text[], {", ".join(f"${i}::{TENDER_ARRAY_TYPES[f]}" for i, f in enumerate(TENDER_FIELDS, start=4))})
+    ON CONFLICT (link) DO NOTHING
+    RETURNING id, link
+"""
+NOTIFY_IDS_PER_PAYLOAD = 500  # id через запятую; payload NOTIFY ограничен 8000 байт
+
+def new_lot(source, title, link, message=None, sheet_row=None, **fields):
+    """Лот, готовый к save_tenders. fields - колонки из TENDER_FIELDS: amount/current_amount - Decimal
+    (to_amount), start_at/end_at - datetime (parse_site_datetime), остальное - текст.
+    message и sheet_row - уведомление в канал и строка таблицы, если лот окажется новым."""
+    fields.setdefault("currency", "UZS")
+    return {"source": source, "title": title, "link": link, "fields": fields, "message": message, "sheet_row": sheet_row}
+
+async def save_tenders(lots):
+    """Пачка лотов (None пропускаются) -> один INSERT ... RETURNING. Канал, таблица, счетчики
+    и подписки - только для вставленных. Возвращает вставленные лоты с "id"."""
+    unique = {}
+    for lot in lots:
+        if lot: unique.setdefault(lot["link"], lot)
+    lots = list(unique.values())
+    if not lots: return []
+    columns = [[lot[key] for lot in lots] for key in ("source", "title", "link")]
+    columns += [[lot["fields"].get(f) for lot in lots] for f in TENDER_FIELDS]
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(TENDER_BULK_INSERT, *columns)
+        # Воркер или несколько экземпляров бота: ленты и подписки живут в процессах бота - сообщаем им id новых лотов
+        if rows and NOTIFY_PEERS:
+            ids = [str(r["id"]) for r in rows]
+            payloads = [",".join(ids[i:i + NOTIFY_IDS_PER_PAYLOAD]) for i in range(0, len(ids), NOTIFY_IDS_PER_PAYLOAD)]
+            await conn.execute("SELECT pg_notify($1, p) FROM unnest($2::text[]) AS p", TENDERS_CHANNEL, payloads)
+    for lot in lots: remember_link(lot["link"])
+    inserted = {r["link"]: r["id"] for r in rows}
+    saved = [lot for lot in lots if lot["link"] in inserted]
+    for lot in saved:
+        lot["id"] = inserted[lot["link"]]
+        count_lot(lot["source"])
+        print(f"🔥 [{lot['source']}] Новый: {lot['title']}")
+        if lot["sheet_row"]: save_to_google_sheet(lot["source"], lot["sheet_row"])
+    await send_notifications_to_channel([(lot["message"], lot["source"], DEFAULT_PHOTO_PATH) for lot in saved if lot["message"]])
+    if saved and not NOTIFY_PEERS:
+        for lot in saved: offer_new_lot(lot["source"], {**dict.fromkeys(TENDER_FIELDS), **lot["fields"], "id": lot["id"], "title": lot["title"], "link": lot["link"]})
+        for lot in saved: await notify_subscribers(lot["source"], lot["title"], lot["link"], lot["fields"])
+    return saved
+
+# Курсор ленты: пользователь видел все id площадки в [low_id, high_id].
+# Следующие карточки - сначала новые лоты по возрастанию (id > high_id),
+# потом вглубь истории (id < low_id). Оба варианта - keyset по индексу (source, id).
+# Лайкнутые вне диапазона (лайки до появления feed_state) пропускаем по ключу favorites.
+TENDER_BATCH_QUERY = """
+    SELECT * FROM (
+        (SELECT id, title, link, amount, currency, current_amount, start_at, end_at, region, category, customer, 0 AS pri
+         FROM tenders t WHERE source = $1 AND id > $2
+             AND NOT EXISTS (SELECT 1 FROM favorites f WHERE f.user_id = $5 AND f.tender_id = t.id)
+         ORDER BY id ASC LIMIT $4)
+        UNION ALL
+        (SELECT id, title, link, amount, currency, current_amount, start_at, end_at, region, category, customer, 1 AS pri
+         FROM tenders t WHERE source = $1 AND id < $3
+             AND NOT EXISTS (SELECT 1 FROM favorites f WHERE f.user_id = $5 AND f.tender_id = t.id)
+         ORDER BY id DESC LIMIT $4)
+    ) t ORDER BY pri, CASE WHEN pri = 0 THEN id END ASC, id DESC LIMIT $4
+"""
+# Пользователи с лайками, но без feed_state (лайкали до курсора): диапазон "просмотрено" -
+# верхняя непрерывная серия лайков площадки, в которой нет ни одного нелайкнутого лота.
+# Остальные лайки отсекает NOT EXISTS в TENDER_BATCH_QUERY.
+FEED_SEED_QUERY = """
+    INSERT INTO feed_state (user_id, source, high_id, low_id)
+    SELECT user_id, source, max(id), min(id) FROM (
+        SELECT f.user_id, t.source, t.id, max(t.id) OVER w AS top_id, row_number() OVER (w ORDER BY t.id DESC) AS liked_above
+        FROM favorites f JOIN tenders t ON t.id = f.tender_id
+        WHERE t.source IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM feed_state s WHERE s.user_id = f.user_id AND s.source = t.source)
+        WINDOW w AS (PARTITION BY f.user_id, t.source)
+    ) liked
+    WHERE liked_above = (SELECT count(*) FROM tenders t2 WHERE t2.source = liked.source AND t2.id BETWEEN liked.id AND liked.top_id)
+    GROUP BY user_id, source
+    ON CONFLICT (user_id, source) DO NOTHING
+"""
+FEED_EMPTY_ID = 2147483647  # Нет состояния: "новых" нет, история начинается с самого свежего
+
+async def get_feed_state(user_id, source):
+    async with db_pool.acquire() as conn:
+        state = await conn.fetchrow("SELECT high_id, low_id FROM feed_state WHERE user_id = $1 AND source = $2", user_id, source)
+    if state is None: return FEED_EMPTY_ID, FEED_EMPTY_ID
+    return state["high_id"], state["low_id"]
+
+async def fetch_tender_batch(user_id, source, high_id, low_id, limit):
+    """Следующие limit карточек после курсора одним запросом: [(pri, {id, title, ...}), ...]."""
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(TENDER_BATCH_QUERY, source, high_id, low_id, limit, user_id)
+    return [(r["pri"], dict(r)) for r in rows]
+
+async def mark_seen(user_id, source, tender_id):
+    """Лайк или пропуск: расширяем просмотренный диапазон, чтобы лот больше не показывался.
+    Возвращает актуальный (high_id, low_id) - с учетом свайпов на других экземплярах бота."""
+    async with db_pool.acquire() as conn:
+        state = await conn.fetchrow("""
+            INSERT INTO feed_state (user_id, source, high_id, low_id) VALUES ($1, $2, $3, $3)
+            ON CONFLICT (user_id, source) DO UPDATE SET
+                high_id = GREATEST(feed_state.high_id, EXCLUDED.high_id),
+                low_id = LEAST(feed_state.low_id, EXCLUDED.low_id),
+                updated_at = now()
+            RETURNING high_id, low_id
+        """, user_id, source, int(tender_id))
+    return state["high_id"], state["low_id"]
+
+# === Избранное: число лайков кэшируем, страницы - keyset по (timestamp, tender_id) ===
+favorite_counts = {}  # user_id -> (число, time.monotonic() до которого ему верим)
+
+def _adjust_favorite_count(user_id, status):
+    """status - ответ execute ("INSERT 0 1", "DELETE 3"); поправляем кэш, а не сбрасываем его."""
+    cached = favorite_counts.get(user_id)
+    if cached is None: return
+    changed = int(status.rsplit(" ", 1)[1])
+    favorite_counts[user_id] = (max(0, cached[0] + (changed if status.startswith("INSERT") else -changed)), cached[1])
+
+async def add_favorite(user_id, tender_id):
+    async with db_pool.acquire() as conn:
+        status = await conn.execute("INSERT INTO favorites (user_id, tender_id) VALUES ($1, $2) ON CONFLICT DO NOTHING", user_id, int(tender_id))
+    _adjust_favorite_count(user_id, status)
+
+async def delete_favorite(user_id, tender_id):
+    async with db_pool.acquire() as conn:
+        status = await conn.execute("DELETE FROM favorites WHERE user_id = $1 AND tender_id = $2", user_id, int(tender_id))
+    _adjust_favorite_count(user_id, status)
+
+async def delete_favorites_page(user_id, cursor, limit):
+    """Удаляет страницу: limit лайков, начиная с cursor (включительно) вниз."""
+    async with db_pool.acquire() as conn:
+        status = await conn.execute("""
+            DELETE FROM favorites WHERE user_id = $1 AND tender_id IN (
+                SELECT tender_id FROM favorites WHERE user_id = $1 AND (timestamp, tender_id) <= ($2, $3)
+                ORDER BY timestamp DESC, tender_id DESC LIMIT $4)
+        """, user_id, cursor[0], cursor[1], limit)
+    _adjust_favorite_count(user_id, status)
+
+async def clear_favorites(user_id):
+    async with db_pool.acquire() as conn:
+        await conn.execute("DELETE FROM favorites WHERE user_id = $1", user_id)
+    favorite_counts[user_id] = (0, time.monotonic() + FAVORITES_COUNT_TTL)
+
+FAVORITES_TOP = (datetime(9999, 12, 31), 2 ** 31 - 1)  # Курсор первой страницы: "выше" любого лайка
+_EPOCH = datetime(1970, 1, 1)
+
+def encode_fav_cursor(ts, tender_id):
+    """(timestamp, tender_id) -> "микросекунды_id" для callback_data (точно, без float)."""
+    return f"{(ts - _EPOCH) // timedelta(microseconds=1)}_{tender_id}"
+
+def decode_fav_cursor(text):
+    if text == "0": return FAVORITES_TOP
+    us, tender_id = text.split("_")
+    return _EPOCH + timedelta(microseconds=int(us)), int(tender_id)
+
+# Страница = до $4 лайков с курсора включительно (+1, чтобы знать про следующую),
+# плюс ближайшие $4 лайков выше курсора - самый верхний из них и есть начало предыдущей страницы.
+# Число лайков считается в том же запросе, только если его нет в кэше ($5).
+FAVORITES_PAGE_QUERY = """
+    (SELECT 0 AS part, f.timestamp AS ts, f.tender_id, t.title, t.amount, t.currency, t.link, t.source,
+            CASE WHEN $5 THEN (SELECT count(*) FROM favorites WHERE user_id = $1) END AS total
+     FROM favorites f JOIN tenders t ON t.id = f.tender_id
+     WHERE f.user_id = $1 AND (f.timestamp, f.tender_id) <= ($2, $3)
+     ORDER BY f.timestamp DESC, f.tender_id DESC LIMIT $4 + 1)
+    UNION ALL
+    (SELECT 1, ts, tender_id, NULL, NULL, NULL, NULL, NULL, NULL FROM (
+        SELECT timestamp AS ts, tender_id FROM favorites
+        WHERE user_id = $1 AND (timestamp, tender_id) > ($2, $3)
+        ORDER BY timestamp ASC, tender_id ASC LIMIT $4
+     ) above ORDER BY ts DESC, tender_id DESC LIMIT 1)
+"""
+
+async def get_favorites_page(user_id, cursor=FAVORITES_TOP, limit=None):
+    """{"items": [...], "cursor"/"next"/"prev": курсоры или None, "total": число лайков}. Один запрос."""
+    limit = limit or FAVORITES_PAGE_SIZE
+    cached = favorite_counts.get(user_id)
+    need_count = cached is None or cached[1] < time.monotonic()
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(FAVORITES_PAGE_QUERY, user_id, cursor[0], cursor[1], limit, need_count)
+    items = [dict(r) for r in rows if r["part"] == 0]
+    above = [r for r in rows if r["part"] == 1]
+    if need_count and items:
+        if len(favorite_counts) >= PREFETCH_MAX_BUFFERS and user_id not in favorite_counts:
+            del favorite_counts[next(iter(favorite_counts))]
+        favorite_counts[user_id] = (items[0]["total"], time.monotonic() + FAVORITES_COUNT_TTL)
+    return {
+        "items": items[:limit],
+        "cursor": encode_fav_cursor(items[0]["ts"], items[0]["tender_id"]) if items else None,
+        "next": encode_fav_cursor(items[limit]["ts"], items[limit]["tender_id"]) if len(items) > limit else None,
+        "prev": encode_fav_cursor(above[0]["ts"], above[0]["tender_id"]) if above else None,
+        "total": favorite_counts[user_id][0] if user_id in favorite_counts else len(items),
+    }
 
-def get_tender_link(tender_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT link FROM tenders WHERE id = %s", (tender_id,))
-        res = cursor.fetchone()
-        return res[0] if res else None
-    finally:
-        cursor.close()
-        conn.close()
+async def get_tender_link(tender_id):
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval("SELECT link FROM tenders WHERE id = $1", int(tender_id))
+
+SEARCH_QUERY = """
+    SELECT id, source, title, link, amount, currency, end_at, category, items_desc, count(*) OVER () AS total
+    FROM tenders, websearch_to_tsquery('russian', $1) AS q
+    WHERE search_tsv @@ q
+    ORDER BY ts_rank_cd(search_tsv, q) DESC, id DESC
+    LIMIT $2 OFFSET $3
+"""
+
+async def save_search_query(user_id, query):
+    """id запроса для кнопок листания; у пользователя храним SEARCH_HISTORY_PER_USER последних."""
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            query_id = await conn.fetchval("""
+                INSERT INTO search_queries (user_id, query) VALUES ($1, $2)
+                ON CONFLICT (user_id, query) DO UPDATE SET created_at = now()
+                RETURNING id
+            """, user_id, query)
+            await conn.execute("""
+                DELETE FROM search_queries WHERE user_id = $1 AND id NOT IN (
+                    SELECT id FROM search_queries WHERE user_id = $1 ORDER BY created_at DESC LIMIT $2)
+            """, user_id, SEARCH_HISTORY_PER_USER)
+    return query_id
+
+async def get_search_query(user_id, query_id):
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval("SELECT query FROM search_queries WHERE id = $1 AND user_id = $2", query_id, user_id)
+
+async def search_tenders(query, limit, offset=0):
+    """Полнотекстовый поиск по GIN-индексу, лучшие совпадения первыми. [dict(..., total), ...]"""
+    async with db_pool.acquire() as conn:
+        return [dict(r) for r in await conn.fetch(SEARCH_QUERY, query, limit, offset)]
+
+# Новые текущие цены пачкой: одна страница списка - один UPDATE. Строки, где цена не изменилась,
+# не трогаем; в RETURNING - и старая, и новая цена (для уведомлений).
+PRICE_UPDATE_QUERY = """
+    UPDATE tenders t SET current_amount = x.new_amount, price_updated_at = now()
+    FROM (
+        SELECT t2.id, t2.current_amount AS old_amount, u.amount AS new_amount
+        FROM unnest($1::text[], $2::numeric[]) AS u(link, amount)
+        JOIN tenders t2 ON t2.link = u.link
+        WHERE t2.current_amount IS DISTINCT FROM u.amount
+    ) x
+    WHERE t.id = x.id
+    RETURNING t.id, t.title, t.link, x.old_amount, x.new_amount
+"""
+
+async def apply_price_updates(prices):
+    """prices - {link: Decimal}. Возвращает изменившиеся лоты."""
+    async with db_pool.acquire() as conn:
+        return await conn.fetch(PRICE_UPDATE_QUERY, list(prices), list(prices.values()))
+
+async def get_open_links(source):
+    # Срок не разобрали (end_at IS NULL) - лот считаем открытым, иначе его цену никто не обновит
+    async with db_pool.acquire() as conn:
+        return {r["link"] for r in await conn.fetch("SELECT link FROM tenders WHERE source = $1 AND (end_at IS NULL OR end_at > now())", source)}
+
+SUBSCRIPTION_COLUMNS = "id, user_id, keywords, regions, min_amount, max_amount, source"
+
+async def load_subscriptions():
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(f"SELECT {SUBSCRIPTION_COLUMNS} FROM subscriptions")
+    subscription_index.clear()
+    for r in rows: subscription_index.add(Subscription(**dict(r)))
+    print(f"🔔 Загружено подписок: {len(rows)}")
+
+async def reload_user_subscriptions(user_id):
+    """Подписки пользователя изменил соседний экземпляр бота - перечитываем только их."""
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(f"SELECT {SUBSCRIPTION_COLUMNS} FROM subscriptions WHERE user_id = $1", user_id)
+    for sub in subscription_index.user_subscriptions(user_id): subscription_index.remove(sub.id)
+    for r in rows: subscription_index.add(Subscription(**dict(r)))
+
+async def _notify_subscriptions_changed(conn, user_id):
+    if BOT_MODE == "webhook": await conn.execute("SELECT pg_notify($1, $2)", SUBSCRIPTIONS_CHANNEL, str(user_id))
+
+async def add_subscription(user_id, spec):
+    """spec - dict из parse_subscription. Возвращает Subscription или None, если лимит исчерпан."""
+    if len(subscription_index.by_user.get(user_id, ())) >= SUBSCRIPTIONS_PER_USER: return None
+    async with db_pool.acquire() as conn:
+        sub_id = await conn.fetchval("""
+            INSERT INTO subscriptions (user_id, keywords, regions, min_amount, max_amount, source)
+            VALUES ($1, $2, $3, $4, $5, $6) RETURNING id
+        """, user_id, spec["keywords"], spec["regions"], spec["min_amount"], spec["max_amount"], spec["source"])
+        await _notify_subscriptions_changed(conn, user_id)
+    sub = Subscription(id=sub_id, user_id=user_id, **spec)
+    subscription_index.add(sub)
+    return sub
+
+async def delete_subscription(user_id, sub_id):
+    async with db_pool.acquire() as conn:
+        await conn.execute("DELETE FROM subscriptions WHERE id = $1 AND user_id = $2", int(sub_id), user_id)
+        await _notify_subscriptions_changed(conn, user_id)
+    subscription_index.remove(int(sub_id), user_id)
 
 # ==========================================
 # === 3. HELPER FUNCTIONS ===
@@ -220,7 +1065,31 @@ def parse_price_to_number(price_str):
             
         clean = re.sub(r'[^\d.]', '', clean)
         return float(clean)
-    except: return 0.0
+    except Exception: return 0.0
+
+def to_amount(value):
+    """Число -> Decimal для NUMERIC; 0 и мусор -> None (цена не указана)."""
+    try: value = float(value)
+    except (TypeError, ValueError): return None
+    return Decimal(f"{value:.2f}") if value > 0 else None
+
+def format_amount(amount, currency=None, default="Не указано"):
+    if amount is None: return default
+    text = "{:,.2f}".format(amount).replace(",", " ").replace(".", ",")
+    return f"{text} {currency}" if currency else text
+
+SITE_DATETIME = re.compile(r"(\d{2})[.-](\d{2})[.-](\d{4})(?:\s*(\d{2}):(\d{2})(?::(\d{2}))?)?")
+
+def parse_site_datetime(value):
+    """"17.10.2026 18:00[:00]" / "17-10-2026" (время площадки) -> datetime с таймзоной или None."""
+    match = SITE_DATETIME.search(value or "")
+    if not match: return None
+    day, month, year, hour, minute, second = (int(g) if g else 0 for g in match.groups())
+    try: return datetime(year, month, day, hour, minute, second, tzinfo=SITE_TZ)
+    except ValueError: return None
+
+def format_site_datetime(value):
+    return value.astimezone(SITE_TZ).strftime("%d.%m.%Y %H:%M") if value else "-"
 
 def format_price_str(price_raw):
     if not price_raw or "нет" in str(price_raw).lower(): return "Не указано"
@@ -228,158 +1097,903 @@ def format_price_str(price_raw):
         val = parse_price_to_number(str(price_raw))
         if val == 0: return "Не указано"
         return "{:,.2f}".format(val).replace(",", " ").replace(".", ",")
-    except: return "Не указано"
+    except Exception: return "Не указано"
+
+# === Движок извлечения полей (компилируется один раз при импорте) ===
+
+class PhraseMatcher:
+    """Поиск фраз из списка без учета регистра. Фразы приводятся к нижнему регистру
+    один раз при импорте, текст - один раз на вызов (раньше - на каждую фразу).
+    first() возвращает фразу с наивысшим приоритетом в списке - как цикл
+    `for p in phrases: if p.lower() in text.lower()`.
+    Поиск подстроки в CPython быстрее, чем IGNORECASE-альтернация в модуле re."""
+
+    def __init__(self, phrases):
+        self.phrases = list(phrases)
+        self._lowered = [(p.lower(), p) for p in self.phrases]
+
+    def search(self, text):
+        lowered = text.lower()
+        return any(p in lowered for p, _ in self._lowered)
+
+    def first(self, text, default=None):
+        lowered = text.lower()
+        return next((original for p, original in self._lowered if p in lowered), default)
+
+class FieldSpec:
+    """Декларативный набор полей: {имя: (метка, шаблон значения)}.
+    Значения в шаблоне - именованные группы (?P<value>...), (?P<amount>...) и т.п.
+    Метки всех полей собраны в одну альтернацию, которая ищется по тексту в нижнем
+    регистре (без медленного IGNORECASE). В каждой найденной позиции все поля
+    проверяются одним составным lookahead-шаблоном. Первое совпадение каждого поля то же,
+    что дал бы отдельный re.search, а текст просматривается один раз.
+    Метки - литералы, \\s и .? (их можно безопасно привести к нижнему регистру)."""
+
+    def __init__(self, fields, flags=re.IGNORECASE):
+        self.names = list(fields)
+        labels = "|".join(f"(?:{label})" for label, _ in fields.values())
+        self._guard = re.compile(labels.lower())
+        self._guard_ic = re.compile(labels, flags)
+        parts = []
+        for name, (label, rest) in fields.items():
+            body = f"(?:{label}){rest}".replace("(?P<", f"(?P<{name}__")
+            parts.append(f"(?:(?=(?P<{name}>{body}))|)")
+        self._at = re.compile("".join(parts), flags)
+        self._groups = {name: [g for g in self._at.groupindex if g.startswith(name + "__")] for name in self.names}
+
+    def extract(self, text):
+        """{поле: {"match": все совпадение, "value": ..., ...}} - только для найденных полей."""
+        lowered = text.lower()
+        # Редкие символы меняют длину при lower() - тогда ищем метки по исходному тексту
+        guard, haystack = (self._guard, lowered) if len(lowered) == len(text) else (self._guard_ic, text)
+        found = {}
+        m = guard.search(haystack)
+        while m and len(found) < len(self.names):
+            at = self._at.match(text, m.start())
+            for name in self.names:
+                if name in found or at.group(name) is None: continue
+                found[name] = {"match": at.group(name), **{g.split("__", 1)[1]: at.group(g) for g in self._groups[name]}}
+            m = guard.search(haystack, m.start() + 1)
+        return found
+
+REGION_MATCHER = PhraseMatcher(REGIONS_LIST)
+KEYWORD_MATCHER = PhraseMatcher(TARGET_KEYWORDS)
 
-def save_to_google_sheet(source_name, row_data):
-    if not os.path.exists(GOOGLE_KEY_FILE): return
-    try:
-        client = gspread.service_account(filename=GOOGLE_KEY_FILE)
-        sheet = client.open(GOOGLE_SHEET_NAME)
-        
-        try:
-            worksheet = sheet.worksheet(source_name)
-        except gspread.WorksheetNotFound:
-            # === ЗАГОЛОВКИ ДЛЯ ETENDER (БЕЗ "Текущая цена" и "Участников") ===
-            if source_name == "Etender":
-                cols = "20"
-                headers = [
-                    "Дата парсинга", 
-                    "Тип анкеты", 
-                    "Номер лота", 
-                    "Описание товаров", 
-                    "Квалификация (Toifa)", 
-                    "Заказчик", 
-                    "ИНН Заказчика", 
-                    "Начальная цена", 
-                    "Валюта", 
-                    # "Текущая цена" - УБРАНО
-                    "Регион", 
-                    "Дата начала", 
-                    "Срок окончания", 
-                    "Срок доставки", 
-                    # "Участников" - УБРАНО
-                    "Контакты", 
-                    "Ссылка"
-                ]
-            elif source_name == "IT-Market":
-                cols = "6"
-                headers = ["Дата парсинга", "Заказчик", "Статус", "Задача", "Бюджет", "Ссылка"]
-            else:
-                # Xarid.uz (ОСТАВЛЯЕМ КАК ЕСТЬ)
-                cols = "20"
-                headers = [
-                    "Дата парсинга", "Тип анкеты", "Номер лота", "Описание товаров", 
-                    "Название/Квалификация", "Заказчик", "Начальная цена", "Текущая цена", 
-                    "Регион", "Дата начала", "Срок окончания", "Срок доставки", 
-                    "Участников", "Контакты", "Ссылка"
-                ]
-            
-            worksheet = sheet.add_worksheet(title=source_name, rows="1000", cols=cols)
-            worksheet.append_row(headers)
-            try:
-                body = {"requests": [{"repeatCell": {"range": {"sheetId": worksheet.id, "startRowIndex": 0, "endRowIndex": 1}, "cell": {"userEnteredFormat": {"textFormat": {"bold": True}}}, "fields": "userEnteredFormat.textFormat.bold"}}]}
-                sheet.batch_update(body)
-            except: pass
-        
-        # Преобразуем все данные в строки
-        safe_row = [str(x) if x is not None else "" for x in row_data]
-        worksheet.append_row(safe_row)
-        print(f"✅ [Google] Записано в лист '{source_name}'")
-        
-    except Exception as e:
-        print(f"⚠️ Ошибка Google Sheets ({source_name}): {e}")
+# ==========================================
+# === 3.2 TELEGRAM OUTBOX (ОЧЕРЕДЬ С ЛИМИТАМИ) ===
+# ==========================================
 
-async def send_notification_to_channel(text, source_name, photo_path=None):
-    if not ADMIN_CHANNEL_ID: return
-    thread_id = TOPIC_MAP.get(source_name)
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity.
+    pause() - принудительная пауза (например, retry_after от Telegram)."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+chat_buckets = {}   # chat_id -> TokenBucket
+topic_buckets = {}  # (chat_id, thread_id) -> TokenBucket
+photo_file_ids = {} # путь к картинке -> file_id, чтобы не загружать один и тот же JPEG заново
+outbox_wakeup = asyncio.Event()
+
+def get_photo_input(photo_path):
+    return photo_file_ids.get(photo_path) or FSInputFile(photo_path)
+
+def remember_photo(photo_path, sent_message):
+    if sent_message and sent_message.photo and photo_path not in photo_file_ids:
+        photo_file_ids[photo_path] = sent_message.photo[-1].file_id
+
+global_bucket = None  # общий лимит бота на все чаты (создается в работающем event loop)
+
+def _global_bucket():
+    global global_bucket
+    if global_bucket is None: global_bucket = TokenBucket(OUTBOX_GLOBAL_RATE, OUTBOX_GLOBAL_RATE)
+    return global_bucket
+
+def _chat_bucket(chat_id):
+    if chat_id not in chat_buckets: chat_buckets[chat_id] = TokenBucket(OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST)
+    return chat_buckets[chat_id]
+
+def _topic_bucket(chat_id, thread_id):
+    key = (chat_id, thread_id)
+    if key not in topic_buckets: topic_buckets[key] = TokenBucket(OUTBOX_TOPIC_RATE, OUTBOX_TOPIC_BURST)
+    return topic_buckets[key]
+
+async def _deliver(chat_id, thread_id, text, photo_path):
+    if photo_path and os.path.exists(photo_path):
+        with metrics.timer("tender_telegram_send_seconds", kind="photo"):
+            sent = await bot.send_photo(chat_id=chat_id, photo=get_photo_input(photo_path), caption=text, parse_mode="HTML", message_thread_id=thread_id)
+        remember_photo(photo_path, sent)
+    else:
+        with metrics.timer("tender_telegram_send_seconds", kind="text"):
+            await bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML", message_thread_id=thread_id, disable_web_page_preview=True)
+    metrics.inc("tender_telegram_sent_total")
+
+async def send_notifications_to_channel(messages):
+    """[(text, source_name, photo_path), ...] -> постоянная очередь outbox одним INSERT
+    (порядок сохраняется); доставляет outbox_worker()."""
+    if not ADMIN_CHANNEL_ID or not messages: return
     try:
-        if photo_path and os.path.exists(photo_path):
-            photo = FSInputFile(photo_path)
-            await bot.send_photo(chat_id=ADMIN_CHANNEL_ID, photo=photo, caption=text, parse_mode="HTML", message_thread_id=thread_id)
-        else:
-            await bot.send_message(chat_id=ADMIN_CHANNEL_ID, text=text, parse_mode="HTML", message_thread_id=thread_id, disable_web_page_preview=True)
+        async with db_pool.acquire() as conn:
+            await conn.execute(
+                "INSERT INTO outbox (chat_id, thread_id, text, photo_path) "
+                "SELECT $1, t, x, p FROM unnest($2::int[], $3::text[], $4::text[]) AS u(t, x, p)",
+                str(ADMIN_CHANNEL_ID), [TOPIC_MAP.get(source) for _, source, _ in messages],
+                [text for text, _, _ in messages], [photo for _, _, photo in messages]
+            )
+            if NOTIFY_PEERS: await conn.execute("SELECT pg_notify($1, '')", OUTBOX_CHANNEL)
+        outbox_wakeup.set()
     except Exception as e:
-        print(f"⚠️ Telegram Error: {e}")
+        print(f"⚠️ Outbox Error: {e}")
+
+async def _deliver_group(rows):
+    """Сообщения одного топика отправляются строго по порядку."""
+    for row in rows:
+        chat_id, thread_id = row["chat_id"], row["thread_id"]
+        await _topic_bucket(chat_id, thread_id).acquire()
+        await _chat_bucket(chat_id).acquire()
+        await _global_bucket().acquire()
+        try:
+            await _deliver(chat_id, thread_id, row["text"], row["photo_path"])
+            async with db_pool.acquire() as conn:
+                await conn.execute("DELETE FROM outbox WHERE id = $1", row["id"])
+        except TelegramRetryAfter as e:
+            metrics.inc("tender_telegram_errors_total", error="RetryAfter")
+            # Telegram сам сказал, сколько ждать: тормозим весь чат и откладываем остаток топика
+            _chat_bucket(chat_id).pause(e.retry_after)
+            async with db_pool.acquire() as conn:
+                await conn.execute(
+                    "UPDATE outbox SET next_attempt_at = now() + make_interval(secs => $2) WHERE id = ANY($1::bigint[])",
+                    [r["id"] for r in rows[rows.index(row):]], float(e.retry_after)
+                )
+            print(f"⏳ Telegram 429: пауза {e.retry_after} с")
+            return
+        except Exception as e:
+            metrics.inc("tender_telegram_errors_total", error=type(e).__name__)
+            attempts = row["attempts"] + 1
+            async with db_pool.acquire() as conn:
+                # BadRequest - сообщение битое, Forbidden - пользователь заблокировал бота: повтор не поможет
+                if isinstance(e, (TelegramBadRequest, TelegramForbiddenError)) or attempts >= OUTBOX_MAX_ATTEMPTS:
+                    await conn.execute("DELETE FROM outbox WHERE id = $1", row["id"])
+                    print(f"⚠️ Telegram Error (сообщение отброшено): {e}")
+                    continue
+                await conn.execute(
+                    "UPDATE outbox SET attempts = $2, next_attempt_at = now() + make_interval(secs => $3) WHERE id = $1",
+                    row["id"], attempts, float(min(2 ** attempts * 5, 600))
+                )
+            print(f"⚠️ Telegram Error (повтор {attempts}/{OUTBOX_MAX_ATTEMPTS}): {e}")
+            return
+
+async def outbox_worker():
+    print("📮 Outbox worker started...")
+    while True:
+        try:
+            async with db_pool.acquire() as conn:
+                rows = await conn.fetch(
+                    "SELECT id, chat_id, thread_id, text, photo_path, attempts FROM outbox "
+                    "WHERE next_attempt_at <= now() ORDER BY id LIMIT $1", OUTBOX_BATCH_SIZE
+                )
+            groups = defaultdict(list)
+            for row in rows: groups[(row["chat_id"], row["thread_id"])].append(row)
+            if groups:
+                await asyncio.gather(*(_deliver_group(g) for g in groups.values()))
+                if len(rows) == OUTBOX_BATCH_SIZE: continue
+        except Exception as e:
+            print(f"⚠️ Outbox worker error: {e}")
+        outbox_wakeup.clear()
+        try: await asyncio.wait_for(outbox_wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError: pass
 
 # ==========================================
-# === 4. PARSING LOGIC: ETENDER ===
+# === 3.3 ПОДПИСКИ (ИНВЕРТИРОВАННЫЙ ИНДЕКС) ===
 # ==========================================
 
+SUB_GRAM = 5  # Ключ индекса - подстрока из 5 символов (короче - фраза целиком)
+
+def _grams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+def _anchor(phrase):
+    """Подстрока фразы, под которой подписка лежит в индексе. matches() ищет фразу подстрокой,
+    а раз фраза есть в тексте - есть и любая ее подстрока: "наблюдение" найдется и в
+    "видеонаблюдение", "ноут" - в "ноутбук". Берем середину самого длинного слова - она реже."""
+    phrase = phrase.lower()
+    if len(phrase) <= SUB_GRAM: return phrase or None
+    word = max(re.findall(r"\w+", phrase), key=len, default="")
+    if len(word) < SUB_GRAM: return phrase[:SUB_GRAM]
+    start = (len(word) - SUB_GRAM) // 2
+    return word[start:start + SUB_GRAM]
+
+class Subscription:
+    """Фильтр пользователя. Внутри списков - ИЛИ, между видами фильтров - И.
+    keywords/regions - фразы в нижнем регистре, ищутся подстрокой (так ловятся окончания)."""
+    __slots__ = ("id", "user_id", "keywords", "regions", "min_amount", "max_amount", "source")
+
+    def __init__(self, id, user_id, keywords=(), regions=(), min_amount=None, max_amount=None, source=None):
+        self.id, self.user_id, self.source = id, user_id, source
+        self.keywords = [k.lower() for k in keywords or ()]
+        self.regions = [r.lower() for r in regions or ()]
+        self.min_amount, self.max_amount = min_amount, max_amount
+
+    def anchors(self):
+        if self.keywords: return {("w", _anchor(k)) for k in self.keywords if _anchor(k)}
+        if self.regions: return {("r", _anchor(r)) for r in self.regions if _anchor(r)}
+        return {("s", self.source or "*")}
+
+    def matches(self, lot):
+        if self.source and self.source != lot["source"]: return False
+        if self.keywords and not any(k in lot["text"] for k in self.keywords): return False
+        if self.regions and not any(r in lot["region"] for r in self.regions): return False
+        if self.min_amount is not None or self.max_amount is not None:
+            # Диапазон цены задается в сумах - лоты в валюте и без цены под него не подходят
+            amount = lot["amount"]
+            if amount is None or lot["currency"] != "UZS": return False
+            if self.min_amount is not None and amount < self.min_amount: return False
+            if self.max_amount is not None and amount > self.max_amount: return False
+        return True
+
+    def describe(self):
+        parts = []
+        if self.keywords: parts.append("🔑 " + ", ".join(self.keywords))
+        if self.regions: parts.append("📍 " + ", ".join(self.regions))
+        if self.min_amount is not None or self.max_amount is not None:
+            parts.append(f"💰 {format_amount(self.min_amount, default='0')} - {format_amount(self.max_amount, default='∞')}")
+        parts.append("🏛 " + (self.source or "все площадки"))
+        return "\n".join(parts)
+
+class SubscriptionIndex:
+    """Инвертированный индекс: ключ -> id подписок. Подписка лежит только под своими якорями
+    (подстроки ключевых слов, иначе регионов, иначе площадка). Новый лот собирает кандидатов
+    по своим ключам и проверяет только их - работа пропорциональна совпадениям, а не числу пользователей."""
+
+    def __init__(self):
+        self.subs = {}                   # id -> Subscription
+        self.by_user = {}                # user_id -> {id, ...}
+        self.postings = defaultdict(set) # ("w"|"r"|"s", ключ) -> {id, ...}
+        self.lengths = {"w": defaultdict(int), "r": defaultdict(int)}  # длина ключа -> сколько таких ключей
+
+    def clear(self):
+        self.subs.clear(); self.by_user.clear(); self.postings.clear()
+        for lengths in self.lengths.values(): lengths.clear()
+
+    def add(self, sub):
+        self.subs[sub.id] = sub
+        self.by_user.setdefault(sub.user_id, set()).add(sub.id)
+        for key in sub.anchors():
+            if not self.postings[key] and key[0] in self.lengths: self.lengths[key[0]][len(key[1])] += 1
+            self.postings[key].add(sub.id)
+
+    def remove(self, sub_id, user_id=None):
+        sub = self.subs.get(sub_id)
+        if sub is None or (user_id is not None and sub.user_id != user_id): return False
+        del self.subs[sub_id]
+        self.by_user[sub.user_id].discard(sub_id)
+        if not self.by_user[sub.user_id]: del self.by_user[sub.user_id]
+        for key in sub.anchors():
+            self.postings[key].discard(sub_id)
+            if not self.postings[key]:
+                del self.postings[key]
+                if key[0] in self.lengths:
+                    lengths = self.lengths[key[0]]
+                    lengths[len(key[1])] -= 1
+                    if not lengths[len(key[1])]: del lengths[len(key[1])]
+        return True
+
+    def user_subscriptions(self, user_id):
+        return [self.subs[i] for i in sorted(self.by_user.get(user_id, ()))]
+
+    def match(self, lot):
+        """lot - dict(source, text, region, amount, currency), text/region в нижнем регистре.
+        Возвращает user_id получателей (каждый - один раз)."""
+        # Ключи лота - его подстроки тех длин, что есть в индексе (обычно SUB_GRAM и пара коротких)
+        keys = {("s", lot["source"]), ("s", "*")}
+        for kind, text in (("w", lot["text"]), ("r", lot["region"])):
+            for n in self.lengths[kind]: keys.update((kind, g) for g in _grams(text, n))
+        candidates = set()
+        for key in keys:
+            ids = self.postings.get(key)
+            if ids: candidates |= ids
+        return {self.subs[i].user_id for i in candidates if self.subs[i].matches(lot)}
+
+subscription_index = SubscriptionIndex()
+
+def parse_subscription(text):
+    """'сервер, ноутбук; регион: Ташкент; цена: 5000000-100000000; площадка: Etender' -> dict.
+    Первая часть без подписи - ключевые слова. ValueError - с понятным пользователю текстом."""
+    spec = {"keywords": [], "regions": [], "min_amount": None, "max_amount": None, "source": None}
+    for part in (p.strip() for p in (text or "").split(";")):
+        if not part: continue
+        key, sep, value = part.partition(":")
+        key = key.strip().lower() if sep else "ключевые слова"
+        value = value if sep else part
+        items = [v.strip() for v in value.split(",") if v.strip()]
+        if key in ("ключевые слова", "слова", "kw"): spec["keywords"] += items
+        elif key in ("регион", "регионы", "район"): spec["regions"] += items
+        elif key in ("цена", "бюджет"):
+            low, _, high = value.partition("-")
+            spec["min_amount"] = to_amount(parse_price_to_number(low)) if low.strip() else None
+            spec["max_amount"] = to_amount(parse_price_to_number(high)) if high.strip() else None
+        elif key in ("площадка", "источник"):
+            sources = [s for s in SOURCE_TIMEOUTS if s in TOPIC_MAP]
+            source = next((s for s in sources if s.lower() == value.strip().lower()), None)
+            if source is None: raise ValueError(f"Неизвестная площадка. Доступны: {', '.join(sources)}")
+            spec["source"] = source
+        else: raise ValueError(f"Непонятный фильтр: {key}")
+    if not (spec["keywords"] or spec["regions"] or spec["source"] or spec["min_amount"] or spec["max_amount"]):
+        raise ValueError("Пустая подписка")
+    return spec
+
+async def notify_subscribers(source, title, link, fields):
+    """Новый лот -> подписчики. Подбор по индексу в памяти, доставка - одной пачкой в outbox."""
+    lot = {
+        "source": source, "amount": fields.get("amount"), "currency": fields.get("currency"),
+        "text": " ".join(filter(None, (title, fields.get("items_desc"), fields.get("category"), fields.get("customer")))).lower(),
+        "region": (fields.get("region") or "").lower(),
+    }
+    user_ids = subscription_index.match(lot)
+    if not user_ids: return
+    text = (f"🔔 <b>Новый лот по вашей подписке</b>\n\n🏛 {source}\n📂 {title}\n"
+            f"📍 {fields.get('region') or 'Не указан'}\n💰 {format_amount(fields.get('amount'), fields.get('currency'))}\n"
+            f"⏳ {format_site_datetime(fields.get('end_at'))}\n🔗 {link}")
+    try:
+        async with db_pool.acquire() as conn:
+            await conn.execute(
+                "INSERT INTO outbox (chat_id, thread_id, text) SELECT u, NULL, $2 FROM unnest($1::text[]) AS u",
+                [str(u) for u in user_ids], text
+            )
+        outbox_wakeup.set()
+    except Exception as e:
+        print(f"⚠️ Outbox Error: {e}")
+
+def _is_blocked_host(url):
+    host = urlsplit(url).hostname or ""
+    return any(host == h or host.endswith("." + h) for h in BLOCKED_HOSTS)
+
+async def _route_request(route):
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or _is_blocked_host(request.url):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def setup_request_blocking(context):
+    """Режет картинки/шрифты/CSS и трекеры на уровне BrowserContext (см. BLOCKED_*)."""
+    if BLOCKED_RESOURCE_TYPES or BLOCKED_HOSTS:
+        await context.route("**/*", _route_request)
+
+# === Темп запросов к площадкам: AIMD на сайт ===
+class LimiterSlot:
+    """Один запрос через AdaptiveLimiter; report() - HTTP-статус ответа (и Retry-After)."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.status = None
+        self.retry_after = None
+
+    def report(self, status, retry_after=None):
+        self.status = status
+        try: self.retry_after = float(retry_after) if retry_after else None
+        except ValueError: self.retry_after = None  # Retry-After датой - берем CRAWL_BACKOFF_PAUSE
+
+def _is_throttle_error(error):
+    """Таймауты и обрывы соединения - сайт не справляется или режет нас. Ошибки разбора - нет."""
+    if isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError)): return True
+    # playwright.TimeoutError и net::ERR_CONNECTION_RESET / ERR_TIMED_OUT у goto
+    return type(error).__name__ == "TimeoutError" or "net::ERR_" in str(error)
+
+class AdaptiveLimiter:
+    """Окно одновременных запросов и интервал между стартами для одного сайта (AIMD, как в TCP).
+    Успех: окно +1/окно, интервал x0.95. Таймаут, 429, 5xx: окно и скорость - вдвое,
+    сайт на паузе (Retry-After или CRAWL_BACKOFF_PAUSE). Запросы, начатые до последнего
+    снижения, повторно не снижают - пачка одновременных таймаутов считается одним сигналом."""
+
+    def __init__(self, site):
+        self.site = site
+        self.limit = float(CRAWL_START_CONCURRENCY)
+        self.interval = CRAWL_START_INTERVAL
+        self.in_flight = 0
+        self._next_start = 0.0
+        self._paused_until = 0.0
+        self._backed_off_at = 0.0
+        self._lock = asyncio.Lock()      # Стартуем по одному, в порядке очереди
+        self._released = asyncio.Event()
+        self._publish()
+
+    def _publish(self):
+        metrics.set("tender_crawl_site_concurrency", self.limit, site=self.site)
+        metrics.set("tender_crawl_site_interval_seconds", self.interval, site=self.site)
+
+    async def _acquire(self):
+        async with self._lock:
+            while True:
+                delay = max(self._paused_until, self._next_start) - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                if self.in_flight < int(self.limit): break
+                self._released.clear()
+                await self._released.wait()
+            self.in_flight += 1
+            self._next_start = time.monotonic() + self.interval
+
+    def _release(self, slot, error, completed):
+        self.in_flight -= 1
+        self._released.set()
+        if slot.status is not None: throttled = slot.status == 429 or slot.status >= 500
+        else: throttled = error is not None and _is_throttle_error(error)
+        if throttled:
+            reason = str(slot.status) if slot.status is not None else type(error).__name__
+            metrics.inc("tender_crawl_site_throttled_total", site=self.site, reason=reason)
+            if slot.started < self._backed_off_at: return
+            now = time.monotonic()
+            self._backed_off_at = now
+            self.limit = max(1.0, self.limit / 2)
+            self.interval = min(CRAWL_MAX_INTERVAL, max(self.interval * 2, CRAWL_MIN_INTERVAL))
+            self._paused_until = max(self._paused_until, now + (slot.retry_after or CRAWL_BACKOFF_PAUSE))
+            print(f"🐢 {self.site}: {reason} - окно {self.limit:.1f}, интервал {self.interval:.2f} с")
+        elif completed:
+            self.limit = min(float(CRAWL_MAX_CONCURRENCY), self.limit + 1 / self.limit)
+            self.interval = max(CRAWL_MIN_INTERVAL, self.interval * 0.95)
+        self._publish()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        await self._acquire()
+        slot, error, completed = LimiterSlot(), None, False
+        try:
+            yield slot
+            completed = True
+        except Exception as e:
+            error = e
+            raise
+        finally: self._release(slot, error, completed)  # Отмена (CancelledError) темп не меняет
+
+crawl_limiters = {}  # сайт -> AdaptiveLimiter
+
+def crawl_limiter(url):
+    """Лимитер сайта по URL: etender.uzex.uz, apietender.uzex.uz и xarid.uzex.uz -> "uzex.uz".
+    Прочие хосты (в т.ч. 127.0.0.1 и localhost стаба) - по полному имени."""
+    host = urlsplit(url).hostname or ""
+    site = next((group for group in CRAWL_SITE_GROUPS if host == group or host.endswith("." + group)), host)
+    if site not in crawl_limiters: crawl_limiters[site] = AdaptiveLimiter(site)
+    return crawl_limiters[site]
+
+async def limited_goto(page, url, **kwargs):
+    """page.goto через лимитер сайта: статус ответа и таймауты подстраивают темп."""
+    async with crawl_limiter(url).slot() as slot:
+        response = await page.goto(url, **kwargs)
+        if response is not None: slot.report(response.status, response.headers.get("retry-after"))
+        return response
+
+async def click_next_and_wait(page, next_btn, item_selector, timeout=15000):
+    """Кликает "следующая страница" и ждет, пока первая карточка списка сменится,
+    вместо фиксированной паузы. Клик грузит страницу с сайта - тоже через лимитер."""
+    first = page.locator(item_selector).first
+    prev = await first.evaluate("el => el.outerHTML") if await first.count() > 0 else ""
+    async with crawl_limiter(page.url).slot():
+        await next_btn.click()
+        await page.wait_for_function(
+            "([sel, prev]) => { const el = document.querySelector(sel); return !!el && el.outerHTML !== prev; }",
+            arg=[item_selector, prev], timeout=timeout
+        )
+
+class PagePool:
+    """Ограниченный пул переиспользуемых вкладок одного BrowserContext (или CrawlSession).
+    Не больше size вкладок одновременно; свободные вкладки отдаются повторно,
+    а закрытые/упавшие просто выбрасываются и создаются заново."""
+
+    def __init__(self, context, size=DETAIL_CONCURRENCY, max_uses=PAGE_MAX_USES):
+        self.context = context
+        self.size = size
+        self.max_uses = max_uses
+        self._sem = asyncio.Semaphore(size)
+        self._idle = []
+        self._uses = {}  # page -> сколько раз выдана; старую вкладку меняем, чтобы не копила память JS
+
+    @contextlib.asynccontextmanager
+    async def page(self):
+        await self._sem.acquire()
+        page = None
+        try:
+            while self._idle and page is None:
+                candidate = self._idle.pop()
+                if not candidate.is_closed(): page = candidate
+            if page is None: page = await self.context.new_page()
+            yield page
+        finally:
+            if page is not None and not page.is_closed():
+                uses = self._uses.pop(page, 0) + 1
+                if uses < self.max_uses:
+                    self._uses[page] = uses
+                    self._idle.append(page)
+                else:
+                    try: await page.close()
+                    except Exception as e: record_error("browser", "page_close", e)
+            self._sem.release()
+
+    async def close(self):
+        while self._idle:
+            try: await self._idle.pop().close()
+            except Exception as e: record_error("browser", "page_close", e)
+        self._uses.clear()
+
+class CrawlSession:
+    """BrowserContext прохода площадки, который открывается при первой вкладке. Если HTTP fast path
+    отработал и новых лотов нет, проход не запускает Chromium и не создает ни контекста, ни вкладок."""
+
+    def __init__(self, browsers):
+        self.browsers = browsers
+        self._stack = contextlib.AsyncExitStack()
+        self._context = None
+        self._listing = None
+        self._lock = asyncio.Lock()
+
+    async def new_page(self):
+        async with self._lock:
+            if self._context is None: self._context = await self._stack.enter_async_context(self.browsers.context())
+        return await self._context.new_page()
+
+    async def listing_page(self):
+        """Вкладка для страниц списка - только на fallback через Playwright."""
+        if self._listing is None or self._listing.is_closed(): self._listing = await self.new_page()
+        return self._listing
+
+    async def close(self):
+        await self._stack.aclose()
+
+def process_tree_rss(root_pid=None):
+    """Суммарный RSS всех потомков процесса (драйвер Playwright и Chromium), байт. Не Linux - None."""
+    if not os.path.isdir("/proc"): return None
+    root_pid = root_pid or os.getpid()
+    children, rss = defaultdict(list), {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit(): continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as f: stat = f.read().decode(errors="replace")
+        except OSError: continue
+        # Имя процесса в скобках может содержать пробелы - поля считаем после последней ')'
+        fields = stat[stat.rfind(")") + 2:].split()
+        children[int(fields[1])].append(int(entry))
+        rss[int(entry)] = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    total, stack = 0, list(children[root_pid])
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(children[pid])
+    return total
+
+class BrowserPool:
+    """Chromium процесса с управляемым жизненным циклом. Проходы и пачки задач берут
+    BrowserContext через context(). Браузер (вместе с драйвером Playwright) запускается
+    заново после BROWSER_MAX_NAVIGATIONS переходов, при RSS выше BROWSER_MAX_RSS_MB и после
+    падения. Плановая замена ждет, пока выданные контексты закроются (до BROWSER_DRAIN_TIMEOUT)."""
+
+    def __init__(self):
+        self.playwright = None
+        self.browser = None
+        self.active = 0             # Выданные и еще не закрытые контексты
+        self.navigations = 0        # Переходов с последнего запуска
+        self.launches = 0
+        self.crashes = 0
+        self.recycle_reason = None  # Почему браузер пора заменить (None - не пора)
+        self.launched_at = None
+        self.last_error = None
+        self.rss = None
+        self._lock = asyncio.Lock()
+        self._drained = asyncio.Condition()
+
+    async def _launch(self):
+        await self._shutdown()
+        self.playwright = await async_playwright().start()
+        browser = await self.playwright.chromium.launch(headless=True)
+        browser.on("disconnected", self._on_disconnected)
+        self.browser, self.navigations, self.recycle_reason = browser, 0, None
+        self.launches += 1
+        self.launched_at = time.monotonic()
+        self.last_error = None
+        metrics.inc("tender_browser_launches_total")
+        print(f"🌐 Chromium запущен (#{self.launches})")
+
+    async def _shutdown(self):
+        browser, playwright = self.browser, self.playwright
+        self.browser = self.playwright = None
+        if browser is not None:
+            try: await browser.close()
+            except Exception as e: record_error("browser", "browser_close", e)
+        if playwright is not None:
+            try: await playwright.stop()
+            except Exception as e: record_error("browser", "playwright_stop", e)
+
+    def _on_disconnected(self, browser):
+        if browser is not self.browser: return  # Закрыли сами при замене
+        self.crashes += 1
+        self.recycle_reason = "crash"
+        metrics.inc("tender_browser_crashes_total")
+        print("💥 Chromium упал - перезапущу к следующему проходу")
+
+    def _on_page(self, page):
+        page.on("framenavigated", lambda frame: frame == page.main_frame and self._on_navigation())
+
+    def _on_navigation(self):
+        self.navigations += 1
+        metrics.inc("tender_browser_navigations_total")
+        if self.navigations >= BROWSER_MAX_NAVIGATIONS and self.recycle_reason is None: self.recycle_reason = "navigations"
+
+    def check_memory(self):
+        self.rss = process_tree_rss()
+        if self.rss is not None:
+            metrics.set("tender_browser_rss_bytes", self.rss)
+            if BROWSER_MAX_RSS_MB and self.rss > BROWSER_MAX_RSS_MB * 1024 * 1024 and self.recycle_reason is None:
+                self.recycle_reason = "rss"
+
+    async def _ensure(self):
+        async with self._lock:
+            if self.browser is not None and self.browser.is_connected() and self.recycle_reason is None: return
+            reason = self.recycle_reason or "start"
+            if self.browser is not None and self.browser.is_connected() and self.active:
+                # Новых контекстов не выдаем (держим lock), ждем текущие проходы
+                print(f"♻️ Chromium: замена ({reason}), жду {self.active} активных контекстов...")
+                try:
+                    async with self._drained:
+                        await asyncio.wait_for(self._drained.wait_for(lambda: self.active == 0), timeout=BROWSER_DRAIN_TIMEOUT)
+                except asyncio.TimeoutError:
+                    print("⚠️ Chromium: не дождался контекстов, заменяю принудительно")
+            if reason != "start": metrics.inc("tender_browser_recycles_total", reason=reason)
+            try: await self._launch()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                metrics.inc("tender_browser_launch_errors_total")
+                raise
+
+    @contextlib.asynccontextmanager
+    async def context(self):
+        """Новый BrowserContext (viewport, блокировка ресурсов); закрывается на выходе."""
+        await self._ensure()
+        self.active += 1
+        context = None
+        try:
+            context = await self.browser.new_context(viewport={'width': 1920, 'height': 1080})
+            context.on("page", self._on_page)
+            await setup_request_blocking(context)
+            yield context
+        finally:
+            if context is not None:
+                try: await context.close()
+                except Exception as e: record_error("browser", "context_close", e)
+            self.active -= 1
+            self.check_memory()
+            async with self._drained: self._drained.notify_all()
+
+    def health(self):
+        connected = self.browser is not None and self.browser.is_connected()
+        return {
+            "connected": connected,
+            "launches": self.launches,
+            "crashes": self.crashes,
+            "active_contexts": self.active,
+            "navigations": self.navigations,
+            "rss_mb": round(self.rss / 1024 / 1024, 1) if self.rss is not None else None,
+            "uptime": round(time.monotonic() - self.launched_at) if connected else 0,
+            "recycle_pending": self.recycle_reason,
+            "last_error": self.last_error,
+        }
+
+    async def close(self):
+        async with self._lock: await self._shutdown()
+
+browser_pool = None  # BrowserPool процесса, если он парсит (для /healthz/browser и метрик)
+
 # ==========================================
-# === 3. ФУНКЦИЯ ЗАПИСИ В GOOGLE SHEETS ===
+# === 3.1 GOOGLE SHEETS (БУФЕРИЗОВАННАЯ ЗАПИСЬ) ===
 # ==========================================
 
-def save_to_google_sheet(source_name, row_data):
-    if not os.path.exists(GOOGLE_KEY_FILE): return
-    try:
-        client = gspread.service_account(filename=GOOGLE_KEY_FILE)
-        sheet = client.open(GOOGLE_SHEET_NAME)
-        
+SHEET_HEADERS = {
+    "Etender": [
+        "Дата парсинга", "Тип анкеты", "Номер лота", "Описание товаров", "Квалификация (Toifa)",
+        "ИНН Заказчика", "Заказчик", "Начальная цена", "Валюта", "Регион",
+        "Дата начала", "Срок окончания", "Срок доставки", "Контакты", "Ссылка"
+    ],
+    "IT-Market": ["Дата парсинга", "Заказчик", "Статус", "Задача", "Бюджет", "Ссылка"],
+    "Xarid.uz": [
+        "Дата парсинга", "Тип анкеты", "Номер лота", "Описание товаров",
+        "Название/Квалификация", "Заказчик", "Начальная цена", "Текущая цена",
+        "Регион", "Дата начала", "Срок окончания", "Срок доставки",
+        "Участников", "Контакты", "Ссылка"
+    ],
+}
+
+class SheetsSink:
+    """Пишет строки в Google Sheets пачками из фонового потока.
+    Авторизация и открытие таблицы - один раз, листы кэшируются. Строки копятся
+    по площадкам и уходят одним append_rows, когда набралось batch_size строк
+    или прошло flush_interval секунд. Любая ошибка повторяется с растущей паузой
+    (SHEETS_MAX_RETRIES раз), потом строки возвращаются в буфер до следующего сброса,
+    но не больше SHEETS_MAX_REQUEUES сбросов подряд."""
+
+    def __init__(self, key_file, sheet_name, batch_size=SHEETS_BATCH_SIZE, flush_interval=SHEETS_FLUSH_INTERVAL, retry_delay=5):
+        self.key_file = key_file
+        self.sheet_name = sheet_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self._failures = defaultdict(int)  # Площадка -> неудачных сбросов подряд
+        self._buffers = defaultdict(list)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._sheet = None
+        self._worksheets = {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sheets-sink", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30):
+        self._stop.set()
+        self._wake.set()
+        if self._thread: self._thread.join(timeout)
+
+    def add(self, source_name, row_data):
+        # int оставляем int (без .0), None -> пустая ячейка
+        safe_row = []
+        for x in row_data:
+            if isinstance(x, float) and x.is_integer(): safe_row.append(int(x))
+            elif x is None: safe_row.append("")
+            else: safe_row.append(x)
+        with self._lock:
+            self._buffers[source_name].append(safe_row)
+            if len(self._buffers[source_name]) >= self.batch_size: self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._flush_all()
+        self._flush_all()
+
+    def _flush_all(self):
+        with self._lock:
+            pending = {k: v for k, v in self._buffers.items() if v}
+            self._buffers.clear()
+        for source_name, rows in pending.items():
+            self._flush(source_name, rows)
+
+    def _flush(self, source_name, rows):
+        for attempt in range(SHEETS_MAX_RETRIES):
+            try:
+                with metrics.timer("tender_sheets_flush_seconds", source=source_name):
+                    self._worksheet(source_name).append_rows(rows, value_input_option="USER_ENTERED")
+                metrics.inc("tender_sheets_rows_total", len(rows), source=source_name)
+                print(f"✅ [Google] Записано в лист '{source_name}': {len(rows)} строк")
+                self._failures.pop(source_name, None)
+                return
+            except Exception as e:
+                status = getattr(getattr(e, "response", None), "status_code", None) if isinstance(e, gspread.exceptions.APIError) else None
+                metrics.inc("tender_sheets_errors_total", source=source_name, status=status or type(e).__name__)
+                # Не квота (сеть, токен, удаленный лист) - таблицу и листы откроем заново
+                if status != 429 and not (status and status >= 500): self._sheet = None; self._worksheets.clear()
+                if self._stop.is_set(): break
+                delay = min(2 ** attempt * self.retry_delay, 120)
+                print(f"⏳ Ошибка Google Sheets ({source_name}): {status or type(e).__name__}: {e}, повтор через {delay} с")
+                self._stop.wait(delay)
+        self._failures[source_name] += 1
+        if self._failures[source_name] > SHEETS_MAX_REQUEUES:
+            metrics.inc("tender_sheets_dropped_rows_total", len(rows), source=source_name)
+            print(f"❌ Google Sheets ({source_name}): {self._failures[source_name]} сбросов подряд с ошибкой, {len(rows)} строк отброшено")
+            del self._failures[source_name]
+            return
+        # Не записали - возвращаем строки в начало буфера до следующего сброса
+        with self._lock:
+            self._buffers[source_name][:0] = rows
+
+    def _worksheet(self, source_name):
+        if source_name in self._worksheets: return self._worksheets[source_name]
+        if self._sheet is None:
+            client = gspread.service_account(filename=self.key_file)
+            self._sheet = client.open(self.sheet_name)
         try:
-            worksheet = sheet.worksheet(source_name)
+            worksheet = self._sheet.worksheet(source_name)
         except gspread.WorksheetNotFound:
-            # === СОЗДАНИЕ ЛИСТА С ПРАВИЛЬНЫМИ ЗАГОЛОВКАМИ ===
-            if source_name == "Etender":
-                cols = "20"
-                headers = [
-                    "Дата парсинга", 
-                    "Тип анкеты", 
-                    "Номер лота", 
-                    "Описание товаров", 
-                    "Квалификация (Toifa)", 
-                    "ИНН Заказчика",  # <--- ТЕПЕРЬ СНАЧАЛА ИНН
-                    "Заказчик",       # <--- ПОТОМ ЗАКАЗЧИК
-                    "Начальная цена", 
-                    "Валюта", 
-                    # "Текущая цена" - УБРАНО
-                    "Регион", 
-                    "Дата начала", 
-                    "Срок окончания", 
-                    "Срок доставки", 
-                    # "Участников" - УБРАНО
-                    "Контакты", 
-                    "Ссылка"
-                ]
-            elif source_name == "IT-Market":
-                cols = "6"
-                headers = ["Дата парсинга", "Заказчик", "Статус", "Задача", "Бюджет", "Ссылка"]
-            else:
-                # Xarid.uz (стандарт)
-                cols = "20"
-                headers = [
-                    "Дата парсинга", "Тип анкеты", "Номер лота", "Описание товаров", 
-                    "Название/Квалификация", "Заказчик", "Начальная цена", "Текущая цена", 
-                    "Регион", "Дата начала", "Срок окончания", "Срок доставки", 
-                    "Участников", "Контакты", "Ссылка"
-                ]
-            
-            worksheet = sheet.add_worksheet(title=source_name, rows="1000", cols=cols)
+            headers = SHEET_HEADERS.get(source_name, SHEET_HEADERS["Xarid.uz"])
+            worksheet = self._sheet.add_worksheet(title=source_name, rows="1000", cols="20" if len(headers) > 6 else "6")
             worksheet.append_row(headers)
             try:
                 body = {"requests": [{"repeatCell": {"range": {"sheetId": worksheet.id, "startRowIndex": 0, "endRowIndex": 1}, "cell": {"userEnteredFormat": {"textFormat": {"bold": True}}}, "fields": "userEnteredFormat.textFormat.bold"}}]}
-                sheet.batch_update(body)
-            except: pass
-        
-        # Преобразуем все данные (int оставляем int, остальное str)
-        safe_row = []
-        for x in row_data:
-            if isinstance(x, float) and x.is_integer():
-                safe_row.append(int(x))
-            elif x is None:
-                safe_row.append("")
-            else:
-                safe_row.append(x)
+                self._sheet.batch_update(body)
+            except Exception as e: record_error(source_name, "sheets_header", e)
+        self._worksheets[source_name] = worksheet
+        return worksheet
 
-        worksheet.append_row(safe_row, value_input_option="USER_ENTERED")
-        print(f"✅ [Google] Записано в лист '{source_name}'")
-        
-    except Exception as e:
-        print(f"⚠️ Ошибка Google Sheets ({source_name}): {e}")
+sheets_sink = None  # SheetsSink, запускается в main() если есть ключ Google
+
+def save_to_google_sheet(source_name, row_data):
+    """Не блокирует: строка уходит в буфер, запись делает фоновый поток."""
+    if sheets_sink is None: return
+    sheets_sink.add(source_name, row_data)
 
 # ==========================================
 # === 4. ПАРСИНГ ETENDER (ФИНАЛЬНЫЙ) ===
 # ==========================================
 
+# Элементы, появление которых значит "детальная страница отрисована"
+ETENDER_DETAIL_READY = ".lot__products__item, td"
+XARID_DETAIL_READY = "text=/Buyurtmachining\\s*nomi|Наименование\\s*заказчика/i"
+
+# === СПИСОК РАЗРЕШЕННЫХ КАТЕГОРИЙ ===
+ALLOWED_TOIFA = [
+    "Оборудование компьютерное, электронное и оптическое",
+    "Оборудование электрическое",
+    "Продукты программные", 
+    "услуги по разработке программного обеспечения",
+    "Консультационные и аналогические услуги в области информационных технологий",
+    "Услуги в области информационных технологий"
+]
+
+ETENDER_DETAIL_SPEC = FieldSpec({
+    "customer": (r"Buyurtmachi nomi|Name of the customer|Наименование заказчика",
+                 r"[\s:]+(?P<value>[^\n\r]+?)(?:Buyurtmachi|Telefon|Manzil|Address|Stir|Rasmiylashtirish|Takliflarni|Ishtirokchi|Eng yaxshi|$)"),
+    "inn": (r"STIR|INN|ИНН", r"[\s:]+(?P<value>\d{9})"),
+    "start_date": (r"Boshlanish|Start|Начало", r"[\w\W]{0,60}?(?P<value>\d{2}[.-]\d{2}[.-]\d{4}(?:\s*\d{2}:\d{2})?)"),
+    "end_date": (r"Tugash|End|Окончани|Muddat", r"[\w\W]{0,60}?(?P<value>\d{2}[.-]\d{2}[.-]\d{4}(?:\s*\d{2}:\d{2})?)"),
+    "contact": (r"Telefon|Phone|Телефон", r"[\s:]+(?P<value>[+\d\(\)\s-]{9,20})"),
+    "delivery_term": (r"Muddati|Yetkazib|Delivery|Срок", r"[\s:]+(?:[\w\d\s]+?)(?:kun|day|oy|мес|$)"),
+    "price": (r"Boshlang|Start|Начальная|Бюджет", r"[\w\W]{0,50}?(?P<amount>\d[\d\s,.]+)\s*(?P<currency>UZS|USD|RUB|EUR|so.?m|сум|ye)"),
+})
+# Цена без подписи - запасной вариант (с учетом регистра, как раньше)
+ETENDER_PRICE_FALLBACK = re.compile(r"(\d[\d\s,.]+)\s*(UZS|USD|RUB|EUR|so.?m|сум|ye)")
+ETENDER_ITEM_LINE = re.compile(r'^\d+\s*-\s+')
+ALLOWED_TOIFA_MATCHER = PhraseMatcher(ALLOWED_TOIFA)
+
+def extract_etender_fields(clean_text, data):
+    """Все текстовые поля детальной страницы Etender за один проход по тексту."""
+    fields = ETENDER_DETAIL_SPEC.extract(clean_text)
+    # === 3. ЗАКАЗЧИК ===
+    if "customer" in fields: data["customer"] = fields["customer"]["value"].strip()[:150]
+    # 4. ИНН
+    if "inn" in fields: data["inn"] = fields["inn"]["value"]
+    # 5. ДАТЫ
+    if "start_date" in fields: data["start_date"] = fields["start_date"]["value"]
+    if "end_date" in fields: data["end_date"] = fields["end_date"]["value"]
+    # 6. КОНТАКТЫ
+    if "contact" in fields: data["contact"] = fields["contact"]["value"].strip()
+    # 7. СРОК ПОСТАВКИ
+    if "delivery_term" in fields: data["delivery_term"] = fields["delivery_term"]["match"].strip()
+    # 8. ЦЕНА И ВАЛЮТА
+    if "price" in fields:
+        data["start_price_raw"] = fields["price"]["amount"].strip()
+        data["currency"] = fields["price"]["currency"].upper().strip()
+    else:
+        simple_match = ETENDER_PRICE_FALLBACK.search(clean_text)
+        if simple_match:
+            data["start_price_raw"] = simple_match.group(1).strip()
+            data["currency"] = simple_match.group(2).upper().strip()
+    # 9. РЕГИОН
+    data["region"] = REGION_MATCHER.first(clean_text, "Не указан")
+    return data
+
 async def get_etender_details(page, link):
     """
     Детальный парсинг Etender (Строгий фильтр: только названия лотов "1 - Название")
@@ -388,7 +2002,8 @@ async def get_etender_details(page, link):
         "customer": "Не указан", "inn": "Не указан", "contact": "Не указан", 
         "start_date": "Не указана", "end_date": "Не указана", 
         "delivery_term": "Не указан", "items_desc": "Тендер", "toifa": "Тендер",
-        "participants": "0" 
+        "participants": "0", "start_price_raw": "0", "currency": "UZS", "region": "Не указан",
+        "toifa_parsed": False,  # False - ячейки категории на странице не нашлось, "Тендер" выше - заглушка
     }
     
     try:
@@ -399,24 +2014,17 @@ async def get_etender_details(page, link):
             # .lot__products__item - это наиболее точный класс для списка товаров на Etender
             # h4, .lot-title - запасные варианты
             titles = page.locator(".lot__products__item, h4, h5, .card-title, .lot-title")
-            count = await titles.count()
             
-            for i in range(count):
-                raw_text = await titles.nth(i).inner_text()
-                
+            for raw_text in await titles.all_inner_texts():
                 # Разбиваем текст на отдельные строки (так как в одном блоке может быть и название, и цена)
-                lines = raw_text.split('\n')
-                
-                for line in lines:
+                for line in raw_text.split('\n'):
                     clean_line = line.strip()
                     # === ГЛАВНЫЙ ФИЛЬТР ===
                     # Ищем строки, которые начинаются строго с "Цифра" + " - "
                     # Пример: "1 - Запасные части..."
-                    # ^ - начало строки, \d+ - цифры, \s* - пробелы, - - тире
-                    if re.match(r'^\d+\s*-\s+', clean_line):
-                        # Дополнительная защита: если строка слишком короткая (менее 5 симв), это мусор
-                        if len(clean_line) > 5:
-                            items_list.append(clean_line)
+                    # Дополнительная защита: если строка слишком короткая (менее 5 симв), это мусор
+                    if ETENDER_ITEM_LINE.match(clean_line) and len(clean_line) > 5:
+                        items_list.append(clean_line)
             
             # Если нашли товары по шаблону - сохраняем
             if items_list: 
@@ -429,367 +2037,897 @@ async def get_etender_details(page, link):
                 if await h1.count() > 0: 
                     data["items_desc"] = (await h1.inner_text()).strip()
 
-        except Exception as e:
-            # print(f"Error parsing desc: {e}")
-            pass
+        except Exception as e: record_error("Etender", "items", e)
 
         # === 2. КВАЛИФИКАЦИЯ (TOIFA) ===
         try:
             toifa_el = page.locator("td:nth-child(4)").first
             if await toifa_el.count() > 0: 
                 data["toifa"] = (await toifa_el.inner_text()).strip()
-        except: pass
+                data["toifa_parsed"] = True
+        except Exception as e: record_error("Etender", "toifa", e)
 
-        # Получаем весь текст для остальных полей
+        # Весь текст страницы - для остальных полей
         raw_text = await page.inner_text("body")
-        clean_text = " ".join(raw_text.split())
+        extract_etender_fields(" ".join(raw_text.split()), data)
 
-        # === 3. ЗАКАЗЧИК ===
-        cust_match = re.search(
-            r"(?:Buyurtmachi nomi|Name of the customer|Наименование заказчика)[\s:]+([^\n\r]+?)(?:Buyurtmachi|Telefon|Manzil|Address|Stir|Rasmiylashtirish|Takliflarni|Ishtirokchi|Eng yaxshi|$)", 
-            clean_text, 
-            re.IGNORECASE
-        )
-        if cust_match: 
-            data["customer"] = cust_match.group(1).strip()[:150]
+    except Exception as e: record_error("Etender", "details", e)
+    return data
+
+async def process_etender_lot(pool, full_link):
+    """Открывает лот во вкладке из пула и фильтрует. new_lot(...) для save_tenders или None."""
+    source_name = "Etender"
+    try:
+        async with pool.page() as detail_page:
+            with metrics.timer("tender_detail_fetch_seconds", source=source_name):
+                response = await limited_goto(detail_page, full_link, wait_until="domcontentloaded")
+                rendered = True
+                try: await detail_page.wait_for_selector(ETENDER_DETAIL_READY, timeout=20000)
+                except Exception as e:
+                    rendered = False
+                    record_error(source_name, "detail_wait", e)
+                details = await get_etender_details(detail_page, full_link)
+
+        # Страница не отдалась (429/5xx), не дорисовалась или категории на ней нет - поля остались
+        # заглушками. Такой лот не отсеиваем (иначе пропадет на REJECT_TTL), а пробуем в следующий проход
+        if response is None or response.status >= 400 or not rendered or not details["toifa_parsed"]:
+            metrics.inc("tender_detail_incomplete_total", source=source_name)
+            return None
+
+        # === ФИЛЬТР ПО КАТЕГОРИЯМ (TOIFA) ===
+        # Проверяем, содержит ли 'toifa' одну из разрешенных фраз
+        if not ALLOWED_TOIFA_MATCHER.search(details['toifa']):
+            # print(f"🚫 Пропуск (Категория): {details['toifa']}") 
+            await remember_rejections(source_name, [(full_link, "toifa")])
+            return None
+        # ====================================
+
+        start_price_raw = details['start_price_raw']
+        currency_code = details['currency']
+        if "SO" in currency_code or "СУМ" in currency_code: currency_code = "UZS"
+        if "YE" in currency_code: currency_code = "USD"
+
+        start_price_num = parse_price_to_number(start_price_raw)
+        if len(str(int(start_price_num))) > 15: start_price_num = 0.0
+        
+        limit = MIN_PRICE_LIMIT
+        if currency_code != "UZS": limit = 100
 
-        # 4. ИНН
-        inn_match = re.search(r"(?:STIR|INN|ИНН)[\s:]+(\d{9})", clean_text, re.IGNORECASE)
-        if inn_match: data["inn"] = inn_match.group(1)
+        if start_price_num < limit:
+            await remember_rejections(source_name, [(full_link, "price")])
+            return None
 
-        # 5. ДАТЫ
-        start_match = re.search(r"(?:Boshlanish|Start|Начало)[\w\W]{0,60}?(\d{2}[.-]\d{2}[.-]\d{4}(?:\s*\d{2}:\d{2})?)", clean_text, re.IGNORECASE)
-        if start_match: data["start_date"] = start_match.group(1)
+        lot_id = full_link.split("/")[-1]
+        region = details['region']
         
-        end_match = re.search(r"(?:Tugash|End|Окончани|Muddat)[\w\W]{0,60}?(\d{2}[.-]\d{2}[.-]\d{4}(?:\s*\d{2}:\d{2})?)", clean_text, re.IGNORECASE)
-        if end_match: data["end_date"] = end_match.group(1)
+        sheet_start_price = int(start_price_num) if start_price_num > 0 else 0
+        
+        msg = (
+            f"<b>Тип анкеты: Тендер</b>\nИсточник: etender.uzex.uz\n\n"
+            f"🔢 <b>Номер лота:</b> {lot_id}\n"
+            f"📂 <b>Описание:</b> {details['items_desc'][:200]}...\n"
+            f"📁 <b>Квалификация:</b> {details['toifa']}\n"
+            f"📍 <b>Район:</b> {region}\n"
+            f"📅 <b>Дата начала:</b> {details['start_date']}\n"
+            f"⏳ <b>Срок окончания:</b> {details['end_date']}\n"
+            f"💰 <b>Бюджет:</b> {format_price_str(str(start_price_num))} {currency_code}\n"
+            f"🔗 <b>Ссылка:</b> {full_link}\n\n"
+            f"🏢 <b>Заказчик:</b> {details['customer']}\n"
+            f"🔢 <b>ИНН:</b> {details['inn']}\n"
+            f"📞 <b>Контакты:</b> {details['contact']}"
+        )
 
-        # 6. КОНТАКТЫ
-        phone_match = re.search(r"(?:Telefon|Phone|Телефон)[\s:]+([+\d\(\)\s-]{9,20})", clean_text, re.IGNORECASE)
-        if phone_match: data["contact"] = phone_match.group(1).strip()
+        # === СТРОКА ДЛЯ GOOGLE SHEETS ===
+        sheet_row = [
+            datetime.now().strftime("%d.%m.%Y %H:%M"), 
+            "Тендер", 
+            lot_id, 
+            details['items_desc'], 
+            details['toifa'], 
+            details['inn'],      
+            details['customer'], 
+            sheet_start_price, 
+            currency_code, 
+            region, 
+            details['start_date'], 
+            details['end_date'], 
+            details['delivery_term'], 
+            details['contact'], 
+            full_link
+        ]
+        return new_lot(
+            source_name, f"Лот №{lot_id}", full_link, message=msg, sheet_row=sheet_row,
+            amount=to_amount(start_price_num), currency=currency_code,
+            start_at=parse_site_datetime(details['start_date']), end_at=parse_site_datetime(details['end_date']),
+            region=known_or_none(region), category=known_or_none(details['toifa']),
+            customer=known_or_none(details['customer']), inn=known_or_none(details['inn']),
+            items_desc=known_or_none(details['items_desc'])
+        )
 
-        # 7. СРОК ПОСТАВКИ
-        deliv_match = re.search(r"(?:Muddati|Yetkazib|Delivery|Срок)[\s:]+([\w\d\s]+?)(?:kun|day|oy|мес|$)", clean_text, re.IGNORECASE)
-        if deliv_match: data["delivery_term"] = deliv_match.group(0).strip()
+    except Exception as e:
+        record_error(source_name, "lot", e)
+        return None
 
-    except Exception as e: pass
-    return data
+async def etender_listing_links(page):
+    """Ссылки на лоты с открытой страницы списка Etender."""
+    lot_links = page.locator("a[href^='/lot/']")
+    return [f"https://etender.uzex.uz{href}" for href in await lot_links.evaluate_all("els => els.map(e => e.getAttribute('href'))")]
 
-async def parse_etender(page):
+async def parse_etender(session, pool):
     url = "https://etender.uzex.uz/lots/1/0"
     source_name = "Etender"
     print(f"🔸 Проверяю {source_name}...")
-    
-    # === СПИСОК РАЗРЕШЕННЫХ КАТЕГОРИЙ ===
-    ALLOWED_TOIFA = [
-        "Оборудование компьютерное, электронное и оптическое",
-        "Оборудование электрическое",
-        "Продукты программные", 
-        "услуги по разработке программного обеспечения",
-        "Консультационные и аналогические услуги в области информационных технологий",
-        "Услуги в области информационных технологий"
-    ]
+    if HTTP_FAST_PATH and ETENDER_API_URL and await parse_etender_http(pool): return
     
     try:
-        await page.goto(url, timeout=90000, wait_until="networkidle")
+        page = await session.listing_page()
+        await limited_goto(page, url, timeout=90000, wait_until="domcontentloaded")
         try: await page.wait_for_selector("a[href^='/lot/']", timeout=20000)
-        except: return
+        except Exception as e:
+            record_error(source_name, "listing_wait", e)
+            return
 
+        state = await CrawlState.load(source_name)
         page_num = 1
         while page_num <= MAX_PAGES_PER_RUN:
-            lot_links = page.locator("a[href^='/lot/']")
-            count = await lot_links.count()
-            print(f"🔎 Etender: Страница {page_num}, найдено ссылок: {count}")
-            if count == 0: break
-            new_items = 0
+            all_links = await etender_listing_links(page)
+            count_page(source_name)
+            print(f"🔎 Etender: Страница {page_num}, найдено ссылок: {len(all_links)}")
+            if not all_links:
+                state.finish()
+                break
+
+            # Детальные страницы грузятся параллельно, не больше pool.size вкладок одновременно
+            new_links = await filter_new_links(all_links)
+            await process_lots("Etender", pool, [{"link": link} for link in new_links])
             
-            all_links = []
-            for i in range(count):
-                href = await lot_links.nth(i).get_attribute("href")
-                all_links.append(f"https://etender.uzex.uz{href}")
-
-            for full_link in all_links:
-                try:
-                    if check_exists(full_link): continue
-
-                    detail_page = await page.context.new_page()
-                    await detail_page.goto(full_link, wait_until="networkidle")
-                    
-                    full_page_text = await detail_page.inner_text("body")
-                    clean_page_text = " ".join(full_page_text.split())
-                    
-                    details = await get_etender_details(detail_page, full_link)
-
-                    # === ФИЛЬТР ПО КАТЕГОРИЯМ (TOIFA) ===
-                    # Проверяем, содержит ли 'toifa' одну из разрешенных фраз
-                    current_toifa = details['toifa'].lower()
-                    is_allowed_category = any(cat.lower() in current_toifa for cat in ALLOWED_TOIFA)
-
-                    if not is_allowed_category:
-                        # Если категория не подходит, закрываем и пропускаем
-                        # print(f"🚫 Пропуск (Категория): {details['toifa']}") 
-                        await detail_page.close()
-                        continue
-                    # ====================================
-
-                    start_price_raw = "0"
-                    currency_code = "UZS"
-                    price_regex = r"(\d[\d\s,.]+)\s*(UZS|USD|RUB|EUR|so.?m|сум|ye)"
-                    
-                    context_match = re.search(r"(?:Boshlang|Start|Начальная|Бюджет)[\w\W]{0,50}?" + price_regex, clean_page_text, re.IGNORECASE)
-                    if context_match:
-                        start_price_raw = context_match.group(1).strip()
-                        currency_code = context_match.group(2).upper().strip()
-                    else:
-                        simple_match = re.search(price_regex, clean_page_text)
-                        if simple_match:
-                            start_price_raw = simple_match.group(1).strip()
-                            currency_code = simple_match.group(2).upper().strip()
-
-                    if "SO" in currency_code or "СУМ" in currency_code: currency_code = "UZS"
-                    if "YE" in currency_code: currency_code = "USD"
-
-                    start_price_num = parse_price_to_number(start_price_raw)
-                    if len(str(int(start_price_num))) > 15: start_price_num = 0.0
-                    
-                    limit = MIN_PRICE_LIMIT
-                    if currency_code != "UZS": limit = 100
-
-                    if start_price_num < limit: 
-                        await detail_page.close(); continue
-
-                    await detail_page.close()
-
-                    lot_id = full_link.split("/")[-1]
-                    region = next((r for r in REGIONS_LIST if r.lower() in clean_page_text.lower()), "Не указан")
-                    
-                    sheet_start_price = int(start_price_num) if start_price_num > 0 else 0
-                    
-                    full_price_db = f"{start_price_num} {currency_code}"
-                    full_desc = f"Tender||{region}||{currency_code}"
-                    add_tender_direct(source_name, f"Лот №{lot_id}", full_desc, full_price_db, details['start_date'], details['end_date'], full_link)
-                    
-                    print(f"🔥 [Etender] Новый: {lot_id} | {start_price_num} {currency_code}")
-
-                    msg = (
-                        f"<b>Тип анкеты: Тендер</b>\nИсточник: etender.uzex.uz\n\n"
-                        f"🔢 <b>Номер лота:</b> {lot_id}\n"
-                        f"📂 <b>Описание:</b> {details['items_desc'][:200]}...\n"
-                        f"📁 <b>Квалификация:</b> {details['toifa']}\n"
-                        f"📍 <b>Район:</b> {region}\n"
-                        f"📅 <b>Дата начала:</b> {details['start_date']}\n"
-                        f"⏳ <b>Срок окончания:</b> {details['end_date']}\n"
-                        f"💰 <b>Бюджет:</b> {format_price_str(str(start_price_num))} {currency_code}\n"
-                        f"🔗 <b>Ссылка:</b> {full_link}\n\n"
-                        f"🏢 <b>Заказчик:</b> {details['customer']}\n"
-                        f"🔢 <b>ИНН:</b> {details['inn']}\n"
-                        f"📞 <b>Контакты:</b> {details['contact']}"
-                    )
-                    await send_notification_to_channel(msg, source_name, DEFAULT_PHOTO_PATH)
-                    
-                    # === ЗАПИСЬ В GOOGLE SHEETS ===
-                    save_to_google_sheet("Etender", [
-                        datetime.now().strftime("%d.%m.%Y %H:%M"), 
-                        "Тендер", 
-                        lot_id, 
-                        details['items_desc'], 
-                        details['toifa'], 
-                        details['inn'],      
-                        details['customer'], 
-                        sheet_start_price, 
-                        currency_code, 
-                        region, 
-                        details['start_date'], 
-                        details['end_date'], 
-                        details['delivery_term'], 
-                        details['contact'], 
-                        full_link
-                    ])
-                    new_items += 1
-
-                except Exception as e:
-                    continue
-            
-            if new_items == 0 and page_num > 1: break
+            if state.observe([(_lot_number(l.rsplit("/", 1)[-1]), l) for l in all_links]): break
             try:
                 next_btn = page.locator("li.pagination-next a").first
-                if await next_btn.is_visible(): await next_btn.click(); await page.wait_for_timeout(5000); page_num += 1
-                else: break
-            except: break
-    except: pass
+                if await next_btn.is_visible(): await click_next_and_wait(page, next_btn, "a[href^='/lot/']"); page_num += 1
+                else:
+                    state.finish()
+                    break
+            except Exception as e:
+                record_error(source_name, "pagination", e)
+                break
+        await state.save()
+    except Exception as e: record_error(source_name, "listing", e)
 
 # ==========================================
 # === 5. PARSING LOGIC: XARID.UZ (ORIGINAL) ===
 # ==========================================
 
+XARID_DETAIL_SPEC = FieldSpec({
+    "customer": (r"Buyurtmachining\s*nomi|Наименование\s*заказчика", r"\s*:?\s*(?P<value>.*?)(?:Boshlanish|Start|Дата|Manzil|Адрес)"),
+    "contact": (r"Bog.?lanish\s*uchun", r"\s*:?\s*(?P<value>[+\d\(\)\s-]{7,25})"),
+    "delivery_term": (r"Yetkazib\s*berish\s*muddati|Срок\s*поставки", r"\s*:?\s*(?P<value>.*?)(?:Fayl|Status|Статус)"),
+    "start_date": (r"Boshlanish\s*sanasi|Дата\s*начала", r".*?(?P<value>\d{2}\.\d{2}\.\d{4}\s*\d{2}:\d{2}(?::\d{2})?)"),
+    "end_date": (r"Tugash\s*sanasi|Дата\s*окончания", r".*?(?P<value>\d{2}\.\d{2}\.\d{4}\s*\d{2}:\d{2}(?::\d{2})?)"),
+    "participants": (r"Ishtirokchilar\s*soni|Участники", r".*?(?P<value>\d+)"),
+})
+XARID_ITEMS = re.compile(r"(?:^|\n)\s*(?:\d+[.\s]*)?([^\n]+?)\s*\(\d{2}\.\d{2}\.\d{2}[\.\d-]*\)")
+# Подвал сайта: все, что после этих слов, к лоту не относится
+XARID_FOOTER = re.compile("|".join(re.escape(w) for w in ["Texnik yordam", "Call-markaz", "Ishonch telefoni", "Техническая поддержка"]))
+
+def extract_xarid_fields(raw_text, data):
+    """Все поля детальной страницы Xarid из текста body."""
+    found_items = []; raw_items = XARID_ITEMS.findall(raw_text)
+    if raw_items:
+        for idx, item_name in enumerate(raw_items):
+            if len(item_name.strip()) > 2: found_items.append(f"{idx + 1}. {item_name.strip()}")
+        if found_items: data["items_desc"] = "\n".join(found_items)
+    
+    footer = XARID_FOOTER.search(raw_text)
+    if footer: raw_text = raw_text[:footer.start()]
+    fields = XARID_DETAIL_SPEC.extract(" ".join(raw_text.split()))
+
+    if "customer" in fields: data["customer"] = fields["customer"]["value"].strip()
+    contact = fields.get("contact", {}).get("value")
+    if contact and any(c.isdigit() for c in contact): data["contact"] = contact.strip()
+    if "delivery_term" in fields: data["delivery_term"] = fields["delivery_term"]["value"].strip()
+    for key in ("start_date", "end_date", "participants"):
+        if key in fields: data[key] = fields[key]["value"]
+    return data
+
 async def get_xarid_details(page, link):
     data = {"customer": "Не указан", "contact": "Не указан", "participants": "0", "start_date": "Не указана", "end_date": "Не указана", "delivery_term": "Не указан", "items_desc": "Не указано"}
     try:
-        await page.goto(link, timeout=45000, wait_until="domcontentloaded"); await page.wait_for_timeout(2500)
-        raw_text = await page.inner_text("body")
-        found_items = []; raw_items = re.findall(r"(?:^|\n)\s*(?:\d+[.\s]*)?([^\n]+?)\s*\(\d{2}\.\d{2}\.\d{2}[\.\d-]*\)", raw_text)
-        if raw_items:
-            for idx, item_name in enumerate(raw_items):
-                if len(item_name.strip()) > 2: found_items.append(f"{idx + 1}. {item_name.strip()}")
-            if found_items: data["items_desc"] = "\n".join(found_items)
-        
-        for word in ["Texnik yordam", "Call-markaz", "Ishonch telefoni", "Техническая поддержка"]:
-            if word in raw_text: raw_text = raw_text.split(word)[0]
-        clean_oneline = " ".join(raw_text.split())
-
-        # ИСПРАВЛЕНО: Теперь group(1) - это значение, group(0) - все совпадение
-        cust_match = re.search(r"(?:Buyurtmachining\s*nomi|Наименование\s*заказчика)\s*:?\s*(.*?)(?:Boshlanish|Start|Дата|Manzil|Адрес)", clean_oneline, re.IGNORECASE)
-        if cust_match: data["customer"] = cust_match.group(1).strip()
-
-        phone_match = re.search(r"Bog.?lanish\s*uchun\s*:?\s*([+\d\(\)\s-]{7,25})", clean_oneline, re.IGNORECASE)
-        if phone_match and any(c.isdigit() for c in phone_match.group(1)): data["contact"] = phone_match.group(1).strip()
-        
-        # ИСПРАВЛЕНО: Теперь group(1) - это значение
-        deliv_match = re.search(r"(?:Yetkazib\s*berish\s*muddati|Срок\s*поставки)\s*:?\s*(.*?)(?:Fayl|Status|Статус)", clean_oneline, re.IGNORECASE)
-        if deliv_match: data["delivery_term"] = deliv_match.group(1).strip()
-
-        start_match = re.search(r"(?:Boshlanish\s*sanasi|Дата\s*начала).*?(\d{2}\.\d{2}\.\d{4}\s*\d{2}:\d{2}(?::\d{2})?)", clean_oneline, re.IGNORECASE)
-        if start_match: data["start_date"] = start_match.group(1)
-        end_match = re.search(r"(?:Tugash\s*sanasi|Дата\s*окончания).*?(\d{2}\.\d{2}\.\d{4}\s*\d{2}:\d{2}(?::\d{2})?)", clean_oneline, re.IGNORECASE)
-        if end_match: data["end_date"] = end_match.group(1)
-        part_match = re.search(r"(?:Ishtirokchilar\s*soni|Участники).*?(\d+)", clean_oneline, re.IGNORECASE)
-        if part_match: data["participants"] = part_match.group(1)
-    except: pass
+        await limited_goto(page, link, timeout=45000, wait_until="domcontentloaded")
+        try: await page.wait_for_selector(XARID_DETAIL_READY, timeout=15000)
+        except Exception as e: record_error("Xarid.uz", "detail_wait", e)
+        extract_xarid_fields(await page.inner_text("body"), data)
+    except Exception as e: record_error("Xarid.uz", "details", e)
     return data
 
+async def process_xarid_lot(pool, full_text, clean_text, lot_id, start_price_raw, current_price_raw, start_price_num, full_link):
+    """Догружает детали лота во вкладке из пула. new_lot(...) для save_tenders или None."""
+    source_name = "Xarid.uz"
+    try:
+        start_price_str = format_price_str(start_price_raw)
+
+        # === 2. ТЕКУЩАЯ ЦЕНА (ИСПРАВЛЕНО: не захватывать даты) ===
+        current_price_num = 0.0
+        current_price_str = "Нет ставок"
+
+        # Доп. проверка: если в строке больше одной точки, это скорее всего дата (25.12.2025)
+        if current_price_raw and current_price_raw.count('.') < 2:
+            current_price_num = parse_price_to_number(current_price_raw)
+            current_price_str = format_price_str(current_price_raw)
+
+        # ПОДГОТОВКА ДЛЯ EXCEL (INT, без .0)
+        sheet_start_price = int(start_price_num) if start_price_num > 0 else 0
+        sheet_current_price = int(current_price_num) if current_price_num > 0 else 0
+
+        async with pool.page() as detail_page:
+            with metrics.timer("tender_detail_fetch_seconds", source=source_name):
+                details = await get_xarid_details(detail_page, full_link)
+
+        toifa = "Не указана"
+        if "Toifa:" in full_text: toifa = full_text.split("Toifa:")[1].split("\n")[0].strip()
+        region = REGION_MATCHER.first(clean_text, "Не указан")
+
+        real_end = details['end_date'] if details['end_date'] != "Не указана" else "-"
+        real_start = details['start_date'] if details['start_date'] != "Не указана" else "-"
+
+        msg = (f"<b>Тип анкеты: Аукцион</b>\nИсточник: xarid.uz\n\n🔢 <b>Номер лота:</b> {lot_id}\n📂 <b>Квалификация:</b> {toifa}\n📍 <b>Район:</b> {region}\n📅 <b>Дата начала:</b> {real_start}\n⏳ <b>Срок окончания:</b> {real_end}\n🚚 <b>Срок доставки:</b> {details['delivery_term']}\n💰 <b>Начальная цена:</b> {start_price_str} UZS\n📉 <b>Текущая цена:</b> {current_price_str}\n🔗 <b>Ссылка:</b> {full_link}\n\n🏢 <b>Заказчик:</b> {details['customer']}\n📞 <b>Контакты:</b> {details['contact']}\n👥 <b>Участников:</b> {details['participants']}\n📦 <b>Товары:</b>\n{details['items_desc'][:300]}...")
+
+        sheet_row = [
+            datetime.now().strftime("%d.%m.%Y %H:%M"), "Аукцион", lot_id, 
+            details['items_desc'], toifa, details['customer'], 
+            sheet_start_price,   # Исправлено на INT
+            sheet_current_price, # Исправлено на INT
+            region, real_start, real_end, 
+            details['delivery_term'], details['participants'], details['contact'], full_link
+        ]
+        return new_lot(
+            source_name, f"Лот №{lot_id}", full_link, message=msg, sheet_row=sheet_row,
+            amount=to_amount(start_price_num), current_amount=to_amount(current_price_num),
+            start_at=parse_site_datetime(real_start), end_at=parse_site_datetime(real_end),
+            region=known_or_none(region), category=known_or_none(toifa),
+            customer=known_or_none(details['customer']), items_desc=known_or_none(details['items_desc'])
+        )
+    except Exception as e:
+        record_error(source_name, "lot", e)
+        return None
+
+XARID_CARD_SPEC = FieldSpec({
+    "lot_id": (r"Lot\s*raqami:", r"\s*(?P<value>\d+)"),
+    "start_price": (r"Boshlang.?ich\s*narx|Начальная\s*стоимость|Стартовая\s*стоимость|Начальная\s*цена", r"[^\d]*(?P<value>[\d\s,.]+)"),
+    # Цену ищем только в пределах 20 символов после подписи, чтобы не улететь на дату
+    "current_price": (r"Joriy\s*narx|Текущая\s*цена|Лучшее\s*предложение", r"[^\d\n]{0,20}(?P<value>[\d\s,.]+)"),
+})
+XARID_LOT_ID = re.compile(r'Lot\s*raqami:\s*(\d+)', re.IGNORECASE)
+
+def xarid_candidate_from_card(full_text):
+    """Фильтр карточки списка (ключевые слова, минимальная цена).
+    Возвращает (кортеж для process_xarid_lot, None) или (None, причина отказа)."""
+    try:
+        clean_text = " ".join(full_text.split())
+        if not KEYWORD_MATCHER.search(clean_text): return None, "keywords"
+        fields = XARID_CARD_SPEC.extract(clean_text)
+        lot_id = fields["lot_id"]["value"] if "lot_id" in fields else "00000"
+        
+        # === 1. НАЧАЛЬНАЯ ЦЕНА ===
+        start_price_raw = fields["start_price"]["value"] if "start_price" in fields else "0"
+        start_price_num = parse_price_to_number(start_price_raw)
+        if start_price_num < MIN_PRICE_LIMIT: return None, "price"
+        current_price_raw = fields.get("current_price", {}).get("value")
+
+        full_link = f"https://xarid.uzex.uz/auction/detail/{lot_id[-6:]}"
+        return (full_text, clean_text, lot_id, start_price_raw, current_price_raw, start_price_num, full_link), None
+    except Exception as e:
+        record_error("Xarid.uz", "card", e)
+        return None, None
+
+def xarid_lot_from_card(full_text):
+    """(номер лота, ссылка) любой карточки - для high-water mark, без фильтров."""
+    match_id = XARID_LOT_ID.search(full_text)
+    if not match_id: return (None, None)
+    return (int(match_id.group(1)), f"https://xarid.uzex.uz/auction/detail/{match_id.group(1)[-6:]}")
+
+def xarid_current_amount(full_text):
+    """Текущая ставка из карточки списка (Decimal) или None, если ставок нет."""
+    fields = XARID_CARD_SPEC.extract(" ".join(full_text.split()))
+    raw = fields.get("current_price", {}).get("value")
+    # Больше одной точки - это дата, а не цена (см. process_xarid_lot)
+    if not raw or raw.count('.') >= 2: return None
+    return to_amount(parse_price_to_number(raw))
+
+async def notify_price_moves(changed):
+    """Лайкнувшим лот - сообщение, если текущая цена сдвинулась больше чем на PRICE_ALERT_THRESHOLD."""
+    if PRICE_ALERT_THRESHOLD <= 0: return
+    threshold = Decimal(str(PRICE_ALERT_THRESHOLD))
+    moved = {r["id"]: r for r in changed
+             if r["old_amount"] and r["new_amount"] is not None and abs(r["new_amount"] - r["old_amount"]) >= r["old_amount"] * threshold}
+    if not moved: return
+    async with db_pool.acquire() as conn:
+        likes = await conn.fetch("SELECT user_id, tender_id FROM favorites WHERE tender_id = ANY($1::int[])", list(moved))
+        if not likes: return
+        texts = []
+        for like in likes:
+            r = moved[like["tender_id"]]
+            change = (r["new_amount"] - r["old_amount"]) / r["old_amount"] * 100
+            texts.append(f"{'📉' if change < 0 else '📈'} <b>Цена изменилась ({change:+.1f}%)</b>\n\n📂 {r['title']}\n"
+                         f"💰 {format_amount(r['old_amount'])} → <b>{format_amount(r['new_amount'])}</b> UZS\n🔗 {r['link']}")
+        await conn.execute(
+            "INSERT INTO outbox (chat_id, thread_id, text) SELECT c, NULL, t FROM unnest($1::text[], $2::text[]) AS u(c, t)",
+            [str(l["user_id"]) for l in likes], texts
+        )
+        if NOTIFY_PEERS: await conn.execute("SELECT pg_notify($1, '')", OUTBOX_CHANNEL)
+    outbox_wakeup.set()
+
+async def refresh_xarid_prices(session, pool):
+    """Текущие цены всех открытых аукционов Xarid со страниц списка, без детальных страниц.
+    Одна страница списка - один UPDATE; листаем, пока не увидим все открытые лоты, список
+    не кончится или не выйдет PRICE_REFRESH_MAX_PAGES страниц."""
+    source_name = "Xarid.uz:prices"
+    open_links = await get_open_links("Xarid.uz")
+    if not open_links: return
+    seen = set()
+
+    async def apply(card_texts):
+        """True - все открытые лоты уже встретились, дальше не листаем."""
+        count_page(source_name)
+        prices = {}
+        for text in card_texts:
+            _, link = xarid_lot_from_card(text)
+            if link not in open_links: continue
+            seen.add(link)
+            amount = xarid_current_amount(text)
+            if amount is not None: prices[link] = amount
+        if prices:
+            changed = await apply_price_updates(prices)
+            if changed:
+                metrics.inc("tender_price_updates_total", len(changed), source="Xarid.uz")
+                if PROCESS_ROLE == "bot": invalidate_card_buffers(source="Xarid.uz")
+                await notify_price_moves(changed)
+        return len(seen) >= len(open_links)
+
+    async def crawl():
+        if HTTP_FAST_PATH and XARID_API_URL:
+            try:
+                for page_num in range(1, PRICE_REFRESH_MAX_PAGES + 1):
+                    rows = await fetch_listing_json(XARID_API_URL, page_num)
+                    if not rows or await apply([xarid_card_from_row(r) for r in rows]): break
+                return
+            except EndpointShapeError as e:
+                record_error(source_name, "api", e)
+        try:
+            page = await session.listing_page()
+            await limited_goto(page, "https://xarid.uzex.uz/auction", timeout=90000, wait_until="domcontentloaded")
+            for page_num in range(1, PRICE_REFRESH_MAX_PAGES + 1):
+                await page.wait_for_selector(".lot-item", timeout=15000)
+                if await apply(await page.locator(".lot-item").all_inner_texts()): break
+                next_btn = page.locator(".pagination-next, .ui-paginator-next").first
+                if not await next_btn.is_visible(): break
+                await click_next_and_wait(page, next_btn, ".lot-item")
+        except Exception as e: record_error(source_name, "listing", e)
 
-async def parse_xarid_uz(page):
+    print(f"💱 Xarid: обновляю цены {len(open_links)} открытых лотов...")
+    try: await crawl()
+    finally:
+        # И при таймауте прохода: лоты, которых не встретили в списке (дальше лимита или уже сняты)
+        missed = len(open_links) - len(seen)
+        metrics.set("tender_price_refresh_missed_lots", missed, source="Xarid.uz")
+        if missed: print(f"⚠️ Xarid: цены не обновлены у {missed} из {len(open_links)} открытых лотов")
+
+async def process_xarid_cards(pool, card_texts):
+    """Одна страница списка: ссылки (с кэшем отказов) проверяются одним запросом,
+    фильтр гоняем только по новым карточкам, новые лоты обрабатываются параллельно."""
+    by_link = {}
+    for full_text in card_texts:
+        _, link = xarid_lot_from_card(full_text)
+        if link: by_link.setdefault(link, full_text)
+    candidates, rejected = [], []
+    for link in await filter_new_links(list(by_link)):
+        candidate, reason = xarid_candidate_from_card(by_link[link])
+        if candidate: candidates.append(candidate)
+        elif reason: rejected.append((link, reason))
+    await remember_rejections("Xarid.uz", rejected)
+    return await process_lots("Xarid.uz", pool, [{"link": c[-1], "candidate": list(c)} for c in candidates])
+
+async def parse_xarid_uz(session, pool):
     url = "https://xarid.uzex.uz/auction"
     source_name = "Xarid.uz"
     print(f"🔸 Checking {source_name}...")
+    if HTTP_FAST_PATH and XARID_API_URL and await parse_xarid_http(pool): return
     try:
-        await page.goto(url, timeout=90000, wait_until="domcontentloaded")
+        page = await session.listing_page()
+        await limited_goto(page, url, timeout=90000, wait_until="domcontentloaded")
+        state = await CrawlState.load(source_name)
         page_num = 1
         while page_num <= MAX_PAGES_PER_RUN:
             try: await page.wait_for_selector(".lot-item", timeout=15000); items = page.locator(".lot-item"); count = await items.count()
-            except: break
-            if count == 0: break
-            new_items = 0
-            for i in range(count):
-                item = items.nth(i)
-                try:
-                    full_text = await item.inner_text(); clean_text = " ".join(full_text.split())
-                    if not any(k.lower() in clean_text.lower() for k in TARGET_KEYWORDS): continue
-                    match_id = re.search(r'Lot\s*raqami:\s*(\d+)', clean_text, re.IGNORECASE); lot_id = match_id.group(1) if match_id else "00000"
-                    
-                    # === 1. НАЧАЛЬНАЯ ЦЕНА ===
-                    start_pattern = r"(?:Boshlang.?ich\s*narx|Начальная\s*стоимость|Стартовая\s*стоимость|Начальная\s*цена)[^\d]*([\d\s,.]+)"
-                    match_p = re.search(start_pattern, clean_text, re.IGNORECASE)
-                    start_price_raw = match_p.group(1) if match_p else "0"
-                    start_price_num = parse_price_to_number(start_price_raw)
-                    if start_price_num < MIN_PRICE_LIMIT: continue 
-                    start_price_str = format_price_str(start_price_raw)
-
-                    full_link = f"https://xarid.uzex.uz/auction/detail/{lot_id[-6:]}"
-                    if check_exists(full_link): continue
-
-                    # === 2. ТЕКУЩАЯ ЦЕНА (ИСПРАВЛЕНО: не захватывать даты) ===
-                    # Ищем цену только в пределах 20 символов после слов "Текущая цена", чтобы не улететь на дату
-                    curr_pattern = r"(?:Joriy\s*narx|Текущая\s*цена|Лучшее\s*предложение)[^\d\n]{0,20}([\d\s,.]+)"
-                    match_c = re.search(curr_pattern, clean_text, re.IGNORECASE)
-                    
-                    current_price_num = 0.0
-                    current_price_str = "Нет ставок"
-                    
-                    if match_c: 
-                        raw_curr = match_c.group(1)
-                        # Доп. проверка: если в строке больше одной точки, это скорее всего дата (25.12.2025)
-                        if raw_curr.count('.') < 2:
-                            current_price_num = parse_price_to_number(raw_curr)
-                            current_price_str = format_price_str(raw_curr)
-
-                    # ПОДГОТОВКА ДЛЯ EXCEL (INT, без .0)
-                    sheet_start_price = int(start_price_num) if start_price_num > 0 else 0
-                    sheet_current_price = int(current_price_num) if current_price_num > 0 else 0
-
-                    detail_page = await page.context.new_page()
-                    details = await get_xarid_details(detail_page, full_link)
-                    await detail_page.close()
-                    
-                    toifa = "Не указана"
-                    if "Toifa:" in full_text: toifa = full_text.split("Toifa:")[1].split("\n")[0].strip()
-                    region = "Не указан"
-                    for reg in REGIONS_LIST:
-                        if reg.lower() in clean_text.lower(): region = reg; break
-
-                    real_end = details['end_date'] if details['end_date'] != "Не указана" else "-"
-                    real_start = details['start_date'] if details['start_date'] != "Не указана" else "-"
-                    
-                    full_desc = f"{toifa}||{region}||{current_price_str}"
-                    add_tender_direct(source_name, f"Лот №{lot_id}", full_desc, f"{start_price_num} UZS", real_start, real_end, full_link)
-                    print(f"🔥 [Xarid] New: {lot_id}")
-                    
-                    msg = (f"<b>Тип анкеты: Аукцион</b>\nИсточник: xarid.uz\n\n🔢 <b>Номер лота:</b> {lot_id}\n📂 <b>Квалификация:</b> {toifa}\n📍 <b>Район:</b> {region}\n📅 <b>Дата начала:</b> {real_start}\n⏳ <b>Срок окончания:</b> {real_end}\n🚚 <b>Срок доставки:</b> {details['delivery_term']}\n💰 <b>Начальная цена:</b> {start_price_str} UZS\n📉 <b>Текущая цена:</b> {current_price_str}\n🔗 <b>Ссылка:</b> {full_link}\n\n🏢 <b>Заказчик:</b> {details['customer']}\n📞 <b>Контакты:</b> {details['contact']}\n👥 <b>Участников:</b> {details['participants']}\n📦 <b>Товары:</b>\n{details['items_desc'][:300]}...")
-                    await send_notification_to_channel(msg, source_name, DEFAULT_PHOTO_PATH)
-                    
-                    save_to_google_sheet("Xarid.uz", [
-                        datetime.now().strftime("%d.%m.%Y %H:%M"), "Аукцион", lot_id, 
-                        details['items_desc'], toifa, details['customer'], 
-                        sheet_start_price,   # Исправлено на INT
-                        sheet_current_price, # Исправлено на INT
-                        region, real_start, real_end, 
-                        details['delivery_term'], details['participants'], details['contact'], full_link
-                    ])
-                    new_items += 1
-                except: continue
-            if new_items == 0 and page_num > 1: break
+            except Exception as e:
+                record_error(source_name, "listing_wait", e)
+                break
+            if count == 0:
+                state.finish()
+                break
+            try: card_texts = await items.all_inner_texts()
+            except Exception as e:
+                record_error(source_name, "cards", e)
+                break
+            count_page(source_name)
+            await process_xarid_cards(pool, card_texts)
+            if state.observe([xarid_lot_from_card(t) for t in card_texts]): break
             try:
                 next_btn = page.locator(".pagination-next, .ui-paginator-next").first
-                if await next_btn.is_visible(): await next_btn.click(); await page.wait_for_timeout(3000); page_num += 1
-                else: break
-            except: break
-    except: pass
+                if await next_btn.is_visible(): await click_next_and_wait(page, next_btn, ".lot-item"); page_num += 1
+                else:
+                    state.finish()
+                    break
+            except Exception as e:
+                record_error(source_name, "pagination", e)
+                break
+        await state.save()
+    except Exception as e: record_error(source_name, "listing", e)
 
 # ==========================================
 # === 6. PARSING LOGIC: IT-MARKET ===
 # ==========================================
 
-async def parse_it_market(page):
+def parse_it_market_card(card_text):
+    """Поля карточки заказа IT-Market из ее текста. None - если карточка пустая."""
+    lines = [l.strip() for l in card_text.split('\n') if l.strip()]
+    if len(lines) < 3: return None
+    price_str = "Договорная"
+    for k, line in enumerate(lines):
+        if "Бюджет" in line and k+3 < len(lines): price_str = format_price_str(lines[k+3]); break
+    return {"company": lines[0], "status": lines[1], "title": lines[2], "price": price_str}
+
+async def parse_it_market(session, pool):
     url = "https://it-market.uz/order/"
     source_name = "IT-Market"
     print(f"🔹 Checking {source_name}...")
     try:
-        await page.goto(url, timeout=60000, wait_until="networkidle")
+        page = await session.listing_page()
+        await limited_goto(page, url, timeout=60000, wait_until="domcontentloaded")
+        try: await page.wait_for_selector(".animated-card", timeout=20000)
+        except Exception as e:
+            record_error(source_name, "listing_wait", e)
+            return
         cards = page.locator(".animated-card")
         if await cards.count() == 0: return
+        count_page(source_name)
+        card_links = []
         for i in range(await cards.count()):
             card = cards.nth(i)
             try:
                 link_loc = card.locator(".stretched-link")
                 if await link_loc.count() > 0: href = await link_loc.get_attribute("href"); full_link = f"https://it-market.uz{href}"
                 else: full_link = url
-                if check_exists(full_link): continue
-                lines = (await card.inner_text()).split('\n'); lines = [l.strip() for l in lines if l.strip()]
-                if len(lines) < 3: continue
-                company, status, title = lines[0], (lines[1] if len(lines) > 1 else ""), (lines[2] if len(lines) > 2 else "Без названия")
-                price_str = "Договорная"
-                for k, line in enumerate(lines):
-                    if "Бюджет" in line and k+3 < len(lines): price_str = format_price_str(lines[k+3]); break
-                add_tender_direct(source_name, title, company, price_str, "-", "-", full_link)
-                print(f"🔥 [IT-Market] New: {title}")
+                card_links.append((card, full_link))
+            except Exception as e:
+                record_error(source_name, "card", e)
+                continue
+        new_links = set(await filter_new_links([l for _, l in card_links]))
+        lots = []
+        for card, full_link in card_links:
+            try:
+                if full_link not in new_links: continue
+                new_links.discard(full_link)
+                fields = parse_it_market_card(await card.inner_text())
+                if fields is None: continue
+                company, status, title, price_str = fields["company"], fields["status"], fields["title"], fields["price"]
                 msg = (f"<b>Тип анкеты: IT Заказ</b>\n\n🏢 <b>Заказчик:</b> {company}\nℹ️ <b>Статус:</b> {status}\n🛠 <b>Задача:</b> {title}\n💰 <b>Бюджет:</b> {price_str}\n🔗 <b>Ссылка:</b> {full_link}")
-                await send_notification_to_channel(msg, source_name, DEFAULT_PHOTO_PATH)
-                save_to_google_sheet("IT-Market", [datetime.now().strftime("%d.%m.%Y %H:%M"), company, status, title, price_str, full_link])
-            except: continue
-    except: pass
+                sheet_row = [datetime.now().strftime("%d.%m.%Y %H:%M"), company, status, title, price_str, full_link]
+                lots.append(new_lot(source_name, title, full_link, message=msg, sheet_row=sheet_row,
+                                    amount=to_amount(parse_price_to_number(price_str)), customer=known_or_none(company)))
+            except Exception as e: record_error(source_name, "lot", e)
+        await save_tenders(lots)
+    except Exception as e: record_error(source_name, "listing", e)
+
+# ==========================================
+# === 6.1 HTTP FAST PATH (JSON API без браузера) ===
+# ==========================================
+
+class EndpointShapeError(Exception):
+    """JSON-эндпоинт ответил не тем, что мы ожидаем (сменился API) - уходим на Playwright."""
+
+http_session = None  # aiohttp.ClientSession с общим пулом соединений
+
+async def get_http_session():
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+            headers={"Accept": "application/json", "User-Agent": HTTP_USER_AGENT}
+        )
+    return http_session
+
+async def close_http_session():
+    global http_session
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    http_session = None
+
+def _pick(row, keys, default=None):
+    for key in keys:
+        if row.get(key) not in (None, ""): return row[key]
+    return default
+
+def _extract_rows(payload):
+    """Достает список лотов из ответа: либо сам список, либо список под одним из типовых ключей."""
+    if isinstance(payload, dict):
+        for key in ("data", "items", "rows", "result", "lots"):
+            if isinstance(payload.get(key), list): payload = payload[key]; break
+    if not isinstance(payload, list) or not all(isinstance(r, dict) for r in payload):
+        raise EndpointShapeError(f"unexpected payload: {type(payload).__name__}")
+    return payload
+
+async def fetch_listing_json(url, page_num):
+    session = await get_http_session()
+    body = {"from": (page_num - 1) * HTTP_PAGE_SIZE + 1, "to": page_num * HTTP_PAGE_SIZE}
+    try:
+        async with crawl_limiter(url).slot() as slot, session.post(url, json=body) as resp:
+            slot.report(resp.status, resp.headers.get("Retry-After"))
+            if resp.status != 200: raise EndpointShapeError(f"HTTP {resp.status}")
+            try: payload = await resp.json(content_type=None)
+            except ValueError as e: raise EndpointShapeError(f"not JSON: {e}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise EndpointShapeError(f"request failed: {e}")
+    return _extract_rows(payload)
+
+ETENDER_ID_KEYS = ("lot_id", "lotId", "LotId", "id", "Id")
+XARID_ID_KEYS = ("lot_id", "lotId", "LotId", "id", "Id")
+
+def etender_link_from_row(row):
+    lot_id = _pick(row, ETENDER_ID_KEYS)
+    if lot_id is None: raise EndpointShapeError("etender row without lot id")
+    return f"https://etender.uzex.uz/lot/{lot_id}"
+
+def xarid_card_from_row(row):
+    """Собирает из JSON-строки текст в том же виде, что и карточка на сайте,
+    чтобы дальше работал тот же xarid_candidate_from_card."""
+    lot_id = _pick(row, XARID_ID_KEYS)
+    if lot_id is None: raise EndpointShapeError("xarid row without lot id")
+    lines = [f"Lot raqami: {lot_id}"]
+    category = _pick(row, ("category_name", "categoryName", "category", "toifa"))
+    if category: lines.append(f"Toifa: {category}")
+    # Остальные строковые поля (название, регион, заказчик) - для поиска ключевых слов и региона
+    lines += [str(v) for k, v in row.items() if isinstance(v, str) and k not in ("category_name", "categoryName", "category", "toifa")]
+    # Цены - последними и с подписью валюты: карточку потом склеивают в одну строку,
+    # и дата сразу за числом (8000000 2026-10-20...) иначе читалась бы как продолжение цены
+    start_cost = _pick(row, ("start_cost", "startCost", "start_price", "startPrice"))
+    if start_cost is not None: lines.append(f"Boshlang'ich narx: {xarid_row_price(start_cost)} UZS")
+    cost = _pick(row, ("cost", "current_cost", "currentCost", "current_price"))
+    if cost is not None: lines.append(f"Joriy narx: {xarid_row_price(cost)} UZS")
+    return "\n".join(lines)
+
+def xarid_row_price(value):
+    """Число из JSON отдаем как есть (без пробелов и экспоненты), строку - через parse_price_to_number."""
+    number = value if isinstance(value, (int, float)) and not isinstance(value, bool) else parse_price_to_number(str(value))
+    return f"{number:.2f}"
+
+async def parse_etender_http(pool):
+    """Список лотов Etender через JSON. False - эндпоинт недоступен/сменился, нужен Playwright."""
+    state = await CrawlState.load("Etender")
+    page_num = 1
+    while page_num <= MAX_PAGES_PER_RUN:
+        try:
+            rows = await fetch_listing_json(ETENDER_API_URL, page_num)
+            links = [etender_link_from_row(r) for r in rows]
+        except EndpointShapeError as e:
+            record_error("Etender", "api", e)
+            if page_num == 1:
+                print(f"⚠️ Etender API: {e}, переключаюсь на браузер")
+                return False
+            break
+        count_page("Etender")
+        print(f"🔎 Etender (API): Страница {page_num}, лотов: {len(links)}")
+        if not links:
+            state.finish()
+            break
+        new_links = await filter_new_links(links)
+        await process_lots("Etender", pool, [{"link": link} for link in new_links])
+        if state.observe([(_lot_number(_pick(r, ETENDER_ID_KEYS)), l) for r, l in zip(rows, links)]): break
+        page_num += 1
+    await state.save()
+    return True
+
+async def parse_xarid_http(pool):
+    """Список аукционов Xarid через JSON. False - эндпоинт недоступен/сменился, нужен Playwright."""
+    state = await CrawlState.load("Xarid.uz")
+    page_num = 1
+    while page_num <= MAX_PAGES_PER_RUN:
+        try:
+            rows = await fetch_listing_json(XARID_API_URL, page_num)
+            cards = [xarid_card_from_row(r) for r in rows]
+        except EndpointShapeError as e:
+            record_error("Xarid.uz", "api", e)
+            if page_num == 1:
+                print(f"⚠️ Xarid API: {e}, переключаюсь на браузер")
+                return False
+            break
+        count_page("Xarid.uz")
+        print(f"🔎 Xarid (API): Страница {page_num}, лотов: {len(cards)}")
+        if not cards:
+            state.finish()
+            break
+        await process_xarid_cards(pool, cards)
+        if state.observe([xarid_lot_from_card(c) for c in cards]): break
+        page_num += 1
+    await state.save()
+    return True
+
+SOURCE_PARSERS = {
+    "Xarid.uz": parse_xarid_uz,
+    "Etender": parse_etender,
+    "IT-Market": parse_it_market,
+    "Xarid.uz:prices": refresh_xarid_prices,
+}
+
+# Последний результат по каждой площадке: когда закончила, сколько шла, чем кончилось
+source_status = {}
+
+async def run_source_once(browsers, source_name):
+    """Один проход площадки с лимитом времени. BrowserContext (из BrowserPool) открывается
+    лениво - только когда парсеру понадобилась вкладка."""
+    started = time.monotonic()
+    status = "ok"
+    crawl_run_stats[source_name] = {"pages": 0, "lots": 0}
+    session = CrawlSession(browsers)
+    try:
+        try: await asyncio.wait_for(SOURCE_PARSERS[source_name](session, PagePool(session)), timeout=SOURCE_TIMEOUTS[source_name])
+        finally: await session.close()
+    except asyncio.TimeoutError:
+        status = "timeout"
+    except Exception as e:
+        status = f"error: {e}"
+        record_error(source_name, "run", e)
+    elapsed = time.monotonic() - started
+    source_status[source_name] = {"finished_at": datetime.now(), "elapsed": elapsed, "status": status}
+    run = crawl_run_stats[source_name]
+    metrics.observe("tender_crawl_run_seconds", elapsed, source=source_name)
+    metrics.inc("tender_crawl_runs_total", source=source_name, status=status.split(":")[0])
+    metrics.set("tender_crawl_last_run_timestamp", time.time(), source=source_name)
+    metrics.set("tender_crawl_last_run_pages", run["pages"], source=source_name)
+    metrics.set("tender_crawl_last_run_lots", run["lots"], source=source_name)
+    metrics.set("tender_crawl_last_run_lots_per_second", run["lots"] / elapsed if elapsed else 0, source=source_name)
+    print(f"🏁 {source_name}: {status}, {elapsed:.1f} с, страниц {run['pages']}, новых лотов {run['lots']} (закончил в {datetime.now().strftime('%H:%M:%S')})")
+    return elapsed
+
+async def source_loop(browsers, source_name):
+    # У каждой площадки свой цикл: медленный Etender не задерживает Xarid и IT-Market
+    while True:
+        elapsed = await run_source_once(browsers, source_name)
+        await asyncio.sleep(max(0, SOURCE_INTERVALS.get(source_name, PARSE_INTERVAL) - elapsed))
 
 async def parser_loop():
+    global browser_pool
     print("🚀 Parser started in background...")
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context(viewport={'width': 1920, 'height': 1080})
-        page = await context.new_page()
+    browser_pool = BrowserPool()
+    try: await asyncio.gather(*(source_loop(browser_pool, name) for name in SOURCE_PARSERS))
+    finally: await browser_pool.close()
+
+# ==========================================
+# === 6.2 ОЧЕРЕДЬ ЗАДАЧ ПАРСИНГА (ВОРКЕРЫ) ===
+# ==========================================
+# crawl_jobs: kind='source' - проход площадки, одна повторяющаяся строка на площадку;
+# kind='detail' - один новый лот (детальная страница), строка удаляется после обработки.
+# Воркеры забирают задачи через FOR UPDATE SKIP LOCKED - их можно запускать сколько угодно,
+# на разных машинах. Бот узнает о новых лотах через LISTEN tenders_new.
+
+DETAIL_HANDLERS = {
+    "Etender": lambda pool, payload: process_etender_lot(pool, payload["link"]),
+    "Xarid.uz": lambda pool, payload: process_xarid_lot(pool, *payload["candidate"]),
+}
+
+CLAIM_JOBS_QUERY = """
+    UPDATE crawl_jobs SET status = 'running', locked_by = $3, locked_at = now(), attempts = attempts + 1
+    WHERE id IN (
+        SELECT id FROM crawl_jobs
+        WHERE kind = $1 AND status = 'pending' AND run_after <= now()
+        ORDER BY run_after, id
+        LIMIT $2
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, kind, source, payload, attempts
+"""
+
+async def process_lots(source, pool, payloads):
+    """Новые лоты со страницы списка. Воркер ставит их в очередь (разберут все воркеры),
+    встроенный парсер разбирает сразу и сохраняет страницу одной пачкой.
+    Возвращает число сохраненных / поставленных в очередь."""
+    if not payloads: return 0
+    if PROCESS_ROLE == "worker": return await enqueue_detail_jobs(source, payloads)
+    lots = await asyncio.gather(*(DETAIL_HANDLERS[source](pool, p) for p in payloads))
+    try: return len(await save_tenders(lots))
+    except Exception as e:
+        record_error(source, "save", e)
+        return 0
+
+async def enqueue_detail_jobs(source, payloads):
+    try:
+        async with db_pool.acquire() as conn:
+            added = await conn.fetch("""
+                INSERT INTO crawl_jobs (kind, source, payload, dedup_key)
+                SELECT 'detail', $1, p::jsonb, k FROM unnest($2::text[], $3::text[]) AS u(p, k)
+                ON CONFLICT (dedup_key) DO NOTHING
+                RETURNING id
+            """, source, [json.dumps(p, ensure_ascii=False) for p in payloads], [p["link"] for p in payloads])
+            if added: await conn.execute("SELECT pg_notify($1, $2)", JOBS_CHANNEL, source)
+        metrics.inc("tender_jobs_enqueued_total", len(added), source=source)
+        return len(added)
+    except Exception as e:
+        record_error(source, "enqueue", e)
+        return 0
+
+async def ensure_source_jobs():
+    """По одной повторяющейся задаче прохода на площадку (повторный вызов ничего не меняет)."""
+    async with db_pool.acquire() as conn:
+        await conn.execute("""
+            INSERT INTO crawl_jobs (kind, source, dedup_key)
+            SELECT 'source', s, 'source:' || s FROM unnest($1::text[]) AS s
+            ON CONFLICT (dedup_key) DO NOTHING
+        """, list(SOURCE_PARSERS))
+
+async def claim_jobs(kind, limit):
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(CLAIM_JOBS_QUERY, kind, limit, WORKER_ID)
+    return [dict(r, payload=json.loads(r["payload"])) for r in rows]
+
+async def reap_stale_jobs():
+    """Задачи упавших воркеров (running дольше самого длинного таймаута) - обратно в очередь,
+    лоты, которые валили воркер JOB_MAX_ATTEMPTS раз, - выбрасываем."""
+    stale_after = float(max(SOURCE_TIMEOUTS.values()) + 120)
+    async with db_pool.acquire() as conn:
+        await conn.execute("""
+            DELETE FROM crawl_jobs WHERE kind = 'detail' AND status = 'running' AND attempts >= $2
+              AND locked_at < now() - make_interval(secs => $1)
+        """, stale_after, JOB_MAX_ATTEMPTS)
+        await conn.execute("""
+            UPDATE crawl_jobs SET status = 'pending', locked_by = NULL, run_after = now()
+            WHERE status = 'running' AND locked_at < now() - make_interval(secs => $1)
+        """, stale_after)
+
+async def source_job_loop(browsers):
+    """Слот воркера: забирает проход площадки, выполняет, планирует следующий через PARSE_INTERVAL."""
+    while True:
+        try:
+            jobs = await claim_jobs("source", 1)
+            if not jobs:
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+                continue
+            job = jobs[0]
+            elapsed = await run_source_once(browsers, job["source"])
+            status = source_status[job["source"]]["status"]
+            async with db_pool.acquire() as conn:
+                await conn.execute("""
+                    UPDATE crawl_jobs SET status = 'pending', attempts = 0, locked_by = NULL,
+                        run_after = now() + make_interval(secs => $2), last_error = $3
+                    WHERE id = $1
+                """, job["id"], float(max(0, SOURCE_INTERVALS.get(job["source"], PARSE_INTERVAL) - elapsed)), None if status == "ok" else status)
+        except Exception as e:
+            print(f"⚠️ Source job error: {e}")
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+async def run_detail_jobs(browsers, jobs):
+    async with browsers.context() as context:
+        pool = PagePool(context)
+        async def run(job):
+            try: return await DETAIL_HANDLERS[job["source"]](pool, job["payload"])
+            except Exception as e: record_error(job["source"], "job", e)
+            finally: metrics.inc("tender_jobs_done_total", source=job["source"])
+        lots = await asyncio.gather(*(run(job) for job in jobs))
+    # Вся пачка - одним INSERT; упал - задачи остаются 'running', и reap_stale_jobs вернет их в очередь
+    await save_tenders(lots)
+    async with db_pool.acquire() as conn:
+        await conn.execute("DELETE FROM crawl_jobs WHERE id = ANY($1::bigint[])", [j["id"] for j in jobs])
+
+async def detail_job_loop(browsers, wakeup):
+    """Забирает пачку лотов из общей очереди и разбирает их во вкладках PagePool."""
+    while True:
+        try:
+            jobs = await claim_jobs("detail", WORKER_DETAIL_BATCH)
+            if jobs:
+                await run_detail_jobs(browsers, jobs)
+                continue
+        except Exception as e:
+            print(f"⚠️ Detail job error: {e}")
+        wakeup.clear()
+        try: await asyncio.wait_for(wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError: pass
+
+async def job_reaper_loop():
+    while True:
+        try: await reap_stale_jobs()
+        except Exception as e: print(f"⚠️ Job reaper error: {e}")
+        await asyncio.sleep(60)
+
+async def listen_forever(channels, on_connect=None):
+    """LISTEN на выделенном соединении пула; channels - {канал: callback(payload)}.
+    При обрыве соединения переподключается и зовет on_connect() - догнать пропущенное."""
+    while True:
+        try:
+            async with db_pool.acquire() as conn:
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda c: lost.set())
+                listeners = [(channel, lambda c, pid, ch, payload, cb=callback: cb(payload)) for channel, callback in channels.items()]
+                for channel, listener in listeners: await conn.add_listener(channel, listener)
+                try:
+                    if on_connect: await on_connect()
+                    await lost.wait()
+                finally:
+                    if not conn.is_closed():
+                        for channel, listener in listeners: await conn.remove_listener(channel, listener)
+        except asyncio.CancelledError: raise
+        except Exception as e:
+            print(f"⚠️ LISTEN error: {e}")
+        await asyncio.sleep(5)
+
+# === Бот: новые лоты от воркеров ===
+announced_until = None  # Время БД, до которого (минус ANNOUNCE_OVERLAP) бот уже знает все лоты
+announced_ids = {}      # id -> date_added объявленных лотов внутри окна перекрытия - чтобы не объявить дважды
+
+async def announce_tenders(ids=None):
+    """Лоты, сохраненные воркерами: кэш ссылок, буферы ленты, подписки. ids=None - догнать все,
+    добавленные после announced_until с перекрытием (старт бота или обрыв LISTEN)."""
+    global announced_until
+    columns = "id, source, title, link, amount, current_amount, currency, start_at, end_at, region, category, customer, items_desc, date_added"
+    async with db_pool.acquire() as conn:
+        if announced_until is None:
+            # Старт бота: все, что уже лежит в базе, не новость - в том числе лоты окна перекрытия
+            announced_until = await conn.fetchval("SELECT localtimestamp")
+            known = await conn.fetch("SELECT id, date_added FROM tenders WHERE date_added >= $1",
+                                     announced_until - timedelta(seconds=ANNOUNCE_OVERLAP))
+            announced_ids.update((r["id"], r["date_added"]) for r in known)
+            return
+        if ids is None:
+            # По времени, а не по max(id): лот с меньшим id мог закоммититься уже после отметки
+            since = announced_until - timedelta(seconds=ANNOUNCE_OVERLAP)
+            announced_until = await conn.fetchval("SELECT localtimestamp")
+            rows = await conn.fetch(f"SELECT {columns} FROM tenders WHERE date_added >= $1 ORDER BY id", since)
+        else: rows = await conn.fetch(f"SELECT {columns} FROM tenders WHERE id = ANY($1::int[]) ORDER BY id", ids)
+    # Отмечаем до первого await: догон после LISTEN и NOTIFY могут прийти одновременно
+    rows = [r for r in rows if r["id"] not in announced_ids]
+    announced_ids.update((r["id"], r["date_added"]) for r in rows)
+    for r in rows:
+        remember_link(r["link"])
+        offer_new_lot(r["source"], dict(r))
+        # Несколько экземпляров: рассылку по подпискам делает только лидер, иначе каждый лот придет N раз
+        if is_leader: await notify_subscribers(r["source"], r["title"], r["link"], dict(r))
+    # Лоты старше окна перекрытия следующий догон уже не вернет - помнить их незачем
+    horizon = announced_until - timedelta(seconds=ANNOUNCE_OVERLAP)
+    for tender_id in [i for i, added in announced_ids.items() if added is None or added < horizon]: del announced_ids[tender_id]
+    if rows: outbox_wakeup.set()
+
+async def catch_up(reconnect):
+    """После (пере)подключения LISTEN: догнать лоты и подписки, изменившиеся без нас."""
+    await announce_tenders()
+    if reconnect and BOT_MODE == "webhook": await load_subscriptions()
+
+async def tender_listener():
+    """Новые лоты от воркеров и соседних экземпляров, пробуждение outbox, чужие правки подписок."""
+    # Снимок "что уже есть в базе" - до LISTEN: иначе NOTIFY, пришедший раньше снимка,
+    # попал бы в него как старый лот и остался без рассылки
+    while announced_until is None:
+        try: await announce_tenders()
+        except Exception as e:
+            print(f"⚠️ Announce snapshot error: {e}")
+            await asyncio.sleep(5)
+    connects = 0
+    async def on_connect():
+        nonlocal connects
+        connects += 1
+        await catch_up(reconnect=connects > 1)
+    pending = asyncio.Queue()
+    async def consume():
         while True:
-            await parse_xarid_uz(page)
-            await parse_etender(page)
-            await parse_it_market(page)
-            print("💤 Parsing paused for 5 minutes...")
-            await asyncio.sleep(300)
+            payloads = [await pending.get()]
+            while not pending.empty(): payloads.append(pending.get_nowait())
+            ids = [int(i) for payload in payloads for i in payload.split(",")]
+            try: await announce_tenders(ids)
+            except Exception as e: print(f"⚠️ Announce error: {e}")
+    spawn(consume(), "Announce consumer stopped")
+    await listen_forever({
+        TENDERS_CHANNEL: lambda payload: pending.put_nowait(payload),  # "id,id,..." - лоты одной пачки
+        OUTBOX_CHANNEL: lambda payload: outbox_wakeup.set(),
+        SUBSCRIPTIONS_CHANNEL: lambda payload: spawn(reload_user_subscriptions(int(payload)), "Subscriptions reload error"),
+    }, on_connect=on_connect)
 
 # ==========================================
 # === 7. TELEGRAM BOT LOGIC ===
@@ -809,6 +2947,7 @@ def get_bottom_menu():
     kb = ReplyKeyboardBuilder()
     kb.button(text="🔙 Выбрать источник")
     kb.button(text="❤️ Мои лайки")
+    kb.button(text="🔔 Подписки")
     return kb.as_markup(resize_keyboard=True)
 
 def get_tinder_keyboard(tender_id, source):
@@ -818,34 +2957,24 @@ def get_tinder_keyboard(tender_id, source):
     kb.adjust(2)
     return kb.as_markup()
 
-def format_caption(source, title, desc, price, start, end, link):
+def format_caption(source, t):
+    """t - строка tenders (dict) из fetch_tender_batch: все поля уже типизированы, разбирать нечего."""
+    title, link = t["title"], t["link"]
+    start, end = format_site_datetime(t["start_at"]), format_site_datetime(t["end_at"])
+    region = t["region"] or "Не указан"
     if source == "Xarid.uz":
-        toifa, region, current_price = "Не указана", "Не указан", "Нет"
-        if desc and "||" in desc:
-            parts = desc.split("||")
-            if len(parts) >= 3: toifa, region, current_price = parts[0], parts[1], parts[2]
         lot_number = title.replace("Лот №", "").replace("Лот ", "")
-        return (f"📢 *Новый лот на Xarid.uz*\n\n1. *Номер лота:* {lot_number}\n2. *Квалификация:* {toifa}\n3. *Район:* {region}\n4. *Срок окончания:* {end}\n5. *Начальная цена:* {price}\n6. *Текущая цена:* {current_price}\n7. *Ссылка:* {link}")
+        price, current_price = format_amount(t["amount"], t["currency"]), format_amount(t["current_amount"], default="Нет ставок")
+        return (f"📢 *Новый лот на Xarid.uz*\n\n1. *Номер лота:* {lot_number}\n2. *Квалификация:* {t['category'] or 'Не указана'}\n3. *Район:* {region}\n4. *Срок окончания:* {end}\n5. *Начальная цена:* {price}\n6. *Текущая цена:* {current_price}\n7. *Ссылка:* {link}")
     
     elif source == "Etender":
-        region = "Не указан"
-        currency = ""
-        if desc and "||" in desc:
-             parts = desc.split("||")
-             if len(parts) >= 2: region = parts[1]
-             if len(parts) >= 3: currency = parts[2]
         lot_number = title.replace("Лот №", "").replace("Лот ", "")
-        
-        display_price = price if " " in price else f"{price} {currency}"
-        return (f"📢 *Новый Тендер на Etender*\n\n1. *Номер лота:* {lot_number}\n2. *Район:* {region}\n3. *Начало:* {start}\n4. *Конец:* {end}\n5. *Бюджет:* {display_price}\n6. *Ссылка:* {link}")
+        return (f"📢 *Новый Тендер на Etender*\n\n1. *Номер лота:* {lot_number}\n2. *Район:* {region}\n3. *Начало:* {start}\n4. *Конец:* {end}\n5. *Бюджет:* {format_amount(t['amount'], t['currency'])}\n6. *Ссылка:* {link}")
 
     else:
         display_title = title if title else "Без названия"
-        company, status = desc, "-"
-        if desc and "(" in desc and desc.strip().endswith(")"):
-            try: company, status = desc.rsplit(" (", 1); status = status.replace(")", "")
-            except: pass
-        return (f"📢 *Новый заказ на {source}*\n\n🏢 *Заказчик:* {company}\nℹ️ *Статус:* {status}\n🛠 *Задача:* {display_title}\n\n💰 *Бюджет:* {price}\n📅 *Начало:* {start}\n🏁 *Дедлайн:* {end}\n\n🔗 [Посмотреть подробнее]({link})")
+        price = format_amount(t["amount"], default="Договорная")
+        return (f"📢 *Новый заказ на {source}*\n\n🏢 *Заказчик:* {t['customer'] or '-'}\nℹ️ *Статус:* -\n🛠 *Задача:* {display_title}\n\n💰 *Бюджет:* {price}\n📅 *Начало:* {start}\n🏁 *Дедлайн:* {end}\n\n🔗 [Посмотреть подробнее]({link})")
 
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
@@ -856,47 +2985,190 @@ async def cmd_start(message: types.Message):
 async def menu_button_handler(message: types.Message):
     await message.answer("🔎 Выберите площадку:", reply_markup=get_source_menu())
 
+# === Мои лайки: одно сообщение, листается правкой на месте. Курсор страницы - в callback_data ===
+async def render_favorites_page(user_id, cursor="0"):
+    page = await get_favorites_page(user_id, decode_fav_cursor(cursor))
+    if not page["items"] and cursor != "0": page = await get_favorites_page(user_id)  # страницы больше нет - в начало
+    if not page["items"]: return "💔 Вы пока ничего не добавили в избранное.", None
+    lines = [f"❤️ <b>Ваши избранные</b>: {page['total']} шт."]
+    kb = InlineKeyboardBuilder()
+    for n, t in enumerate(page["items"], start=1):
+        is_auction = t["source"] in ("Xarid.uz", "Etender")
+        price = format_amount(t["amount"], t["currency"]) if is_auction else format_amount(t["amount"], default="Договорная")
+        lines.append(f"\n<b>{n}. {'🔢' if is_auction else '🛠'} {html.escape(t['title'] or 'Без названия')}</b>\n🏛 {t['source']} 💰 {price}\n🔗 {html.escape(t['link'])}")
+        kb.button(text=f"🗑 {n}", callback_data=f"favrm_{t['tender_id']}_{page['cursor']}")
+    nav = []
+    if page["prev"]: nav.append(types.InlineKeyboardButton(text="◀️ Назад", callback_data=f"favs_{page['prev']}"))
+    if page["next"]: nav.append(types.InlineKeyboardButton(text="Вперед ▶️", callback_data=f"favs_{page['next']}"))
+    kb.adjust(5)
+    if nav: kb.row(*nav)
+    kb.row(
+        types.InlineKeyboardButton(text="🗑 Удалить страницу", callback_data=f"favdel_{page['cursor']}"),
+        types.InlineKeyboardButton(text="🧹 Очистить всё", callback_data="favclear"),
+    )
+    return "\n".join(lines), kb.as_markup()
+
+async def show_favorites_page(callback: types.CallbackQuery, cursor, notice=None):
+    text, markup = await render_favorites_page(callback.from_user.id, cursor)
+    try: await callback.message.edit_text(text, parse_mode="HTML", reply_markup=markup, disable_web_page_preview=True)
+    except TelegramBadRequest: pass  # "message is not modified" - страница не изменилась
+    await callback.answer(notice)
+
 @dp.message(F.text == "❤️ Мои лайки")
 async def favorites_button_handler(message: types.Message):
-    user_id = message.from_user.id
-    favorites = get_user_favorites(user_id)
-    if not favorites:
-        await message.answer("💔 Вы пока ничего не добавили в избранное.")
-        return
-    await message.answer(f"📋 *Ваши избранные ({len(favorites)} шт):*", parse_mode="Markdown")
-    for row in favorites:
-        t_id, title, price, link, source = row[:5]
-        display_title = title if title else "Без названия"
-        text = f"🔢 *{display_title}*\n🏛 {source}\n💰 {price}\n🔗 {link}" if source in ["Xarid.uz", "Etender"] else f"🛠 *{display_title}*\n🏛 {source}\n💰 {price}\n🔗 [Открыть]({link})"
-        kb = InlineKeyboardBuilder()
-        kb.button(text="🗑 Удалить", callback_data=f"del_fav_{t_id}")
-        await message.answer(text, parse_mode="Markdown", disable_web_page_preview=True, reply_markup=kb.as_markup())
+    text, markup = await render_favorites_page(message.from_user.id)
+    await message.answer(text, parse_mode="HTML", reply_markup=markup, disable_web_page_preview=True)
+
+@dp.callback_query(F.data.startswith("favs_"))
+async def favorites_page_handler(callback: types.CallbackQuery):
+    await show_favorites_page(callback, callback.data.split("_", 1)[1])
+
+@dp.callback_query(F.data.startswith("favrm_"))
+async def favorite_remove_handler(callback: types.CallbackQuery):
+    _, tender_id, cursor = callback.data.split("_", 2)
+    await delete_favorite(callback.from_user.id, tender_id)
+    await show_favorites_page(callback, cursor, "🗑 Удалено!")
+
+@dp.callback_query(F.data.startswith("favdel_"))
+async def favorites_delete_page_handler(callback: types.CallbackQuery):
+    cursor = callback.data.split("_", 1)[1]
+    await delete_favorites_page(callback.from_user.id, decode_fav_cursor(cursor), FAVORITES_PAGE_SIZE)
+    await show_favorites_page(callback, cursor, "🗑 Страница удалена")
+
+@dp.callback_query(F.data == "favclear")
+async def favorites_clear_handler(callback: types.CallbackQuery):
+    kb = InlineKeyboardBuilder()
+    kb.button(text="✅ Да, удалить все", callback_data="favclear_yes")
+    kb.button(text="↩️ Отмена", callback_data="favs_0")
+    await callback.message.edit_text("🧹 Удалить все лайки? Это нельзя отменить.", reply_markup=kb.as_markup())
+    await callback.answer()
+
+@dp.callback_query(F.data == "favclear_yes")
+async def favorites_clear_confirm_handler(callback: types.CallbackQuery):
+    await clear_favorites(callback.from_user.id)
+    await show_favorites_page(callback, "0", "🧹 Избранное очищено")
 
 @dp.callback_query(F.data.startswith("source_"))
 async def start_swiping(callback: types.CallbackQuery):
     source_name = callback.data.split("_")[1]
     await callback.answer(f"Загружаю {source_name}...")
+    invalidate_card_buffers(user_id=callback.from_user.id)
     await show_next_card(callback.message, callback.from_user.id, source_name)
 
+# === Предзагрузка карточек: следующие N лотов на пользователя и площадку ===
+background_tasks = set()  # Держим ссылки: иначе задачу может собрать GC, а ошибка потеряется
+
+def spawn(coro, what):
+    """Фоновая задача, которую никто не ждет: ошибку печатаем в done-callback."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    def done(task):
+        background_tasks.discard(task)
+        if not task.cancelled() and task.exception(): print(f"⚠️ {what}: {task.exception()}")
+    task.add_done_callback(done)
+    return task
+
+class CardBuffer:
+    def __init__(self):
+        self.new_cards = deque()  # [(tender_id, caption), ...] новые по возрастанию id - подпись готова заранее
+        self.old_cards = deque()  # то же для истории, по убыванию id
+        self.high_id = None       # Курсор для следующей дозагрузки (после хвоста буфера)
+        self.low_id = None
+        self.new_done = False     # Все новые лоты до high_id уже в буфере: свежий лот можно дописать сразу
+        self.exhausted = False
+        self.refill_task = None
+
+card_buffers = {}  # (user_id, source) -> CardBuffer
+
+def invalidate_card_buffers(user_id=None, source=None):
+    """Сбрасывает буферы пользователя и/или площадки (сменили площадку, поменялись цены в подписях)."""
+    for key in [k for k in card_buffers if (user_id is None or k[0] == user_id) and (source is None or k[1] == source)]:
+        del card_buffers[key]
+
+def offer_new_lot(source, t):
+    """Новый лот - в хвост новых карточек у буферов площадки, которые уже выбрали все новые лоты.
+    Остальные доберут его сами: дозагрузка идет от high_id вверх."""
+    caption = None
+    for (_, buf_source), buf in card_buffers.items():
+        if buf_source != source or not buf.new_done: continue
+        if buf.high_id != FEED_EMPTY_ID and t["id"] <= buf.high_id: continue
+        if any(card[0] == t["id"] for card in buf.new_cards): continue
+        caption = caption or format_caption(source, t)
+        buf.new_cards.append((t["id"], caption))
+        if buf.high_id != FEED_EMPTY_ID: buf.high_id = t["id"]
+
+def forget_seen_cards(user_id, source, high_id, low_id):
+    """Несколько экземпляров бота: часть буфера пользователь мог уже пролистать на другом.
+    Выкидываем карточки из просмотренного диапазона [low_id, high_id] (его вернул mark_seen)
+    и сдвигаем за него курсор дозагрузки."""
+    buf = card_buffers.get((user_id, source))
+    if buf is None or buf.high_id is None: return
+    buf.new_cards = deque(card for card in buf.new_cards if not low_id <= card[0] <= high_id)
+    buf.old_cards = deque(card for card in buf.old_cards if not low_id <= card[0] <= high_id)
+    buf.high_id, buf.low_id = max(buf.high_id, high_id), min(buf.low_id, low_id)
+
+async def _refill_cards(key, buf):
+    user_id, source = key
+    if buf.high_id is None: buf.high_id, buf.low_id = await get_feed_state(user_id, source)
+    batch = await fetch_tender_batch(user_id, source, buf.high_id, buf.low_id, PREFETCH_SIZE)
+    if card_buffers.get(key) is not buf: return  # буфер уже сброшен, результат устарел
+    for pri, t in batch:
+        if pri == 0:
+            buf.high_id = t["id"]
+            buf.new_cards.append((t["id"], format_caption(source, t)))
+        else:
+            buf.low_id = t["id"]
+            buf.old_cards.append((t["id"], format_caption(source, t)))
+    buf.exhausted = len(batch) < PREFETCH_SIZE
+    buf.new_done = buf.exhausted or any(pri == 1 for pri, _ in batch)
+
+async def next_card(user_id, source):
+    """Следующая карточка из буфера. Запрос в БД на критическом пути - только если буфер пуст."""
+    key = (user_id, source)
+    buf = card_buffers.get(key)
+    if buf is None:
+        if len(card_buffers) >= PREFETCH_MAX_BUFFERS: del card_buffers[next(iter(card_buffers))]
+        buf = card_buffers[key] = CardBuffer()
+    if not buf.new_cards and not buf.old_cards and not buf.exhausted:
+        if buf.refill_task and not buf.refill_task.done(): await buf.refill_task
+        else: await _refill_cards(key, buf)
+    cards = buf.new_cards or buf.old_cards
+    card = cards.popleft() if cards else None
+    if len(buf.new_cards) + len(buf.old_cards) < PREFETCH_LOW_WATER and not buf.exhausted and (buf.refill_task is None or buf.refill_task.done()):
+        buf.refill_task = spawn(_refill_cards(key, buf), "Card prefetch error")
+    return card
+
 async def show_next_card(message: types.Message, user_id, source_name):
-    tender = get_next_tender(user_id, source_name)
-    if not tender:
+    card = await next_card(user_id, source_name)
+    if not card:
         await message.answer(f"🎉 На площадке *{source_name}* всё просмотрено!", parse_mode="Markdown")
         return
-    t_id, title, desc, price, start, end, link = tender
-    caption_text = format_caption(source_name, title, desc, price, start, end, link)
+    t_id, caption_text = card
     if os.path.exists(DEFAULT_PHOTO_PATH):
-        photo = FSInputFile(DEFAULT_PHOTO_PATH)
-        await message.answer_photo(photo=photo, caption=caption_text, parse_mode="Markdown", reply_markup=get_tinder_keyboard(t_id, source_name))
+        sent = await message.answer_photo(photo=get_photo_input(DEFAULT_PHOTO_PATH), caption=caption_text, parse_mode="Markdown", reply_markup=get_tinder_keyboard(t_id, source_name))
+        remember_photo(DEFAULT_PHOTO_PATH, sent)
     else:
         await message.answer(text=caption_text, parse_mode="Markdown", reply_markup=get_tinder_keyboard(t_id, source_name), disable_web_page_preview=True)
 
+async def save_swipe(user_id, source, t_id, liked):
+    """Запись свайпа в БД - уже после того, как пользователь получил следующую карточку."""
+    if liked: await add_favorite(user_id, t_id)
+    forget_seen_cards(user_id, source, *await mark_seen(user_id, source, t_id))
+
+def card_link(message: types.Message):
+    """Ссылка из разметки самой карточки ([Посмотреть подробнее](link)) - без запроса в БД."""
+    for entity in message.caption_entities or message.entities or []:
+        if entity.type == "text_link": return entity.url
+    return None
+
 @dp.callback_query(F.data.startswith("like_"))
 async def handle_like(callback: types.CallbackQuery):
     _, t_id, source = callback.data.split("_", 2)
-    add_favorite(callback.from_user.id, t_id)
+    await callback.answer("❤️ Сохранено")
+    await show_next_card(callback.message, callback.from_user.id, source)
+    spawn(save_swipe(callback.from_user.id, source, t_id, liked=True), "Like save error")
     old_text = callback.message.caption or callback.message.text
-    link = get_tender_link(t_id)
+    link = card_link(callback.message) or await get_tender_link(t_id)
     restored_text = old_text
     if link:
         if source == "Xarid.uz":
@@ -907,40 +3179,255 @@ async def handle_like(callback: types.CallbackQuery):
     new_text = f"{restored_text}\n\n✅ *В ИЗБРАННОМ*"
     if callback.message.photo: await callback.message.edit_caption(caption=new_text, parse_mode="Markdown", reply_markup=None)
     else: await callback.message.edit_text(text=new_text, parse_mode="Markdown", reply_markup=None, disable_web_page_preview=True)
-    await callback.answer("❤️ Сохранено")
-    await show_next_card(callback.message, callback.from_user.id, source)
 
 @dp.callback_query(F.data.startswith("dislike_"))
 async def handle_dislike(callback: types.CallbackQuery):
     _, t_id, source = callback.data.split("_", 2)
+    await callback.answer("👎 Пропущено")
+    await show_next_card(callback.message, callback.from_user.id, source)
+    spawn(save_swipe(callback.from_user.id, source, t_id, liked=False), "Swipe save error")
     old_text = callback.message.caption or callback.message.text
     new_text = f"{old_text}\n\n❌ *ПРОПУЩЕНО*"
     if callback.message.photo: await callback.message.edit_caption(caption=new_text, parse_mode="Markdown", reply_markup=None)
     else: await callback.message.edit_text(text=new_text, parse_mode="Markdown", reply_markup=None, disable_web_page_preview=True)
-    await callback.answer("👎 Пропущено")
-    await show_next_card(callback.message, callback.from_user.id, source)
 
+# Кнопки из старых сообщений "по одному лайку на сообщение"
 @dp.callback_query(F.data.startswith("del_fav_"))
 async def delete_favorite_handler(callback: types.CallbackQuery):
     tender_id = callback.data.split("_")[2]
-    delete_favorite(callback.from_user.id, tender_id)
+    await delete_favorite(callback.from_user.id, tender_id)
     await callback.message.delete()
     await callback.answer("🗑 Удалено!")
 
+# === Поиск /search: текст запроса - в search_queries, в кнопках листания - его id и номер страницы ===
+async def render_search_page(query_id, query, page):
+    rows = await search_tenders(query, SEARCH_PAGE_SIZE, page * SEARCH_PAGE_SIZE)
+    if not rows:
+        return (f"🔍 По запросу <b>{html.escape(query)}</b> ничего не найдено." if page == 0 else "🔍 Больше результатов нет."), None
+    total = rows[0]["total"]
+    pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    lines = [f"🔍 <b>{html.escape(query)}</b>: найдено {total} (стр. {page + 1}/{pages})"]
+    for n, t in enumerate(rows, start=page * SEARCH_PAGE_SIZE + 1):
+        items = (t["items_desc"] or "").split("\n")[0][:120]
+        lines.append(
+            f"\n<b>{n}. {html.escape(t['title'] or 'Без названия')}</b> - {t['source']}\n"
+            + (f"📦 {html.escape(items)}\n" if items else "")
+            + (f"📂 {html.escape(t['category'])}\n" if t["category"] else "")
+            + f"💰 {format_amount(t['amount'], t['currency'])} ⏳ {format_site_datetime(t['end_at'])}\n🔗 {t['link']}"
+        )
+    kb = InlineKeyboardBuilder()
+    if page > 0: kb.button(text="◀️ Назад", callback_data=f"search_{query_id}_{page - 1}")
+    if page + 1 < pages: kb.button(text="Вперед ▶️", callback_data=f"search_{query_id}_{page + 1}")
+    return "\n".join(lines), kb.as_markup()
+
+@dp.message(Command("search"))
+async def cmd_search(message: types.Message):
+    query = message.text.partition(" ")[2].strip()[:200]
+    if not query:
+        await message.answer("🔍 Поиск по лотам: `/search сервер Ташкент`\nМожно \"точную фразу\", `-исключить` и `or`.", parse_mode="Markdown")
+        return
+    query_id = await save_search_query(message.from_user.id, query)
+    text, markup = await render_search_page(query_id, query, 0)
+    await message.answer(text, parse_mode="HTML", reply_markup=markup, disable_web_page_preview=True)
+
+@dp.callback_query(F.data.startswith("search_"))
+async def search_page_handler(callback: types.CallbackQuery):
+    parts = callback.data.split("_")
+    # Кнопки старого формата (search_<страница>) ссылались на запрос в памяти процесса
+    query = await get_search_query(callback.from_user.id, int(parts[1])) if len(parts) == 3 else None
+    if query is None:
+        await callback.answer("Поиск устарел, повторите /search", show_alert=True)
+        return
+    text, markup = await render_search_page(int(parts[1]), query, int(parts[2]))
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=markup, disable_web_page_preview=True)
+    await callback.answer()
+
+SUBSCRIBE_HELP = (
+    "🔔 *Подписка на новые лоты*\n\n"
+    "`/subscribe сервер, ноутбук; регион: Ташкент; цена: 5000000-100000000; площадка: Etender`\n\n"
+    "Первая часть - ключевые слова (любое из них). Регион, цена (в сумах) и площадка - по желанию.\n"
+    "Список подписок: /subscriptions"
+)
+
+@dp.message(Command("subscribe"))
+async def cmd_subscribe(message: types.Message):
+    args = message.text.partition(" ")[2].strip()
+    if not args:
+        await message.answer(SUBSCRIBE_HELP, parse_mode="Markdown")
+        return
+    try: spec = parse_subscription(args)
+    except ValueError as e:
+        await message.answer(f"⚠️ {e}\n\n{SUBSCRIBE_HELP}", parse_mode="Markdown")
+        return
+    sub = await add_subscription(message.from_user.id, spec)
+    if sub is None:
+        await message.answer(f"⚠️ Не больше {SUBSCRIPTIONS_PER_USER} подписок. Удалите лишние: /subscriptions")
+        return
+    await message.answer(f"✅ Подписка #{sub.id} сохранена:\n{sub.describe()}")
+
+@dp.message(Command("subscriptions"))
+@dp.message(F.text == "🔔 Подписки")
+async def subscriptions_handler(message: types.Message):
+    subs = subscription_index.user_subscriptions(message.from_user.id)
+    if not subs:
+        await message.answer(SUBSCRIBE_HELP, parse_mode="Markdown")
+        return
+    for sub in subs:
+        kb = InlineKeyboardBuilder()
+        kb.button(text="🗑 Удалить", callback_data=f"del_sub_{sub.id}")
+        await message.answer(f"🔔 Подписка #{sub.id}\n{sub.describe()}", reply_markup=kb.as_markup())
+
+@dp.callback_query(F.data.startswith("del_sub_"))
+async def delete_subscription_handler(callback: types.CallbackQuery):
+    await delete_subscription(callback.from_user.id, callback.data.split("_")[2])
+    await callback.message.delete()
+    await callback.answer("🗑 Подписка удалена")
+
+# ==========================================
+# === 7.1 WEBHOOK И НЕСКОЛЬКО ЭКЗЕМПЛЯРОВ БОТА ===
+# ==========================================
+LEADER_LOCK_KEY = 0x74656e64  # pg_advisory_lock: один лидер на базу
+is_leader = BOT_MODE != "webhook"  # polling - процесс один, он и лидер
+
+def start_background_tasks():
+    """То, что должно идти ровно в одном экземпляре бота: доставка outbox (лимиты Telegram
+    считаются на бота целиком) и встроенный парсер."""
+    tasks = [asyncio.create_task(outbox_worker())]
+    if CRAWLER_MODE != "queue": tasks.append(asyncio.create_task(parser_loop()))
+    return tasks
+
+async def leader_loop():
+    """Выборы через pg_try_advisory_lock на выделенном соединении. Лидер запускает
+    start_background_tasks(); упал или потерял базу - замок освобождается вместе с сессией,
+    и его забирает другой экземпляр в течение LEADER_RETRY_INTERVAL."""
+    global is_leader
+    while True:
+        try:
+            async with db_pool.acquire() as conn:
+                if await conn.fetchval("SELECT pg_try_advisory_lock($1)", LEADER_LOCK_KEY):
+                    is_leader = True
+                    metrics.set("tender_bot_leader", 1)
+                    print(f"👑 {WORKER_ID}: лидер (outbox, подписки{', парсер' if CRAWLER_MODE != 'queue' else ''})")
+                    tasks = start_background_tasks()
+                    try:
+                        # Обрыв соединения = потеря замка: пингуем, чтобы узнать об этом
+                        while True:
+                            await asyncio.sleep(LEADER_RETRY_INTERVAL)
+                            await conn.fetchval("SELECT 1")
+                    finally:
+                        is_leader = False
+                        metrics.set("tender_bot_leader", 0)
+                        for task in tasks: task.cancel()
+                        if not conn.is_closed():
+                            with contextlib.suppress(Exception): await conn.execute("SELECT pg_advisory_unlock($1)", LEADER_LOCK_KEY)
+        except asyncio.CancelledError: raise
+        except Exception as e:
+            print(f"⚠️ Leader error: {e}")
+        await asyncio.sleep(LEADER_RETRY_INTERVAL)
+
+async def run_webhook():
+    """aiohttp-сервер: POST WEBHOOK_PATH -> dp. Чужие запросы (без секретного заголовка) получают 401.
+    SIGTERM/SIGINT - перестаем принимать соединения, ждем начатые апдейты до WEBHOOK_SHUTDOWN_TIMEOUT."""
+    app = web.Application()
+    # handle_in_background=False: Telegram получает 200 только после обработки. Апдейт, который
+    # экземпляр не успел обработать (рестарт, падение), Telegram повторит - уже на соседний
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET, handle_in_background=False).register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/healthz", _healthz_handler)
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app, shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+    await runner.setup()
+    # reuse_port: несколько процессов на одной машине делят один порт, соединения раскидывает ядро
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=True).start()
+    print(f"🌐 Webhook: http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}" + (f" (Bot API: {TELEGRAM_API_URL})" if TELEGRAM_API_URL else ""))
+    if WEBHOOK_BASE_URL:
+        # Все экземпляры регистрируют один и тот же URL - повторный вызов ничего не меняет.
+        # При остановке вебхук не снимаем: соседние экземпляры продолжают работать
+        await bot.set_webhook(
+            WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(), max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError): loop.add_signal_handler(sig, stop.set)  # Windows: только Ctrl+C
+    try: await stop.wait()
+    finally:
+        print("🛑 Webhook: останавливаюсь, дожидаюсь начатых апдейтов...")
+        await runner.cleanup()
+        await bot.session.close()
+
 # ==========================================
 # === 8. MAIN (STARTUP) ===
 # ==========================================
 
 async def main():
+    global sheets_sink
     print("🚀 Starting initialization...")
-    try: init_db()
+    try:
+        await create_db_pool()
+        await init_db()
+        await load_known_links()
+        await load_rejected_links()
+        await load_subscriptions()
+    except Exception as e:
+        print(f"❌ CRITICAL DB ERROR: {e}")
+        return
+    if not await db_health_check():
+        print("❌ CRITICAL DB ERROR: health check failed")
+        await close_db_pool()
+        return
+    if os.path.exists(GOOGLE_KEY_FILE):
+        sheets_sink = SheetsSink(GOOGLE_KEY_FILE, GOOGLE_SHEET_NAME)
+        sheets_sink.start()
+    metrics_runner = await start_metrics_server()
+    print(f"🤖 Starting Bot ({BOT_MODE}) and Parser...")
+    # webhook: экземпляров может быть несколько - outbox и парсер запускает выбранный лидер
+    if BOT_MODE == "webhook": asyncio.create_task(leader_loop())
+    else: start_background_tasks()
+    # queue: парсят воркеры (python main.py worker); webhook: новые лоты и подписки приходят и от соседей
+    if BOT_MODE == "webhook" or CRAWLER_MODE == "queue": asyncio.create_task(tender_listener())
+    try:
+        if BOT_MODE == "webhook": await run_webhook()
+        else: await dp.start_polling(bot)
+    finally:
+        if sheets_sink: await asyncio.get_running_loop().run_in_executor(None, sheets_sink.stop)
+        if metrics_runner: await metrics_runner.cleanup()
+        await close_http_session()
+        await close_db_pool()
+
+async def worker_main():
+    """python main.py worker - только парсинг: проходы площадок и лоты из crawl_jobs, без Telegram."""
+    global sheets_sink, browser_pool
+    print(f"🛠 Crawler worker {WORKER_ID} starting...")
+    try:
+        await create_db_pool()
+        await init_db()
+        await load_known_links()
+        await load_rejected_links()
+        await ensure_source_jobs()
     except Exception as e:
         print(f"❌ CRITICAL DB ERROR: {e}")
         return
-    print("🤖 Starting Bot and Parser...")
-    asyncio.create_task(parser_loop())
-    await dp.start_polling(bot)
+    if os.path.exists(GOOGLE_KEY_FILE):
+        sheets_sink = SheetsSink(GOOGLE_KEY_FILE, GOOGLE_SHEET_NAME)
+        sheets_sink.start()
+    metrics_runner = await start_metrics_server()
+    wakeup = asyncio.Event()
+    browser_pool = BrowserPool()
+    try:
+        await asyncio.gather(
+            listen_forever({JOBS_CHANNEL: lambda payload: wakeup.set()}),
+            job_reaper_loop(),
+            detail_job_loop(browser_pool, wakeup),
+            *(source_job_loop(browser_pool) for _ in range(WORKER_SOURCE_SLOTS)),
+        )
+    finally:
+        await browser_pool.close()
+        if sheets_sink: await asyncio.get_running_loop().run_in_executor(None, sheets_sink.stop)
+        if metrics_runner: await metrics_runner.cleanup()
+        await close_http_session()
+        await close_db_pool()
 
 if __name__ == "__main__":
-    try: asyncio.run(main())
+    try: asyncio.run(worker_main() if PROCESS_ROLE == "worker" else main())
     except (KeyboardInterrupt, SystemExit): print("Bot stopped!")
\ No newline at end of file
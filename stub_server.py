@@ -0,0 +1,48 @@
+"""
+Локальная заглушка JSON API площадок для проверки HTTP fast path без сети.
+
+Отдает записанные ответы из fixtures/api/<name>.json с постраничной нарезкой
+по полям from/to (как делает настоящий API).
+
+Запуск:
+    python stub_server.py --port 8081
+    ETENDER_API_URL=http://127.0.0.1:8081/etender XARID_API_URL=http://127.0.0.1:8081/xarid python main.py
+
+Любой другой путь отвечает HTML-страницей - так проверяется откат на Playwright.
+"""
+import argparse
+import json
+import os
+
+from aiohttp import web
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "api")
+
+def load_fixture(name):
+    path = os.path.join(FIXTURES_DIR, f"{name}.json")
+    if not os.path.exists(path): return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+async def handle_listing(request):
+    rows = load_fixture(request.match_info["name"])
+    if rows is None:
+        return web.Response(text="<html><body>Not an API</body></html>", content_type="text/html")
+    try: body = await request.json()
+    except ValueError: body = {}
+    params = {**request.query, **body}
+    start = max(int(params.get("from", 1)), 1)
+    end = int(params.get("to", len(rows)))
+    return web.json_response({"data": rows[start - 1:end], "total": len(rows)})
+
+def make_app():
+    app = web.Application()
+    app.router.add_route("*", "/{name}", handle_listing)
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub JSON API for Etender/Xarid")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    web.run_app(make_app(), host=args.host, port=args.port)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:offline")
+os.environ.setdefault("CRAWL_START_INTERVAL", "0")
+os.environ.setdefault("CRAWL_MIN_INTERVAL", "0")
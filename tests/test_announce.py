@@ -0,0 +1,77 @@
+"""Новые лоты от воркеров: ни один не теряется при старте и обрыве LISTEN и не объявляется дважды."""
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+main = pytest.importorskip("main")
+
+T0 = datetime(2026, 10, 17, 12, 0)
+
+
+class FakeDB:
+    def __init__(self):
+        self.now = T0
+        self.rows = []
+
+    def add(self, tender_id, added):
+        self.rows.append({"id": tender_id, "date_added": added, "source": "Etender", "title": f"Лот {tender_id}",
+                          "link": f"https://etender.uzex.uz/lot/{tender_id}"})
+
+    async def fetchval(self, sql):
+        return self.now
+
+    async def fetch(self, sql, arg):
+        if "id = ANY" in sql: return [r for r in self.rows if r["id"] in arg]
+        return [r for r in self.rows if r["date_added"] >= arg]
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake, told = FakeDB(), []
+
+    async def notify(source, title, link, fields):
+        told.append(fields["id"])
+
+    monkeypatch.setattr(main, "db_pool", fake)
+    monkeypatch.setattr(main, "announced_until", None)
+    monkeypatch.setattr(main, "announced_ids", {})
+    monkeypatch.setattr(main, "is_leader", True)
+    monkeypatch.setattr(main, "notify_subscribers", notify)
+    monkeypatch.setattr(main, "remember_link", lambda link: None)
+    fake.told = told
+    return fake
+
+
+def test_late_commit_with_lower_id_is_caught_up(db):
+    async def scenario():
+        db.add(1, T0 - timedelta(minutes=1))
+        await main.announce_tenders()                 # Старт: лот 1 уже был
+        db.add(3, T0 + timedelta(seconds=5))
+        await main.announce_tenders([3])              # NOTIFY
+        db.add(2, T0 + timedelta(seconds=4))          # Начат раньше 3, закоммичен позже, NOTIFY потерян
+        db.now = T0 + timedelta(seconds=30)
+        await main.announce_tenders()                 # Догон после обрыва LISTEN
+        await main.announce_tenders()
+    asyncio.run(scenario())
+    assert db.told == [3, 2]
+
+
+def test_notify_before_first_catch_up_is_announced(db, monkeypatch):
+    async def fake_listen(channels, on_connect=None):
+        # Снимок уже снят до LISTEN; лот, о котором пришел NOTIFY, добавлен после него
+        assert main.announced_until is not None
+        db.add(5, T0 + timedelta(seconds=1))
+        channels[main.TENDERS_CHANNEL]("5")
+        await on_connect()
+        await asyncio.sleep(0.05)
+
+    monkeypatch.setattr(main, "listen_forever", fake_listen)
+    db.add(4, T0 - timedelta(seconds=10))
+    asyncio.run(main.tender_listener())
+    assert db.told == [5]
@@ -0,0 +1,72 @@
+"""Буфер карточек должен забывать лоты, которые пользователь пролистал на другом экземпляре бота."""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+main = pytest.importorskip("main")
+
+
+@pytest.fixture
+def buffer():
+    buf = main.CardBuffer()
+    buf.new_cards.extend((i, f"card {i}") for i in (11, 12, 13))
+    buf.old_cards.extend((i, f"card {i}") for i in (9, 8))
+    buf.high_id, buf.low_id = 13, 8
+    main.card_buffers[(1, "Etender")] = buf
+    yield buf
+    main.card_buffers.pop((1, "Etender"), None)
+
+
+def lot(tender_id):
+    return {"id": tender_id, "title": f"Лот №{tender_id}", "link": f"https://etender.uzex.uz/lot/{tender_id}",
+            **dict.fromkeys(main.TENDER_FIELDS), "start_at": datetime(2026, 1, 1, tzinfo=timezone.utc)}
+
+
+def test_seen_range_is_dropped_from_buffer(buffer):
+    # На другом экземпляре пользователь дошел до 12, а вглубь - до 9
+    main.forget_seen_cards(1, "Etender", 12, 9)
+    assert [card[0] for card in buffer.new_cards + buffer.old_cards] == [13, 8]
+    assert (buffer.high_id, buffer.low_id) == (13, 8)
+
+
+def test_cursor_moves_past_range_seen_elsewhere(buffer):
+    main.forget_seen_cards(1, "Etender", 20, 3)
+    assert not buffer.new_cards and not buffer.old_cards
+    assert (buffer.high_id, buffer.low_id) == (20, 3)
+
+
+def test_other_users_are_untouched(buffer):
+    main.forget_seen_cards(2, "Etender", 20, 3)
+    assert len(buffer.new_cards + buffer.old_cards) == 5
+
+
+def test_new_lot_goes_after_new_cards_not_history(buffer):
+    buffer.new_done = True
+    main.offer_new_lot("Etender", lot(14))
+    main.offer_new_lot("Etender", lot(14))  # тот же лот из NOTIFY и догона
+    assert [card[0] for card in buffer.new_cards] == [11, 12, 13, 14]
+    assert [card[0] for card in buffer.old_cards] == [9, 8]
+    assert buffer.high_id == 14
+
+
+def test_new_lot_is_left_to_refill_until_new_lots_are_caught_up(buffer):
+    # В БД еще есть новые лоты между 13 и 14: дописав 14, курсор перепрыгнул бы их
+    main.offer_new_lot("Etender", lot(14))
+    assert [card[0] for card in buffer.new_cards] == [11, 12, 13]
+    assert buffer.high_id == 13
+
+
+def test_failed_refill_is_logged(buffer, monkeypatch, capsys):
+    async def broken(*args):
+        raise RuntimeError("db down")
+    monkeypatch.setattr(main, "fetch_tender_batch", broken)
+    buffer.old_cards.clear()  # после выдачи останется меньше PREFETCH_LOW_WATER - пойдет фоновая дозагрузка
+
+    async def run():
+        await main.next_card(1, "Etender")
+        await asyncio.gather(*main.background_tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+    asyncio.run(run())
+    assert not main.background_tasks
+    assert "Card prefetch error: db down" in capsys.readouterr().out
@@ -0,0 +1,17 @@
+"""Лимитер темпа общий на поддомены uzex.uz, остальные хосты - каждый со своим."""
+import pytest
+
+main = pytest.importorskip("main")
+
+
+@pytest.mark.parametrize("url, site", [
+    ("https://etender.uzex.uz/lots/1/0", "uzex.uz"),
+    ("https://apietender.uzex.uz/api/common/GetLots", "uzex.uz"),
+    ("https://xarid.uzex.uz/auction", "uzex.uz"),
+    ("https://it-market.uz/order/", "it-market.uz"),
+    ("http://127.0.0.1:8081/etender", "127.0.0.1"),
+    ("http://10.0.0.1:8081/xarid", "10.0.0.1"),
+    ("http://localhost:8081/xarid", "localhost"),
+])
+def test_site_key(url, site):
+    assert main.crawl_limiter(url) is main.crawl_limiters[site]
@@ -0,0 +1,84 @@
+"""Отметка CrawlState двигается, только если проход прочитал список до старой отметки или до конца."""
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import pytest
+
+main = pytest.importorskip("main")
+
+
+class FakeConn:
+    def __init__(self, saved):
+        self.saved = saved
+
+    async def execute(self, sql, source, newest_lot_id, newest_link, backfilled):
+        self.saved.append((newest_lot_id, backfilled))
+
+
+class FakePool:
+    def __init__(self):
+        self.saved = []
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield FakeConn(self.saved)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(main, "db_pool", pool)
+    monkeypatch.setattr(main, "MAX_PAGES_PER_RUN", 3)
+    return pool.saved
+
+
+def page(*ids):
+    return [(i, f"https://example.uz/lot/{i}") for i in ids]
+
+
+def normal_state():
+    return main.CrawlState("Etender", 100, "https://example.uz/lot/100", datetime.now(timezone.utc))
+
+
+def test_pass_broken_before_mark_keeps_old_mark(db):
+    state = normal_state()
+    assert not state.observe(page(130, 129, 128))  # Стр. 1 новее отметки, на стр. 2 пагинация упала
+    asyncio.run(state.save())
+    assert db == []
+
+
+def test_pass_reaching_mark_advances(db):
+    state = normal_state()
+    state.observe(page(130, 129, 128))
+    assert state.observe(page(101, 100, 99))
+    asyncio.run(state.save())
+    assert db == [(130, False)]
+
+
+def test_listing_end_advances(db):
+    state = normal_state()
+    state.observe(page(130, 129))
+    state.finish()
+    asyncio.run(state.save())
+    assert db == [(130, False)]
+
+
+def test_deep_pass_stamps_backfill_only_when_complete(db):
+    broken = main.CrawlState("Etender", 100, "https://example.uz/lot/100", None)
+    assert broken.deep
+    broken.observe(page(130, 129))
+    asyncio.run(broken.save())
+    assert db == []
+
+    full = main.CrawlState("Etender", 100, "https://example.uz/lot/100", None)
+    for ids in ((130, 129), (101, 100), (99, 98)): assert not full.observe(page(*ids))
+    asyncio.run(full.save())
+    assert db == [(130, True)]
+
+
+def test_deep_pass_broken_after_mark_advances_without_backfill(db):
+    state = main.CrawlState("Etender", 100, "https://example.uz/lot/100", None)
+    state.observe(page(130, 101, 100))
+    asyncio.run(state.save())
+    assert db == [(130, False)]
@@ -0,0 +1,68 @@
+"""Лот Etender, который не удалось загрузить, не должен попадать в кэш отказов."""
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+main = pytest.importorskip("main")
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.headers = {}
+
+
+class FakePage:
+    def __init__(self, status, rendered):
+        self.status, self.rendered = status, rendered
+
+    async def goto(self, url, **kwargs):
+        return FakeResponse(self.status)
+
+    async def wait_for_selector(self, selector, **kwargs):
+        if not self.rendered: raise TimeoutError(selector)
+
+
+class FakePool:
+    def __init__(self, page):
+        self._page = page
+
+    @asynccontextmanager
+    async def page(self):
+        yield self._page
+
+
+def run_lot(monkeypatch, status, rendered, toifa_parsed=True, toifa="Продукты питания"):
+    rejected = []
+
+    async def fake_details(page, link):
+        return {"toifa": toifa if toifa_parsed else "Тендер", "toifa_parsed": toifa_parsed,
+                "start_price_raw": "0", "currency": "UZS"}
+
+    async def fake_remember(source, items):
+        rejected.extend(items)
+
+    monkeypatch.setattr(main, "get_etender_details", fake_details)
+    monkeypatch.setattr(main, "remember_rejections", fake_remember)
+    link = "https://etender.uzex.uz/lot/123"
+    result = asyncio.run(main.process_etender_lot(FakePool(FakePage(status, rendered)), link))
+    return result, rejected
+
+
+def test_server_error_is_not_cached(monkeypatch):
+    assert run_lot(monkeypatch, 503, rendered=True) == (None, [])
+
+
+def test_render_timeout_is_not_cached(monkeypatch):
+    assert run_lot(monkeypatch, 200, rendered=False) == (None, [])
+
+
+def test_missing_toifa_cell_is_not_cached(monkeypatch):
+    assert run_lot(monkeypatch, 200, rendered=True, toifa_parsed=False) == (None, [])
+
+
+def test_loaded_lot_with_foreign_category_is_cached(monkeypatch):
+    result, rejected = run_lot(monkeypatch, 200, rendered=True)
+    assert result is None
+    assert rejected == [("https://etender.uzex.uz/lot/123", "toifa")]
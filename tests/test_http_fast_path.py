@@ -0,0 +1,92 @@
+"""HTTP fast path против stub_server: листает fixtures/api, стоп на отметке CrawlState, HTML - откат на браузер."""
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import pytest
+
+main = pytest.importorskip("main")
+stub_server = pytest.importorskip("stub_server")
+web = pytest.importorskip("aiohttp.web")
+
+
+class FakeConn:
+    def __init__(self, db):
+        self.db = db
+
+    async def fetchrow(self, sql, source):
+        return self.db.state
+
+    async def execute(self, sql, source, newest_lot_id, newest_link, backfilled):
+        self.db.saved.append((newest_lot_id, backfilled))
+
+
+class FakePool:
+    def __init__(self):
+        self.state, self.saved = None, []
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield FakeConn(self)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(main, "db_pool", pool)
+    monkeypatch.setattr(main, "HTTP_PAGE_SIZE", 1)  # по лоту на страницу - есть что листать
+    monkeypatch.setattr(main, "MAX_PAGES_PER_RUN", 10)
+    return pool
+
+
+@pytest.fixture
+def processed(monkeypatch):
+    seen = []
+    async def filter_new_links(links): return links
+    async def process_lots(source, pool, payloads): seen.extend(p["link"] for p in payloads)
+    async def process_xarid_cards(pool, cards): seen.extend(main.xarid_lot_from_card(c)[0] for c in cards)
+    monkeypatch.setattr(main, "filter_new_links", filter_new_links)
+    monkeypatch.setattr(main, "process_lots", process_lots)
+    monkeypatch.setattr(main, "process_xarid_cards", process_xarid_cards)
+    return seen
+
+
+def run_against_stub(monkeypatch, parser, etender_path="etender", xarid_path="xarid"):
+    async def run():
+        runner = web.AppRunner(stub_server.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        base = f"http://127.0.0.1:{runner.addresses[0][1]}"
+        monkeypatch.setattr(main, "ETENDER_API_URL", f"{base}/{etender_path}")
+        monkeypatch.setattr(main, "XARID_API_URL", f"{base}/{xarid_path}")
+        try: return await parser(None)
+        finally:
+            await main.close_http_session()
+            await runner.cleanup()
+    return asyncio.run(run())
+
+
+def test_etender_stops_at_crawl_mark(db, processed, monkeypatch):
+    db.state = (2510468, "https://etender.uzex.uz/lot/2510468", datetime.now(timezone.utc))
+    assert run_against_stub(monkeypatch, main.parse_etender_http)
+    assert processed == ["https://etender.uzex.uz/lot/2510473", "https://etender.uzex.uz/lot/2510468"]
+    assert db.saved == [(2510473, False)]
+
+
+def test_etender_pages_to_listing_end(db, processed, monkeypatch):
+    assert run_against_stub(monkeypatch, main.parse_etender_http)
+    assert len(processed) == 3
+    assert db.saved == [(2510473, True)]  # Без отметки - глубокий проход, дошел до пустой страницы
+
+
+def test_xarid_stops_at_crawl_mark(db, processed, monkeypatch):
+    db.state = (26110384470, "https://xarid.uzex.uz/auction/detail/384470", datetime.now(timezone.utc))
+    assert run_against_stub(monkeypatch, main.parse_xarid_http)
+    assert processed == [26110384512, 26110384498, 26110384470]
+    assert db.saved == [(26110384512, False)]
+
+
+@pytest.mark.parametrize("parser", ["parse_etender_http", "parse_xarid_http"])
+def test_html_on_first_page_falls_back_to_browser(db, processed, monkeypatch, parser):
+    assert run_against_stub(monkeypatch, getattr(main, parser), etender_path="lots", xarid_path="auction") is False
+    assert processed == [] and db.saved == []
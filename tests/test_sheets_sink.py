@@ -0,0 +1,43 @@
+"""SheetsSink не должен терять строки на временных ошибках, но и не копить их бесконечно."""
+import pytest
+
+main = pytest.importorskip("main")
+
+
+class FlakyWorksheet:
+    def __init__(self, failures):
+        self.failures = failures
+        self.rows = []
+
+    def append_rows(self, rows, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("connection reset")
+        self.rows.extend(rows)
+
+
+def make_sink(monkeypatch, worksheet, retries=2, requeues=1):
+    monkeypatch.setattr(main, "SHEETS_MAX_RETRIES", retries)
+    monkeypatch.setattr(main, "SHEETS_MAX_REQUEUES", requeues)
+    sink = main.SheetsSink("key.json", "sheet", retry_delay=0)
+    monkeypatch.setattr(sink, "_worksheet", lambda source_name: worksheet)
+    return sink
+
+
+def test_network_error_is_retried(monkeypatch):
+    worksheet = FlakyWorksheet(failures=1)
+    sink = make_sink(monkeypatch, worksheet)
+    sink.add("Etender", ["a", 1.0])
+    sink._flush_all()
+    assert worksheet.rows == [["a", 1]]
+
+
+def test_rows_are_requeued_then_dropped(monkeypatch):
+    worksheet = FlakyWorksheet(failures=100)
+    sink = make_sink(monkeypatch, worksheet)
+    sink.add("Etender", ["a"])
+    sink._flush_all()
+    assert sink._buffers["Etender"] == [["a"]]  # Первый неудачный сброс - строки вернулись в буфер
+    sink._flush_all()
+    assert not sink._buffers["Etender"]  # Лимит сбросов исчерпан - пачку отбросили
+    assert worksheet.rows == []
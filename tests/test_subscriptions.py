@@ -0,0 +1,70 @@
+"""Инвертированный индекс подписок должен находить ровно то же, что перебор Subscription.matches()."""
+import random
+from decimal import Decimal
+
+import pytest
+
+main = pytest.importorskip("main")
+
+WORDS = [
+    "ноут", "ноутбук", "ноутбуки", "сервер", "серверов", "видеонаблюдение", "наблюдение", "камера",
+    "1с", "it", "по", "программное", "обеспечение", "kompyuter", "kompyuterlar", "принтер", "картридж",
+    "ташкент", "ташкентская", "самарканд", "toshkent", "sh", "монитор", "мони", "связь", "кабель",
+]
+SOURCES = ["Xarid.uz", "Etender", "IT-Market"]
+
+def random_phrase(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.choice((1, 1, 1, 2)))]
+    phrase = " ".join(words)
+    # Кусок слова - подстрока, которую matches() найдет внутри более длинного слова
+    if rng.random() < 0.2 and len(phrase) > 3:
+        start = rng.randrange(len(phrase) - 2)
+        phrase = phrase[start:start + rng.randint(2, 8)].strip() or phrase
+    return phrase
+
+def random_subscription(rng, sub_id):
+    spec = {"keywords": [], "regions": [], "min_amount": None, "max_amount": None, "source": None}
+    if rng.random() < 0.8: spec["keywords"] = [random_phrase(rng) for _ in range(rng.randint(1, 3))]
+    if rng.random() < 0.3: spec["regions"] = [rng.choice(["ташкент", "самарканд", "toshkent", "ташкентская", "сам"])]
+    if rng.random() < 0.3: spec["source"] = rng.choice(SOURCES)
+    if rng.random() < 0.2: spec["min_amount"] = Decimal(rng.choice([0, 1000000, 50000000]))
+    if rng.random() < 0.2: spec["max_amount"] = Decimal(rng.choice([10000000, 100000000]))
+    return main.Subscription(id=sub_id, user_id=1000 + sub_id, **spec)
+
+def random_lot(rng):
+    return {
+        "source": rng.choice(SOURCES),
+        "text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 12))),
+        "region": rng.choice(["", "г. ташкент", "ташкентская область", "самарканд", "toshkent shahri"]),
+        "amount": rng.choice([None, Decimal(500000), Decimal(20000000), Decimal(200000000)]),
+        "currency": rng.choice(["UZS", "UZS", "USD"]),
+    }
+
+def brute_force(subs, lot):
+    return {s.user_id for s in subs if s.matches(lot)}
+
+def test_index_matches_brute_force():
+    rng = random.Random(16)
+    index = main.SubscriptionIndex()
+    subs = [random_subscription(rng, i) for i in range(400)]
+    for sub in subs: index.add(sub)
+    for _ in range(2000):
+        lot = random_lot(rng)
+        assert index.match(lot) == brute_force(subs, lot), lot
+
+    # После удаления половины подписок индекс по-прежнему совпадает с перебором
+    for sub in subs[::2]: assert index.remove(sub.id)
+    left = subs[1::2]
+    for _ in range(1000):
+        lot = random_lot(rng)
+        assert index.match(lot) == brute_force(left, lot), lot
+
+def test_short_and_infix_keywords():
+    index = main.SubscriptionIndex()
+    index.add(main.Subscription(id=1, user_id=100, keywords=["ноут"]))
+    index.add(main.Subscription(id=2, user_id=101, keywords=["наблюдение"]))
+    index.add(main.Subscription(id=3, user_id=102, keywords=["1с"]))
+    lot = {"source": "Etender", "text": "ноутбуки и система видеонаблюдения, 1с", "region": "", "amount": None, "currency": "UZS"}
+    assert index.match(lot) == {100, 102}
+    lot["text"] = "монтаж системы видеонаблюдение"
+    assert index.match(lot) == {101}
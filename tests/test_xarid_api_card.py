@@ -0,0 +1,33 @@
+"""Карточка из JSON API Xarid должна разбираться тем же фильтром, что и карточка со страницы."""
+import pytest
+
+main = pytest.importorskip("main")
+
+ROW = {
+    "lot_id": 26110012345,
+    "category_name": "Оборудование компьютерное, электронное и оптическое",
+    "name": "Поставка ноутбуков",
+    "start_cost": 8000000,
+    "cost": 7500000.5,
+    "end_date": "2026-10-20T11:00:00",
+    "region": "г. Ташкент",
+}
+
+
+def test_prices_do_not_absorb_following_fields():
+    candidate, reason = main.xarid_candidate_from_card(main.xarid_card_from_row(ROW))
+    assert reason is None
+    _, _, lot_id, start_raw, current_raw, start_num, link = candidate
+    assert lot_id == "26110012345"
+    assert start_num == 8000000
+    assert main.parse_price_to_number(current_raw) == 7500000.5
+    assert link.endswith("/012345")
+
+
+@pytest.mark.parametrize("raw, expected", [(8000000, "8000000.00"), ("8 000 000,00", "8000000.00"), (1.5e7, "15000000.00")])
+def test_row_price_is_plain_number(raw, expected):
+    assert main.xarid_row_price(raw) == expected
+
+
+def test_current_amount_from_api_card():
+    assert main.xarid_current_amount(main.xarid_card_from_row(ROW)) == main.to_amount(7500000.5)